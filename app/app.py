@@ -3,6 +3,8 @@ from flask import Flask
 from dotenv import load_dotenv
 
 from .tasks import start_worker_threads
+from .core.reindex import start_background_reindex
+from .services.suggest_index import suggest_index
 from .blueprints.main import main_bp
 from .blueprints.upload import upload_bp
 from .blueprints.search import search_bp
@@ -41,5 +43,9 @@ def create_app():
     # --- 启动后台任务 ---
     with app.app_context():
         start_worker_threads()
+        # EMBEDDING_MODEL 变化后在后台重建向量集合，期间搜索继续使用旧集合
+        start_background_reindex()
+        # 搜索建议索引从磁盘上的章节摘要构建，之后随入库、删除、重命名增量更新
+        suggest_index.start_rebuild()
 
     return app
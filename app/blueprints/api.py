@@ -1,16 +1,44 @@
+import os
 import json
 import time
-from flask import Blueprint, jsonify, Response, stream_with_context, render_template
-from ..tasks import get_all_statuses, processing_statuses
+import re
+from flask import Blueprint, jsonify, Response, stream_with_context, render_template, request, redirect, url_for, flash
+from ..tasks import (get_all_statuses, processing_statuses, read_stream_updates, wait_for_task_update, FINAL_STATUSES,
+                     cancel_task, pause_task, resume_task)
 from app.utils.logger import logger
+from app.utils.metrics import render_metrics
+from app.utils import tracing
 
 api_bp = Blueprint('api', __name__)
 
+# 无新输出时发送 SSE 注释保活的间隔；唤醒后再等待片刻以便把同一批突发的块合并进一个帧
+STREAM_KEEPALIVE_SECONDS = float(os.getenv('STREAM_KEEPALIVE_SECONDS', 15))
+STREAM_COALESCE_SECONDS = float(os.getenv('STREAM_COALESCE_SECONDS', 0.05))
+
 @api_bp.route('/processing')
 def processing_status():
     """显示文件处理状态的页面。"""
     statuses = get_all_statuses()
-    return render_template('processing.html', statuses=statuses)
+    return render_template('processing.html', statuses=statuses, trace_enabled=tracing.is_enabled(), final_statuses=FINAL_STATUSES)
+
+@api_bp.route('/processing/trace', methods=['POST'])
+def toggle_tracing():
+    """开启或关闭本进程的任务时间线追踪。"""
+    enabled = request.form.get('enabled') == '1'
+    tracing.set_enabled(enabled)
+    flash('任务追踪已开启，之后运行的阶段会被记录。' if enabled else '任务追踪已关闭。', 'success')
+    return redirect(url_for('api.processing_status'))
+
+@api_bp.route('/api/trace/<path:task_id>')
+def download_trace(task_id):
+    """下载任务的 Chrome / Perfetto 追踪 JSON。"""
+    trace = tracing.export_trace(task_id)
+    if trace is None:
+        return jsonify({'error': '该任务没有追踪记录（需要在任务运行前开启追踪）。'}), 404
+    response = Response(json.dumps(trace, ensure_ascii=False), mimetype='application/json')
+    filename = re.sub(r'[^\w.-]', '_', task_id)
+    response.headers['Content-Disposition'] = f'attachment; filename="trace-{filename}.json"'
+    return response
 
 @api_bp.route('/api/processing-status')
 def api_processing_status():
@@ -22,78 +50,93 @@ def api_processing_status():
         serializable_statuses.append(serializable_task)
     return jsonify(serializable_statuses)
 
+_TASK_ACTIONS = {'cancel': cancel_task, 'pause': pause_task, 'resume': resume_task}
+
+@api_bp.route('/api/tasks/<path:task_id>/<action>', methods=['POST'])
+def control_task(task_id, action):
+    """取消、暂停或恢复任务。"""
+    handler = _TASK_ACTIONS.get(action)
+    if handler is None:
+        return jsonify({'error': f'未知操作: {action}'}), 400
+    if not handler(task_id):
+        return jsonify({'error': '任务不存在或已结束'}), 404
+    return jsonify({'task_id': task_id, 'action': action})
+
 @api_bp.route('/stream-ai/<task_id>')
 def stream_ai(task_id):
+    """以 SSE 推送任务的 AI 流式输出。
+
+    连接在任务通知通道上阻塞等待，没有新输出时不占用 CPU；每次唤醒把积压的块合并为一个
+    JSON 数组帧发送，同一流的连续文本块合并为一条。
+    """
     def generate():
         if task_id not in processing_statuses:
-            error_data = json.dumps({"stream_id": "error", "content": f"错误：未找到任务ID {task_id}"})
+            error_data = json.dumps([{"stream_id": "error", "content": f"错误：未找到任务ID {task_id}"}])
             yield f"data: {error_data}\n\n"
             return
 
-        task_status = processing_statuses.get(task_id)
-        if not task_status:
+        sent_positions = {}
+        version, chunks, status = read_stream_updates(task_id, sent_positions)
+        if status is None:
             return
 
-        finished_stream_ids = set()
-        if 'stream_buffers' in task_status:
-            for stream_id, buffer in task_status['stream_buffers'].items():
-                if any(isinstance(item, dict) and item.get('type') == 'stream_end' for item in buffer):
-                    finished_stream_ids.add(stream_id)
-
-        if 'stream_buffers' in task_status:
-            for stream_id, buffer in task_status['stream_buffers'].items():
-                if stream_id in finished_stream_ids:
-                    continue
-                
-                if buffer:
-                    history_content = "".join([item for item in buffer if isinstance(item, str)])
-                    if history_content:
-                        data = json.dumps({"stream_id": stream_id, "content": history_content, "is_history": True})
-                        yield f"data: {data}\n\n"
-        
-        known_stream_ids = set(task_status.get('stream_buffers', {}).keys())
-        sent_positions = {stream_id: len(buffer) for stream_id, buffer in task_status.get('stream_buffers', {}).items()}
+        # 首帧：未结束的流以完整历史内容替换显示，已结束的流不再发送
+        finished_stream_ids = {stream_id for stream_id, chunk in chunks if isinstance(chunk, dict) and chunk.get('type') == 'stream_end'}
+        history = {}
+        for stream_id, chunk in chunks:
+            if stream_id in finished_stream_ids:
+                continue
+            if isinstance(chunk, str):
+                history[stream_id] = history.get(stream_id, '') + chunk
+            elif chunk.get('type') == 'stream_reset':
+                # 请求重试前的输出已作废
+                history[stream_id] = ''
+        if history:
+            frame = [{"stream_id": stream_id, "content": content, "is_history": True} for stream_id, content in history.items()]
+            yield f"data: {json.dumps(frame)}\n\n"
 
         try:
-            while True:
-                task_status = processing_statuses.get(task_id)
-                if not task_status:
-                    break
-
-                current_stream_ids = set(task_status.get('stream_buffers', {}).keys())
-                new_streams = current_stream_ids - known_stream_ids
-                if new_streams:
-                    for stream_id in new_streams:
-                        known_stream_ids.add(stream_id)
-                        sent_positions[stream_id] = 0
-
-                has_data = False
-                for stream_id in list(known_stream_ids):
-                    buffer = task_status.get('stream_buffers', {}).get(stream_id)
-                    if buffer:
-                        current_pos = sent_positions.get(stream_id, 0)
-                        if len(buffer) > current_pos:
-                            new_chunks = list(buffer)[current_pos:]
-                            for chunk in new_chunks:
-                                if isinstance(chunk, dict):
-                                    data = json.dumps(chunk)
-                                else:
-                                    data = json.dumps({"stream_id": stream_id, "content": chunk})
-                                yield f"data: {data}\n\n"
-                                has_data = True
-                            sent_positions[stream_id] = len(buffer)
-                
-                if task_status['status'] in ['完成', '失败']:
+            while status not in FINAL_STATUSES:
+                new_version = wait_for_task_update(task_id, version, STREAM_KEEPALIVE_SECONDS)
+                if new_version == version:
+                    yield ": keepalive\n\n"
+                    continue
+                if STREAM_COALESCE_SECONDS > 0:
+                    time.sleep(STREAM_COALESCE_SECONDS)
+                version, chunks, status = read_stream_updates(task_id, sent_positions)
+                if status is None:
                     break
-                
-                if not has_data:
-                    time.sleep(0.1)
+                frame = _coalesce_chunks(chunks)
+                if frame:
+                    yield f"data: {json.dumps(frame)}\n\n"
 
             yield "event: close\ndata: Task finished\n\n"
 
         except Exception as e:
             logger.error(f"流式传输 AI 输出时出错: {e}", exc_info=True)
-            error_data = json.dumps({"stream_id": "error", "content": f"发生内部错误: {e}"})
+            error_data = json.dumps([{"stream_id": "error", "content": f"发生内部错误: {e}"}])
             yield f"data: {error_data}\n\n"
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _coalesce_chunks(chunks):
+    """把 [(流ID, 块)] 转换为一个 SSE 帧的消息列表，同一流相邻的文本块合并为一条。"""
+    frame, text = [], None
+    for stream_id, chunk in chunks:
+        if isinstance(chunk, dict):
+            frame.append(chunk)
+            text = None
+        elif text is not None and text['stream_id'] == stream_id:
+            text['content'] += chunk
+        else:
+            text = {"stream_id": stream_id, "content": chunk}
+            frame.append(text)
+    return frame
+
+@api_bp.route('/metrics')
+def metrics():
+    """以 Prometheus 文本格式导出处理流水线和搜索指标。"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,15 @@
 import os
-from flask import Blueprint, render_template, send_from_directory
+import json
+from flask import Blueprint, render_template, send_from_directory, send_file, request, Response, stream_with_context
+
+from ..utils.logger import LOG_FILE, task_log_path
+from ..utils.log_reader import tail_log, follow_log
 
 main_bp = Blueprint('main', __name__)
 
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+MAX_TAIL_LINES = 5000
+
 @main_bp.route('/')
 def index():
     """主页路由，显示搜索界面。"""
@@ -10,15 +17,50 @@ def index():
 
 @main_bp.route('/logs')
 def logs():
-    """显示处理日志页面。"""
-    log_file_path = 'logs/processing.log'
-    log_content = "日志文件不存在或为空。"
-    if os.path.exists(log_file_path):
-        with open(log_file_path, 'r', encoding='utf-8') as f:
-            # 读取文件末尾的 1000 行
-            lines = f.readlines()
-            log_content = "".join(lines[-1000:])
-    return render_template('logs.html', log_content=log_content)
+    """显示处理日志页面。只反向读取文件末尾所需的部分，支持按任务ID和日志级别过滤。"""
+    task_id = request.args.get('task_id', '').strip() or None
+    level = request.args.get('level', '').strip().upper() or None
+    lines = min(request.args.get('lines', 1000, type=int) or 1000, MAX_TAIL_LINES)
+
+    # 若存在任务专属日志，则直接读取它，无需扫描全局日志
+    log_file = LOG_FILE
+    has_task_log = bool(task_id) and os.path.exists(task_log_path(task_id))
+    if has_task_log:
+        log_file = task_log_path(task_id)
+
+    records = tail_log(log_file, max_lines=lines, task_id=task_id, level=level)
+    log_content = "\n".join(records) if records else "日志文件不存在或为空。"
+    return render_template('logs.html', log_content=log_content, task_id=task_id or '', level=level or '',
+                           lines=lines, log_levels=LOG_LEVELS, log_file=log_file, has_task_log=has_task_log)
+
+@main_bp.route('/logs/task/<path:task_id>')
+def task_log(task_id):
+    """下载单个任务的结构化（JSONL）日志文件。"""
+    path = task_log_path(task_id)
+    if not os.path.exists(path):
+        return "未找到该任务的日志文件（需开启 LOG_PER_TASK）", 404
+    return send_file(os.path.abspath(path), mimetype='application/x-ndjson', as_attachment=True,
+                     download_name=os.path.basename(path))
+
+@main_bp.route('/logs/stream')
+def logs_stream():
+    """以 SSE 方式推送日志文件中新追加的行，过滤条件与 /logs 相同。"""
+    task_id = request.args.get('task_id', '').strip() or None
+    level = request.args.get('level', '').strip().upper() or None
+
+    def generate():
+        idle_polls = 0
+        for line in follow_log(LOG_FILE, task_id=task_id, level=level):
+            if line is None:
+                idle_polls += 1
+                # 定期发送注释行作为心跳，以便尽快发现客户端断开
+                if idle_polls % 30 == 0:
+                    yield ": keep-alive\n\n"
+                continue
+            idle_polls = 0
+            yield f"data: {json.dumps({'line': line}, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
 @main_bp.route('/comic_cover/<comic_hash>')
 def comic_cover(comic_hash):
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
+import os
+import mimetypes
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, Response
 from ..models import (
     get_all_comics_info, delete_comic, update_comic_info, get_comic_details,
     delete_chapter, rename_chapter, get_comic_image_from_fs
 )
-from ..tasks import processing_statuses
+from ..tasks import processing_statuses, cancel_comic_tasks
+from ..services.page_store import PageRange
+from ..core.resummarize import resummarize_comic
 
 manage_bp = Blueprint('manage', __name__)
 
@@ -15,7 +19,11 @@ def manage_data():
 
 @manage_bp.route('/delete_comic/<comic_hash>', methods=['POST'])
 def delete_comic_route(comic_hash):
-    """删除指定漫画的路由。"""
+    """删除指定漫画的路由。正在处理该漫画的任务会先被取消，避免其继续写入已删除的目录。"""
+    still_running = cancel_comic_tasks(comic_hash)
+    if still_running:
+        flash(f'漫画仍有 {len(still_running)} 个任务正在停止，请稍后再删除。', 'error')
+        return redirect(url_for('manage.manage_data'))
     success, message = delete_comic(comic_hash, processing_statuses)
     if success:
         flash(message, 'success')
@@ -53,6 +61,32 @@ def update_comic_route(comic_hash):
         flash(message, 'error')
     return redirect(url_for('manage.manage_data'))
 
+@manage_bp.route('/update_tags/<comic_hash>', methods=['POST'])
+def update_tags_route(comic_hash):
+    """更新漫画标签的路由。标签可用于限定搜索范围。"""
+    tags = []
+    for tag in request.form.get('tags', '').replace('，', ',').split(','):
+        tag = tag.strip()
+        if tag and tag not in tags:
+            tags.append(tag)
+
+    success, message = update_comic_info(comic_hash, {'tags': tags})
+    if success:
+        flash(message, 'success')
+    else:
+        flash(message, 'error')
+    return redirect(url_for('manage.comic_info', comic_hash=comic_hash))
+
+@manage_bp.route('/resummarize/<comic_hash>', methods=['POST'])
+def resummarize_route(comic_hash):
+    """用已保存的页面描述重新生成漫画中过期章节摘要的路由，不再调用视觉模型。"""
+    task_id = resummarize_comic(comic_hash, force=request.form.get('force') == '1')
+    if task_id:
+        flash('已加入重新摘要任务。', 'success')
+        return redirect(url_for('api.processing_status'))
+    flash('所有章节的摘要都是最新的。', 'success')
+    return redirect(url_for('manage.comic_info', comic_hash=comic_hash))
+
 @manage_bp.route('/comicinfo/<comic_hash>')
 def comic_info(comic_hash):
     """显示漫画详细信息的页面。"""
@@ -93,9 +127,11 @@ def rename_chapter_route(comic_hash, old_name):
 
 @manage_bp.route('/comic_image/<comic_hash>/<path:chapter_name>/<path:image_name>')
 def comic_image_route(comic_hash, chapter_name, image_name):
-    """提供章节内单张图片的路由。"""
-    image_io = get_comic_image_from_fs(comic_hash, chapter_name, image_name)
-    if image_io:
-        return send_file(image_io, mimetype='image/png')
-    else:
+    """提供章节内单张图片的路由。散文件交给 send_file，打包章节直接从映射内存分块发送。"""
+    page = get_comic_image_from_fs(comic_hash, chapter_name, image_name)
+    if page is None:
         return "Image not found", 404
+    mimetype = mimetypes.guess_type(image_name)[0] or 'application/octet-stream'
+    if isinstance(page, PageRange):
+        return Response(page.iter_chunks(), mimetype=mimetype, headers={'Content-Length': str(page.length)}, direct_passthrough=True)
+    return send_file(os.path.abspath(page), mimetype=mimetype)
@@ -1,13 +1,75 @@
-from flask import Blueprint, render_template, request
-from ..models import search_comics
+from datetime import datetime, timedelta
+from flask import Blueprint, render_template, request, flash, jsonify
+from ..models import search_comics, search_comics_by_image, get_comic_details
+from ..services.chroma_service import build_where
+from ..services.suggest_index import suggest_index
+from ..utils.logger import logger
 
 search_bp = Blueprint('search', __name__)
 
+def _parse_number(value):
+    return float(value) if value not in (None, '') else None
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+def _parse_scope(args):
+    """从查询参数解析搜索范围，返回 (where 条件, 回显到页面的范围参数)。"""
+    scope = {key: args.get(key, '').strip() for key in ('comic', 'chapter_from', 'chapter_to', 'ingested_after', 'ingested_before', 'tags')}
+    tags = [tag.strip() for tag in scope['tags'].replace('，', ',').split(',') if tag.strip()]
+    if any(c in tag for tag in tags for c in '"\'\\'):
+        raise ValueError('标签不能包含引号或反斜杠')
+    ingested_after = _parse_date(scope['ingested_after'])
+    ingested_before = _parse_date(scope['ingested_before'])
+    where = build_where(
+        comic_hash=scope['comic'] or None,
+        chapter_from=_parse_number(scope['chapter_from']),
+        chapter_to=_parse_number(scope['chapter_to']),
+        ingested_after=ingested_after.timestamp() if ingested_after else None,
+        # 截止日期包含当天
+        ingested_before=(ingested_before + timedelta(days=1)).timestamp() - 1 if ingested_before else None,
+        tags=tags,
+    )
+    return where, scope
+
 @search_bp.route('/search')
 def search():
-    """搜索结果路由。根据查询参数执行语义搜索并显示结果。"""
+    """搜索结果路由。根据查询参数执行语义搜索并显示结果，可限定漫画、章节范围、入库日期和标签。"""
     query = request.args.get('query', '')
+    try:
+        where, scope = _parse_scope(request.args)
+    except ValueError:
+        flash('搜索范围参数无效，已忽略。', 'error')
+        where, scope = None, {}
+    scoped_comic = None
+    if scope.get('comic'):
+        scoped_comic, _ = get_comic_details(scope['comic'])
     results = []
     if query:
-        results = search_comics(query)
-    return render_template('search.html', query=query, results=results)
+        results = search_comics(query, where=where)
+    return render_template('search.html', query=query, results=results, scope=scope, scoped_comic=scoped_comic)
+
+@search_bp.route('/api/suggest')
+def suggest():
+    """搜索框补全：返回以 q 开头的摘要关键词，按出现的章节数排序。只查内存索引，不调用 embedding。"""
+    prefix = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 50)
+    suggestions = suggest_index.suggest(prefix, limit)
+    return jsonify({'query': prefix, 'ready': suggest_index.ready,
+                    'suggestions': [{'term': term, 'chapters': count} for term, count in suggestions]})
+
+@search_bp.route('/search/image', methods=['GET', 'POST'])
+def image_search():
+    """以图搜图：上传截图，按感知哈希查找来源页面。"""
+    results = None
+    if request.method == 'POST':
+        file = request.files.get('image')
+        if not file or file.filename == '':
+            flash('未选择图片')
+        else:
+            try:
+                results = search_comics_by_image(file.stream)
+            except Exception as e:
+                logger.warning(f"以图搜图时无法读取上传的图片 '{file.filename}': {e}")
+                flash('无法识别上传的图片')
+    return render_template('image_search.html', results=results)
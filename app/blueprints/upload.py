@@ -1,36 +1,18 @@
 import os
-import zipfile
-import shutil
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+import re
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
 from werkzeug.utils import secure_filename
 
 from app.processing import process_comic
+from app.core.archive import supported_archive_extensions, get_comic_name
+from app.services.upload_service import create_upload, get_upload, append_chunk, complete_upload
 from app.utils.logger import logger
 
 upload_bp = Blueprint('upload', __name__)
 
-ALLOWED_EXTENSIONS = {'zip'}
-
 def allowed_file(filename):
-    """检查上传的文件扩展名是否在允许范围内"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def get_comic_name_from_zip(filepath):
-    """从ZIP文件中提取漫画名称。"""
-    temp_extract_path = filepath + '_temp_extract'
-    try:
-        with zipfile.ZipFile(filepath, 'r') as zip_ref:
-            zip_ref.extractall(temp_extract_path)
-        
-        extracted_items = os.listdir(temp_extract_path)
-        if len(extracted_items) == 1 and os.path.isdir(os.path.join(temp_extract_path, extracted_items[0])):
-            return extracted_items[0]
-        else:
-            return os.path.splitext(os.path.basename(filepath))[0]
-    finally:
-        if os.path.exists(temp_extract_path):
-            shutil.rmtree(temp_extract_path)
+    """检查上传的文件扩展名是否在允许范围内（ZIP/CBZ、tar 系列，安装 rarfile 后支持 CBR）。"""
+    return filename.lower().endswith(supported_archive_extensions())
 
 @upload_bp.route('/upload', methods=['GET', 'POST'])
 def upload_file():
@@ -65,7 +47,7 @@ def upload_file():
                     flash(f"保存文件 '{filename}' 时出错。")
                     continue
                 
-                comic_name = get_comic_name_from_zip(filepath)
+                comic_name = get_comic_name(filepath)
                 process_comic(filepath, comic_name)
                 uploaded_comics.append(comic_name)
         
@@ -75,4 +57,82 @@ def upload_file():
             flash('没有上传有效的文件。')
             
         return redirect(url_for('api.processing_status'))
-    return render_template('upload.html')
+    return render_template('upload.html', accept=','.join(supported_archive_extensions()))
+
+# --- 分块上传 API ---
+# 1. POST /upload/chunked                      {"filename", "size", 可选 "sha256", "auto_complete"} -> 创建会话
+# 2. PUT  /upload/chunked/<id>?offset=N         请求体为原始数据块，按偏移量追加
+#    GET  /upload/chunked/<id>                  查询已接收的偏移量，用于断线续传
+# 3. 最后一个数据块到达时自动完成（有 sha256 时先校验）并加入处理队列；
+#    auto_complete 为 false 时改由 POST /upload/chunked/<id>/complete {"sha256"} 校验后完成。
+#    complete 可重复调用，每次都会用传入的 sha256 比对已完成文件的哈希，不一致时返回 409
+
+def _enqueue_uploaded_comic(filepath, file_content_hash, filename):
+    comic_name = get_comic_name(filepath, filename)
+    task_id = process_comic(filepath, comic_name, file_content_hash)
+    if task_id is None:
+        # process_comic 已记录原因；抛出异常让 complete_upload 保留会话以便重试
+        raise RuntimeError('无法加入处理队列')
+    return {'comic_name': comic_name, 'task_id': task_id}
+
+def _finish_chunked_upload(upload_id, expected_sha256=None):
+    """完成上传并入队，返回 JSON 响应。入队失败时会话保持未完成，客户端稍后可再次确认。"""
+    try:
+        success, info = complete_upload(current_app.config['UPLOAD_FOLDER'], upload_id, expected_sha256,
+                                        on_complete=_enqueue_uploaded_comic)
+    except Exception as e:
+        logger.error(f"分块上传 {upload_id} 加入处理队列失败: {e}", exc_info=True)
+        return jsonify({'error': f'上传已接收，但加入处理队列失败：{e}'}), 500
+    if not success:
+        return jsonify({'error': info}), 409
+    return jsonify(info)
+
+@upload_bp.route('/upload/chunked', methods=['POST'])
+def chunked_upload_init():
+    """创建分块上传会话。"""
+    payload = request.get_json(silent=True) or {}
+    # 原始文件名只用于推断漫画名称，落盘时由 complete_upload 另行清理
+    filename = os.path.basename(str(payload.get('filename', '')).replace('\\', '/'))
+    size = payload.get('size')
+    expected_sha256 = payload.get('sha256')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': '不支持的文件格式'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': '文件大小无效'}), 400
+    if expected_sha256 is not None and not re.fullmatch(r'[0-9a-fA-F]{64}', str(expected_sha256)):
+        return jsonify({'error': 'sha256 格式无效'}), 400
+    return jsonify(create_upload(current_app.config['UPLOAD_FOLDER'], filename, size, expected_sha256,
+                                 auto_complete=payload.get('auto_complete', True) is not False)), 201
+
+@upload_bp.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """查询分块上传会话的进度。"""
+    info = get_upload(current_app.config['UPLOAD_FOLDER'], secure_filename(upload_id))
+    if info is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    return jsonify(info)
+
+@upload_bp.route('/upload/chunked/<upload_id>', methods=['PUT'])
+def chunked_upload_append(upload_id):
+    """追加一个数据块；最后一块写入后（除非创建时关闭了 auto_complete）立即完成上传并加入处理队列。"""
+    upload_id = secure_filename(upload_id)
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': '缺少 offset 参数'}), 400
+
+    success, result = append_chunk(current_app.config['UPLOAD_FOLDER'], upload_id, offset, request.stream)
+    if not success:
+        info = get_upload(current_app.config['UPLOAD_FOLDER'], upload_id)
+        if info is None:
+            return jsonify({'error': result}), 404
+        return jsonify(dict(info, error=result)), 409
+
+    if result['offset'] < result['size'] or not result['auto_complete']:
+        return jsonify(result)
+    return _finish_chunked_upload(upload_id)
+
+@upload_bp.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+def chunked_upload_complete(upload_id):
+    """确认上传完成，可选传入 sha256 进行校验。重复调用返回相同结果，但每次都会比对传入的 sha256。"""
+    payload = request.get_json(silent=True) or {}
+    return _finish_chunked_upload(secure_filename(upload_id), payload.get('sha256'))
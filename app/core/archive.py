@@ -0,0 +1,106 @@
+import os
+import hashlib
+import shutil
+import tarfile
+import zipfile
+
+from ..utils.logger import logger
+
+try:
+    import rarfile  # CBR/RAR 为可选支持，需要安装 rarfile 以及系统中的 unrar
+except ImportError:
+    rarfile = None
+
+ZIP_EXTENSIONS = ('.zip', '.cbz')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.cbt')
+RAR_EXTENSIONS = ('.rar', '.cbr')
+
+def supported_archive_extensions():
+    """当前环境可以解压的归档扩展名。"""
+    return ZIP_EXTENSIONS + TAR_EXTENSIONS + (RAR_EXTENSIONS if rarfile is not None else ())
+
+def is_supported_archive(path):
+    return path.lower().endswith(supported_archive_extensions())
+
+def _archive_stem(path):
+    name = os.path.basename(path)
+    lower = name.lower()
+    for ext in sorted(supported_archive_extensions() + RAR_EXTENSIONS, key=len, reverse=True):
+        if lower.endswith(ext):
+            return name[:-len(ext)]
+    return os.path.splitext(name)[0]
+
+def _member_names(path):
+    """列出归档内的条目名称（统一使用 / 作为分隔符），不解压内容。"""
+    lower = path.lower()
+    if lower.endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(path, 'r') as zf:
+            return zf.namelist()
+    if lower.endswith(TAR_EXTENSIONS):
+        with tarfile.open(path, 'r:*') as tf:
+            return [member.name + ('/' if member.isdir() else '') for member in tf.getmembers()]
+    if lower.endswith(RAR_EXTENSIONS) and rarfile is not None:
+        with rarfile.RarFile(path) as rf:
+            return [info.filename.replace('\\', '/') + ('/' if info.is_dir() else '') for info in rf.infolist()]
+    raise ValueError(f"不支持的文件格式: {path}")
+
+def get_comic_name(path, filename=None):
+    """推断漫画名称：目录使用目录名；归档内只有单个顶层目录时使用该目录名，否则使用文件名。
+
+    filename 为上传时的原始文件名，磁盘上的文件名被改写过（如分块上传）时用它代替 path 的文件名。
+    """
+    if os.path.isdir(path):
+        return os.path.basename(os.path.normpath(path))
+    names = [name[2:] if name.startswith('./') else name for name in _member_names(path)]
+    names = [name for name in names if name.strip('/')]
+    top_level = {name.split('/', 1)[0] for name in names}
+    if len(top_level) == 1 and all('/' in name for name in names):
+        return top_level.pop()
+    return _archive_stem(filename or path)
+
+def _update_file_digest(digest, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+
+def source_sha256(path):
+    """按块计算来源的 SHA-256，内存占用与大小无关。目录按相对路径排序后依次计入路径和文件内容。"""
+    digest = hashlib.sha256()
+    if not os.path.isdir(path):
+        _update_file_digest(digest, path)
+        return digest.hexdigest()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).replace(os.sep, '/').encode('utf-8') + b'\0')
+            _update_file_digest(digest, file_path)
+    return digest.hexdigest()
+
+def _link_or_copy(src, dst):
+    """优先建立硬链接，跨文件系统时退回复制；后续流程只移动链接，不会改动原始文件。"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def extract_source(path, dest):
+    """把漫画来源展开到 dest：支持 ZIP/CBZ、tar 系列、CBR（可选）以及已解压的目录。"""
+    if os.path.isdir(path):
+        shutil.copytree(path, os.path.join(dest, os.path.basename(os.path.normpath(path))), copy_function=_link_or_copy, dirs_exist_ok=True)
+        return
+    lower = path.lower()
+    if lower.endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(path, 'r') as zf:
+            zf.extractall(dest)
+    elif lower.endswith(TAR_EXTENSIONS):
+        with tarfile.open(path, 'r:*') as tf:
+            tf.extractall(dest, filter='data')
+    elif lower.endswith(RAR_EXTENSIONS):
+        if rarfile is None:
+            raise ValueError("解压 CBR/RAR 需要安装 rarfile 库。")
+        with rarfile.RarFile(path) as rf:
+            rf.extractall(dest)
+    else:
+        raise ValueError(f"不支持的文件格式: {path}")
+    logger.debug(f"已展开 {path} 到 {dest}")
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import concurrent.futures
+
+from ..utils.logger import logger
+from ..processing import process_comic
+from ..tasks import get_all_statuses, release_stream_buffers, FINAL_STATUSES
+from .archive import is_supported_archive, get_comic_name, source_sha256
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+SUPPORTED_FORMATS = tuple(os.getenv('SUPPORTED_FORMATS', '.png,.jpg,.jpeg,.webp,.bmp,.gif').split(','))
+# 扫描缓存：来源路径 -> (签名, 哈希, 漫画名)，签名未变时跳过重新计算哈希
+SCAN_CACHE_PATH = os.path.join(DATA_BASE_PATH, 'import_scan_cache.json')
+
+def _has_images(path):
+    try:
+        return any(name.lower().endswith(SUPPORTED_FORMATS) and os.path.isfile(os.path.join(path, name)) for name in os.listdir(path))
+    except OSError:
+        return False
+
+def _is_chapter_layout(path, subdirs):
+    """子目录直接包含图片、且这些子目录下没有再包含图片的目录，即“漫画/章节/图片”结构。"""
+    image_dirs = [os.path.join(path, d) for d in subdirs if _has_images(os.path.join(path, d))]
+    if not image_dirs:
+        return False
+    for image_dir in image_dirs:
+        for entry in os.scandir(image_dir):
+            if entry.is_dir() and _has_images(entry.path):
+                return False
+    return True
+
+def find_sources(root):
+    """遍历目录树，产出可导入的来源路径。
+
+    归档文件（ZIP/CBZ、tar 系列、CBR）各自是一部漫画；直接包含图片的目录视为一部漫画
+    （其中的子目录作为章节），只有章节子目录包含图片的目录也视为一部漫画。
+    识别为漫画的目录不再向下遍历；root 本身只有在直接包含图片时才被视为漫画。
+    """
+    if os.path.isfile(root):
+        if is_supported_archive(root):
+            yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if _has_images(dirpath) or (dirpath != root and _is_chapter_layout(dirpath, dirnames)):
+            dirnames[:] = []
+            yield dirpath
+            continue
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if is_supported_archive(path):
+                yield path
+
+def _source_signature(path):
+    """来源的廉价签名（大小与修改时间），用于判断是否需要重新计算哈希。"""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    total_size, latest_mtime, count = 0, 0, 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            stat = os.stat(os.path.join(dirpath, name))
+            total_size += stat.st_size
+            latest_mtime = max(latest_mtime, stat.st_mtime_ns)
+            count += 1
+    return [total_size, latest_mtime, count]
+
+def _load_scan_cache():
+    if not os.path.exists(SCAN_CACHE_PATH):
+        return {}
+    try:
+        with open(SCAN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+def _save_scan_cache(cache):
+    os.makedirs(DATA_BASE_PATH, exist_ok=True)
+    tmp_path = SCAN_CACHE_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, SCAN_CACHE_PATH)
+
+def load_indexed_hashes():
+    """收集已成功入库的来源哈希（info.json 的 source_hashes）。
+
+    早期导入的漫画没有该记录，已生成章节摘要时以其存储哈希（即首次上传文件的哈希）代替。
+    """
+    hashes = set()
+    if not os.path.isdir(DATA_BASE_PATH):
+        return hashes
+    for comic_hash in os.listdir(DATA_BASE_PATH):
+        info_path = os.path.join(DATA_BASE_PATH, comic_hash, 'info.json')
+        if not os.path.exists(info_path):
+            continue
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            continue
+        if 'source_hashes' in info:
+            hashes.update(info['source_hashes'])
+            continue
+        summary_dir = os.path.join(DATA_BASE_PATH, comic_hash, 'cap_summary')
+        if os.path.isdir(summary_dir) and os.listdir(summary_dir):
+            hashes.add(comic_hash)
+    return hashes
+
+def scan_sources(paths, scan_threads=8, use_cache=True, progress_callback=None):
+    """并行扫描来源，返回 [(路径, 漫画名, 哈希)]；无法读取的来源记录错误后跳过。"""
+    cache = _load_scan_cache() if use_cache else {}
+    sources = [os.path.abspath(source) for root in paths for source in find_sources(root)]
+
+    def scan(path):
+        signature = _source_signature(path)
+        cached = cache.get(path)
+        if cached and cached['signature'] == signature:
+            return path, cached['name'], cached['hash'], signature
+        return path, get_comic_name(path), source_sha256(path), signature
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=scan_threads) as executor:
+        futures = {executor.submit(scan, path): path for path in sources}
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            path = futures[future]
+            try:
+                path, name, content_hash, signature = future.result()
+            except Exception as e:
+                logger.error(f"扫描来源 {path} 失败: {e}")
+            else:
+                cache[path] = {'signature': signature, 'name': name, 'hash': content_hash}
+                results.append((path, name, content_hash))
+            if progress_callback:
+                progress_callback(n, len(sources))
+
+    _save_scan_cache(cache)
+    order = {path: n for n, path in enumerate(sources)}
+    results.sort(key=lambda item: order[item[0]])
+    return results
+
+def enqueue_sources(sources, force=False):
+    """把尚未入库的来源加入任务队列，返回 (任务 ID 列表, 跳过数)。同一次运行中内容相同的来源只导入一次。"""
+    indexed = set() if force else load_indexed_hashes()
+    task_ids, skipped = [], 0
+    for path, name, content_hash in sources:
+        if content_hash in indexed:
+            skipped += 1
+            continue
+        indexed.add(content_hash)
+        task_id = process_comic(path, name, content_hash, keep_source=True)
+        if task_id:
+            task_ids.append(task_id)
+    return task_ids, skipped
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def wait_for_tasks(task_ids, interval=5.0, output=print):
+    """等待任务全部结束，定期输出进度与预计剩余时间。返回 (成功数, 失败数)。"""
+    pending = set(task_ids)
+    start = time.time()
+    released = set()
+    while True:
+        statuses = {s['task_id']: s for s in get_all_statuses() if s.get('task_id') in pending}
+        finished = {tid for tid, s in statuses.items() if s.get('status') in FINAL_STATUSES}
+        for task_id in finished:
+            if task_id not in released:
+                release_stream_buffers(task_id)
+                released.add(task_id)
+        done = sum(1 for tid in finished if statuses[tid]['status'] == '完成')
+        failed = len(finished) - done
+        # 以各任务自身的进度估算完成比例，长任务运行中也能得到平滑的 ETA
+        fraction = sum(statuses[tid].get('progress', 0) for tid in statuses if tid not in finished) / 100.0 + len(finished)
+        elapsed = time.time() - start
+        eta = _format_duration(elapsed / fraction * (len(pending) - fraction)) if fraction > 0 else '--:--:--'
+        output(f"[导入] 完成 {done} / 失败 {failed} / 共 {len(pending)}  "
+               f"{fraction / len(pending) * 100:5.1f}%  已用 {_format_duration(elapsed)}  预计剩余 {eta}")
+        if len(finished) >= len(pending):
+            return done, failed
+        time.sleep(interval)
@@ -1,44 +1,69 @@
 import os
-import zipfile
 import shutil
 import json
 import concurrent.futures
 import re
 import time
+import hashlib
 from PIL import Image
 from collections import deque
 
 from ..utils.logger import logger
-from ..tasks import update_task_status, get_or_create_stream_buffer
-from ..services.vision_service import analyze_image
-from ..services.openai_service import summarize_text, get_embedding
-from ..services.chroma_service import add_embedding
+from ..tasks import update_task_status, get_or_create_stream_buffer, get_task_control, TaskControl, TaskInterrupted, TaskCancelled
+from ..services.vision_service import analyze_image, analyze_images, parse_batch_output, BatchOutputSplitter, STREAM_RESET, VISION_MODEL, VISION_PROMPT_VERSION
+from ..services.openai_service import SUMMARY_FAILED
+from .summarizer import summarize_chapter, save_chapter_summary
+from .page_dedup import plan_chapter_pages
+from .archive import extract_source
+from ..services.phash_service import add_page_hashes, delete_page_hashes, index_chapter_images, delete_page_images, IMAGE_SEARCH_INDEX
+from ..services.chroma_service import add_embedding, delete_by_chapter_id
+from ..services.suggest_index import index_chapter_terms, delete_chapter_terms
+from ..services.description_store import append_record, load_chapter_descriptions, finalize_chapter
+from ..services.page_store import store_chapter_pages, page_sha256, PAGE_STORAGE
+from ..utils.metrics import EXTRACT_SECONDS, PAGES_TOTAL, VISION_SLOT_WAIT, VISION_BATCH_FALLBACKS
+from ..utils.tracing import span, record_span, is_enabled as tracing_enabled
 
 DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
 TEMP_FOLDER = os.getenv('TEMP_FOLDER', './tmp')
 SUPPORTED_FORMATS = tuple(os.getenv('SUPPORTED_FORMATS', '.png,.jpg,.jpeg,.webp,.bmp,.gif').split(','))
 COVER_NAMES = tuple(os.getenv('COVER_NAMES', 'cover,folder').split(','))
+# 每次视觉请求打包的连续页数；大于 1 时可显著减少按请求计费或 RPM 受限端点上的请求数
+VISION_PAGES_PER_REQUEST = max(1, int(os.getenv('VISION_PAGES_PER_REQUEST', 1)))
+# 章节指纹文件，保存在 pic_detail/<章节>/ 下
+CHAPTER_FINGERPRINT_FILE = 'fingerprint.json'
 
 def natural_sort_key(s):
     """自然排序键函数，用于正确排序包含数字的字符串。"""
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
 
-def _analyze_image_task(task_id, chapter_name, img_file, img_path):
+def _page_log_key(chapter_name, img_file):
+    """单页流缓冲区的键，前端据此区分各页的实时输出。"""
+    return f"{chapter_name}_{os.path.splitext(img_file)[0]}"
+
+def _analyze_image_task(task_id, chapter_name, img_file, img_path, submitted_at=None):
     """封装单个图片分析任务，使其可在线程池中运行。"""
-    log_key = f"{chapter_name}_{os.path.splitext(img_file)[0]}"
+    if submitted_at is not None:
+        VISION_SLOT_WAIT.observe(time.perf_counter() - submitted_at)
+    log_key = _page_log_key(chapter_name, img_file)
+    log_extra = {'task_id': task_id, 'chapter': chapter_name, 'page': img_file}
     
     buffer = get_or_create_stream_buffer(task_id, log_key)
     if buffer is None:
-        logger.error(f"[{task_id}] 无法为 {log_key} 获取流缓冲区。")
+        logger.error(f"[{task_id}] 无法为 {log_key} 获取流缓冲区。", extra=log_extra)
         return img_file, None
 
-    logger.info(f"[{task_id}] [图片分析中] 开始分析图片 {img_file}...")
+    logger.info(f"[{task_id}] [图片分析中] 开始分析图片 {img_file}...", extra=log_extra)
     buffer.append(f"[开始分析图片: {img_file}]\n")
     
     description_chunks = []
     try:
         # 直接传递图片路径给 analyze_image，它现在内置了重试逻辑
-        for chunk in analyze_image(img_path):
+        for chunk in analyze_image(img_path, control=get_task_control(task_id)):
+            if chunk is STREAM_RESET:
+                # 请求中途失败，重试会从头生成，丢弃已收到的部分
+                description_chunks.clear()
+                buffer.append({'type': 'stream_reset', 'stream_id': log_key})
+                continue
             buffer.append(chunk)
             description_chunks.append(chunk)
         
@@ -46,7 +71,7 @@ def _analyze_image_task(task_id, chapter_name, img_file, img_path):
 
         # 检查是否有错误信息从 analyze_image 返回
         if description.startswith("错误："):
-            logger.error(f"[{task_id}] {description}")
+            logger.error(f"[{task_id}] {description}", extra=log_extra)
             buffer.append(f"\n[错误: {description}]\n")
             buffer.append({'type': 'stream_end', 'stream_id': log_key, 'error': True})
             return img_file, None
@@ -54,16 +79,174 @@ def _analyze_image_task(task_id, chapter_name, img_file, img_path):
         buffer.append(f"\n[图片分析结束: {img_file}]\n\n")
         buffer.append({'type': 'stream_end', 'stream_id': log_key})
         
-        logger.info(f"[{task_id}] [图片分析完成] 图片 {img_file} 分析完毕。")
+        logger.info(f"[{task_id}] [图片分析完成] 图片 {img_file} 分析完毕。", extra=log_extra)
         return img_file, description
-    
+
+    except TaskInterrupted:
+        buffer.append("\n[任务已暂停或取消，分析中止]\n")
+        buffer.append({'type': 'stream_end', 'stream_id': log_key, 'error': True})
+        raise
     except Exception as e:
         error_message = f"处理图片 {img_file} 时发生意外错误: {e}"
-        logger.error(f"[{task_id}] {error_message}", exc_info=True)
+        logger.error(f"[{task_id}] {error_message}", exc_info=True, extra=log_extra)
         buffer.append(f"\n[严重错误: {error_message}]\n")
         buffer.append({'type': 'stream_end', 'stream_id': log_key, 'error': True})
         return img_file, None
 
+def _analyze_page_group(task_id, chapter_name, img_files, image_dir, submitted_at=None):
+    """分析一组连续页面，返回 [(img_file, description)]。
+
+    多于一页时打包为一次多图请求，流式输出按【第N页】标记拆分到各页的缓冲区；
+    结果无法按页解析时退回逐页单独请求。
+    """
+    if len(img_files) == 1:
+        return [_analyze_image_task(task_id, chapter_name, img_files[0], os.path.join(image_dir, img_files[0]), submitted_at)]
+
+    if submitted_at is not None:
+        VISION_SLOT_WAIT.observe(time.perf_counter() - submitted_at)
+    log_extra = {'task_id': task_id, 'chapter': chapter_name, 'page': f"{img_files[0]}..{img_files[-1]}"}
+
+    buffers = []
+    for img_file in img_files:
+        buffer = get_or_create_stream_buffer(task_id, _page_log_key(chapter_name, img_file))
+        if buffer is None:
+            logger.error(f"[{task_id}] 无法为 {img_file} 获取流缓冲区。", extra=log_extra)
+            return [(img_file, None) for img_file in img_files]
+        buffer.append(f"[开始分析图片: {img_file}（{len(img_files)} 页批量请求）]\n")
+        buffers.append(buffer)
+
+    logger.info(f"[{task_id}] [图片分析中] 批量分析 {len(img_files)} 页: {img_files[0]} ~ {img_files[-1]}", extra=log_extra)
+    descriptions = None
+    try:
+        splitter = BatchOutputSplitter(len(img_files))
+        for chunk in analyze_images([os.path.join(image_dir, img_file) for img_file in img_files], control=get_task_control(task_id)):
+            if chunk is STREAM_RESET:
+                splitter = BatchOutputSplitter(len(img_files))
+                for img_file, buffer in zip(img_files, buffers):
+                    buffer.append({'type': 'stream_reset', 'stream_id': _page_log_key(chapter_name, img_file)})
+                continue
+            for index, text in splitter.feed(chunk):
+                buffers[index].append(text)
+        for index, text in splitter.finish():
+            buffers[index].append(text)
+        descriptions = parse_batch_output(splitter.text, len(img_files))
+    except TaskInterrupted:
+        for img_file, buffer in zip(img_files, buffers):
+            buffer.append("\n[任务已暂停或取消，分析中止]\n")
+            buffer.append({'type': 'stream_end', 'stream_id': _page_log_key(chapter_name, img_file), 'error': True})
+        raise
+    except Exception as e:
+        logger.error(f"[{task_id}] 批量分析图片时发生意外错误: {e}", exc_info=True, extra=log_extra)
+
+    if descriptions is None:
+        VISION_BATCH_FALLBACKS.inc()
+        logger.warning(f"[{task_id}] 批量结果无法按页解析，改为逐页分析 {len(img_files)} 页。", extra=log_extra)
+        for buffer in buffers:
+            buffer.append("\n[批量结果解析失败，改为单页分析]\n")
+        return [_analyze_image_task(task_id, chapter_name, img_file, os.path.join(image_dir, img_file)) for img_file in img_files]
+
+    for img_file, buffer in zip(img_files, buffers):
+        buffer.append(f"\n[图片分析结束: {img_file}]\n\n")
+        buffer.append({'type': 'stream_end', 'stream_id': _page_log_key(chapter_name, img_file)})
+    logger.info(f"[{task_id}] [图片分析完成] 批量分析 {len(img_files)} 页完毕。", extra=log_extra)
+    return list(zip(img_files, descriptions))
+
+def _save_page_description(chapter_pic_detail_path, img_file, description, content_hash, source, started_at=None, seconds=None):
+    """向章节的页面记录文件追加一页描述。source 为 vision / blank / library / unchanged / duplicate。"""
+    model, prompt_version = (VISION_MODEL, VISION_PROMPT_VERSION) if source == 'vision' else (None, None)
+    append_record(chapter_pic_detail_path, img_file, description, content_hash=content_hash, source=source, model=model,
+                  prompt_version=prompt_version, started_at=started_at, seconds=seconds)
+
+def _analyze_page_group_timed(task_id, chapter_name, img_files, image_dir, submitted_at=None):
+    """_analyze_page_group 的计时包装，返回 (结果, 开始时间戳, 每页平均耗时)。
+
+    任务暂停时在此等待，恢复后重新分析被中止的页面；任务取消时抛出 TaskCancelled，尚未开始的页面不再发出请求。
+    """
+    control = get_task_control(task_id) or TaskControl(task_id)
+    control.checkpoint()
+    started_at = time.time()
+    start = time.perf_counter()
+    if submitted_at is not None and tracing_enabled():
+        waited = start - submitted_at
+        record_span(task_id, 'vision_slot_wait', 'queue', int(submitted_at * 1e9), int(waited * 1e9), {'chapter': chapter_name})
+    with span('analyze_pages', 'vision', task_id=task_id, chapter=chapter_name, pages=img_files):
+        results = control.run(_analyze_page_group, task_id, chapter_name, img_files, image_dir, submitted_at)
+    return results, started_at, (time.perf_counter() - start) / max(1, len(results))
+
+def _file_sha256(path):
+    """计算文件内容的 SHA-256。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _chapter_fingerprint(image_files, page_content_hashes):
+    """章节指纹：按页序排列的页面内容哈希的摘要。"""
+    return hashlib.sha256('\n'.join(page_content_hashes[img_file] for img_file in image_files).encode('utf-8')).hexdigest()
+
+def _load_chapter_fingerprint(chapter_pic_storage_path, chapter_pic_detail_path, chapter_summary_path):
+    """读取章节上次入库时的指纹记录。
+
+    旧版本入库的章节没有指纹文件，此时根据已存储的图片和 manifest 现场重建，
+    使已有的库在首次增量更新时也能跳过未变化的章节。
+    """
+    fingerprint_path = os.path.join(chapter_pic_detail_path, CHAPTER_FINGERPRINT_FILE)
+    if os.path.exists(fingerprint_path):
+        try:
+            with open(fingerprint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+
+    manifest_path = os.path.join(chapter_pic_detail_path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            image_files = json.load(f)
+        pages = [[img_file, page_sha256(chapter_pic_storage_path, img_file)] for img_file in image_files]
+    except (json.JSONDecodeError, IOError):
+        return None
+    descriptions = load_chapter_descriptions(chapter_pic_detail_path)
+    complete = os.path.exists(os.path.join(chapter_summary_path, 'summary.txt')) and all(img_file in descriptions for img_file in image_files)
+    return {'fingerprint': _chapter_fingerprint(image_files, dict(pages)), 'pages': pages, 'complete': complete}
+
+def _save_chapter_fingerprint(chapter_pic_detail_path, image_files, page_content_hashes, complete):
+    """记录章节指纹。complete 为 False 表示有页面或摘要失败，下次上传时需要重新处理。"""
+    record = {
+        'fingerprint': _chapter_fingerprint(image_files, page_content_hashes),
+        'pages': [[img_file, page_content_hashes[img_file]] for img_file in image_files],
+        'complete': complete,
+    }
+    with open(os.path.join(chapter_pic_detail_path, CHAPTER_FINGERPRINT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=4)
+
+def _load_previous_descriptions(chapter_pic_detail_path, previous):
+    """按页面内容哈希收集上次入库时的页面描述，页面改名或调整顺序后仍可复用。"""
+    if not previous:
+        return {}
+    stored = load_chapter_descriptions(chapter_pic_detail_path)
+    descriptions = {}
+    for img_file, content_hash in previous.get('pages', []):
+        if content_hash not in descriptions and img_file in stored:
+            descriptions[content_hash] = stored[img_file]
+    return descriptions
+
+def _record_source_hash(comic_path, file_content_hash):
+    """在 info.json 中记录已成功导入的来源文件哈希，批量导入据此跳过已入库的内容。"""
+    info_path = os.path.join(comic_path, 'info.json')
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        info = {}
+    source_hashes = info.setdefault('source_hashes', [])
+    if file_content_hash not in source_hashes:
+        source_hashes.append(file_content_hash)
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=4)
+
 def _get_comic_index():
     """加载或初始化漫画索引。"""
     index_path = os.path.join(DATA_BASE_PATH, 'index.json')
@@ -84,7 +267,7 @@ def _save_comic_index(index):
         json.dump(index, f, ensure_ascii=False, indent=4)
 
 def _process_zip_file(task):
-    """实际处理单个 ZIP 漫画文件的内部函数。"""
+    """实际处理单个漫画来源（ZIP/CBZ、tar 归档或已解压目录）的内部函数。"""
     task_id = task['task_id']
     filepath = task['filepath']
     comic_name = task['comic_name']
@@ -93,22 +276,23 @@ def _process_zip_file(task):
     update_task_status(task_id, {'status': '正在处理', 'details': '开始解压文件...'})
 
     temp_extract_path = os.path.join(TEMP_FOLDER, task_id)
+    control = get_task_control(task_id) or TaskControl(task_id)
 
     try:
         if os.path.exists(temp_extract_path): shutil.rmtree(temp_extract_path)
         os.makedirs(temp_extract_path, exist_ok=True)
 
-        logger.info(f"[{task_id}] 解压文件到 {temp_extract_path}")
-        with zipfile.ZipFile(filepath, 'r') as zip_ref:
-            zip_ref.extractall(temp_extract_path)
+        logger.info(f"[{task_id}] 解压文件到 {temp_extract_path}", extra={'task_id': task_id})
+        with EXTRACT_SECONDS.time(), span('extract', 'io'):
+            extract_source(filepath, temp_extract_path)
         
         extracted_items = os.listdir(temp_extract_path)
         comic_base_path = temp_extract_path
         
-        # 如果ZIP内有单层目录，则以该目录为基础进行处理
+        # 如果归档内有单层目录，则以该目录为基础进行处理
         if len(extracted_items) == 1 and os.path.isdir(os.path.join(temp_extract_path, extracted_items[0])):
             comic_base_path = os.path.join(temp_extract_path, extracted_items[0])
-            logger.info(f"[{task_id}] 检测到单层目录，处理路径设为: {comic_base_path}")
+            logger.info(f"[{task_id}] 检测到单层目录，处理路径设为: {comic_base_path}", extra={'task_id': task_id})
 
         # 加载漫画索引
         comic_index = _get_comic_index()
@@ -116,13 +300,15 @@ def _process_zip_file(task):
         # 确定漫画的存储哈希
         comic_hash = comic_index.get(comic_name)
         if comic_hash:
-            logger.info(f"[{task_id}] 漫画 '{comic_name}' 已存在，使用哈希 {comic_hash} 进行更新。")
+            logger.info(f"[{task_id}] 漫画 '{comic_name}' 已存在，使用哈希 {comic_hash} 进行更新。", extra={'task_id': task_id})
         else:
             # 对于新漫画，使用文件内容的哈希作为其存储哈希
             comic_hash = file_content_hash
             comic_index[comic_name] = comic_hash
             _save_comic_index(comic_index)
-            logger.info(f"[{task_id}] 创建新漫画 '{comic_name}'，使用哈希: {comic_hash}")
+            logger.info(f"[{task_id}] 创建新漫画 '{comic_name}'，使用哈希: {comic_hash}", extra={'task_id': task_id})
+        # 删除漫画时据此取消其正在进行的任务
+        update_task_status(task_id, {'comic_hash': comic_hash})
 
         comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
         if not os.path.exists(comic_path):
@@ -130,9 +316,6 @@ def _process_zip_file(task):
             with open(os.path.join(comic_path, 'info.json'), 'w', encoding='utf-8') as f:
                 json.dump({'name': comic_name}, f, ensure_ascii=False, indent=4)
 
-        os.remove(filepath)
-        logger.info(f"[{task_id}] 原始 zip 文件已被处理和删除: {filepath}")
-
         pic_storage_path = os.path.join(comic_path, 'pic')
         pic_detail_base_path = os.path.join(comic_path, 'pic_detail')
         cap_summary_base_path = os.path.join(comic_path, 'cap_summary')
@@ -141,8 +324,16 @@ def _process_zip_file(task):
         os.makedirs(cap_summary_base_path, exist_ok=True)
 
         potential_chapters = [d for d in os.listdir(comic_base_path) if os.path.isdir(os.path.join(comic_base_path, d))]
-        chapters = sorted(potential_chapters, key=natural_sort_key) if potential_chapters else ['.']
-        logger.info(f"[{task_id}] 找到章节: {chapters}")
+        if not potential_chapters:
+            # 图片直接位于根目录（单章节的归档或文件夹）时，将其视为与漫画同名的单一章节
+            single_chapter_path = os.path.join(comic_base_path, comic_name)
+            os.makedirs(single_chapter_path, exist_ok=True)
+            for item in os.listdir(comic_base_path):
+                if item.lower().endswith(SUPPORTED_FORMATS) and not any(cn in item.lower() for cn in COVER_NAMES):
+                    shutil.move(os.path.join(comic_base_path, item), os.path.join(single_chapter_path, item))
+            potential_chapters = [comic_name]
+        chapters = sorted(potential_chapters, key=natural_sort_key)
+        logger.info(f"[{task_id}] 找到章节: {chapters}", extra={'task_id': task_id})
 
         # 更新封面（仅当不存在时）
         cover_path = os.path.join(comic_path, 'cover.png')
@@ -157,41 +348,65 @@ def _process_zip_file(task):
                         try:
                             with Image.open(os.path.join(search_dir, item)) as img:
                                 img.convert('RGB').save(cover_path, 'PNG')
-                            logger.info(f"[{task_id}] 找到并保存封面图到: {cover_path}")
+                            logger.info(f"[{task_id}] 找到并保存封面图到: {cover_path}", extra={'task_id': task_id})
                             cover_found = True
                             break
                         except Exception as e:
-                            logger.error(f"[{task_id}] 处理封面图 {item} 时出错: {e}")
-            if not cover_found: logger.warning(f"[{task_id}] 未找到封面图。")
+                            logger.error(f"[{task_id}] 处理封面图 {item} 时出错: {e}", extra={'task_id': task_id})
+            if not cover_found: logger.warning(f"[{task_id}] 未找到封面图。", extra={'task_id': task_id})
 
         total_images = sum(len(sorted([f for f in os.listdir(os.path.join(comic_base_path, c)) if f.lower().endswith(SUPPORTED_FORMATS) and not any(cn in f.lower() for cn in COVER_NAMES)], key=natural_sort_key)) for c in chapters)
         if total_images == 0: raise ValueError("漫画中未找到有效图片。")
 
         processed_images = 0
+        pages_blank = 0
+        pages_reused = 0
+        pages_unchanged = 0
         total_chapters = len(chapters)
+        incomplete_chapters = []
         for i, chapter_name in enumerate(chapters):
+            control.checkpoint()
+            chapter_started = time.perf_counter_ns()
             chapter_path = os.path.join(comic_base_path, chapter_name)
             image_files = sorted([f for f in os.listdir(chapter_path) if f.lower().endswith(SUPPORTED_FORMATS) and not any(cn in f.lower() for cn in COVER_NAMES)], key=natural_sort_key)
             
             if not image_files:
-                logger.warning(f"[{task_id}] 章节 '{chapter_name}' 中未找到有效图片，跳过。")
+                logger.warning(f"[{task_id}] 章节 '{chapter_name}' 中未找到有效图片，跳过。", extra={'task_id': task_id, 'chapter': chapter_name})
                 continue
 
-            # 如果章节已存在，则删除旧章节数据
             chapter_pic_storage_path = os.path.join(pic_storage_path, chapter_name)
+            chapter_pic_detail_path = os.path.join(pic_detail_base_path, chapter_name)
+            chapter_summary_path = os.path.join(cap_summary_base_path, chapter_name)
+
+            # 与上次入库时的章节指纹比较：未变化的章节直接跳过，变化的章节只重新分析改动过的页面
+            with span('fingerprint', 'io', chapter=chapter_name):
+                page_content_hashes = {img_file: _file_sha256(os.path.join(chapter_path, img_file)) for img_file in image_files}
+                previous = _load_chapter_fingerprint(chapter_pic_storage_path, chapter_pic_detail_path, chapter_summary_path)
+            if previous and previous.get('complete') and previous.get('fingerprint') == _chapter_fingerprint(image_files, page_content_hashes):
+                processed_images += len(image_files)
+                pages_unchanged += len(image_files)
+                PAGES_TOTAL.inc(len(image_files), result='unchanged')
+                logger.info(f"[{task_id}] 章节 '{chapter_name}' 内容未变化，跳过。", extra={'task_id': task_id, 'chapter': chapter_name})
+                update_task_status(task_id, {'progress': (processed_images / total_images) * 95, 'pages_unchanged': pages_unchanged,
+                                             'details': f'章节 {chapter_name} ({i+1}/{total_chapters}): 未变化，已跳过'})
+                continue
+            previous_descriptions = _load_previous_descriptions(chapter_pic_detail_path, previous)
+
+            # 如果章节已存在，则删除旧章节数据
             if os.path.exists(chapter_pic_storage_path):
                 shutil.rmtree(chapter_pic_storage_path)
-                logger.info(f"[{task_id}] 已删除旧的图片存储目录: {chapter_pic_storage_path}")
+                logger.info(f"[{task_id}] 已删除旧的图片存储目录: {chapter_pic_storage_path}", extra={'task_id': task_id, 'chapter': chapter_name})
             
-            chapter_pic_detail_path = os.path.join(pic_detail_base_path, chapter_name)
             if os.path.exists(chapter_pic_detail_path):
                 shutil.rmtree(chapter_pic_detail_path)
-                logger.info(f"[{task_id}] 已删除旧的图片详情目录: {chapter_pic_detail_path}")
+                logger.info(f"[{task_id}] 已删除旧的图片详情目录: {chapter_pic_detail_path}", extra={'task_id': task_id, 'chapter': chapter_name})
 
-            chapter_summary_path = os.path.join(cap_summary_base_path, chapter_name)
             if os.path.exists(chapter_summary_path):
                 shutil.rmtree(chapter_summary_path)
-                logger.info(f"[{task_id}] 已删除旧的章节摘要目录: {chapter_summary_path}")
+                logger.info(f"[{task_id}] 已删除旧的章节摘要目录: {chapter_summary_path}", extra={'task_id': task_id, 'chapter': chapter_name})
+                # 旧摘要的向量和联想词随摘要一并删除，新摘要失败时搜索不会再返回磁盘上已不存在的旧摘要
+                delete_by_chapter_id(f"{comic_hash}_{chapter_name}")
+                delete_chapter_terms(comic_hash, chapter_name)
 
             # 创建新章节目录
             os.makedirs(chapter_pic_storage_path, exist_ok=True)
@@ -201,66 +416,152 @@ def _process_zip_file(task):
             manifest_path = os.path.join(chapter_pic_detail_path, 'manifest.json')
             with open(manifest_path, 'w', encoding='utf-8') as f:
                 json.dump(image_files, f, ensure_ascii=False, indent=4)
-            logger.info(f"[{task_id}] 章节 '{chapter_name}' 的文件清单已保存。")
+            logger.info(f"[{task_id}] 章节 '{chapter_name}' 的文件清单已保存。", extra={'task_id': task_id, 'chapter': chapter_name})
 
             page_descriptions_map = {}
             max_workers = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4))
 
+            # 散文件格式把图片移入永久存储后从那里分析；打包格式写入 pages.pack 后仍从解压目录分析
+            with span('store_pages', 'io', chapter=chapter_name, pages=len(image_files)):
+                store_chapter_pages(chapter_pic_storage_path, chapter_path, image_files)
+            image_dir = chapter_path if PAGE_STORAGE == 'packed' else chapter_pic_storage_path
+            logger.info(f"[{task_id}] 章节 '{chapter_name}' 的所有图片已保存到永久存储位置。", extra={'task_id': task_id, 'chapter': chapter_name})
+
+            # 预处理：空白页直接使用固定描述，近似重复页复用已有描述，不再调用视觉模型
+            with span('plan_pages', 'io', chapter=chapter_name):
+                page_plans, page_hashes = plan_chapter_pages(task_id, chapter_name, image_files, image_dir)
             for img_file in image_files:
-                src_img_path = os.path.join(chapter_path, img_file)
-                dest_img_path = os.path.join(chapter_pic_storage_path, img_file)
-                shutil.move(src_img_path, dest_img_path)
-            logger.info(f"[{task_id}] 章节 '{chapter_name}' 的所有图片已移动到永久存储位置。")
+                if page_plans[img_file][0] in ('analyze', 'library') and page_content_hashes[img_file] in previous_descriptions:
+                    page_plans[img_file] = ('unchanged', previous_descriptions[page_content_hashes[img_file]])
+            pages_to_analyze = [img_file for img_file in image_files if page_plans[img_file][0] == 'analyze']
+            for img_file in image_files:
+                kind, value = page_plans[img_file]
+                if kind in ('blank', 'library', 'unchanged'):
+                    page_descriptions_map[img_file] = value
+                    _save_page_description(chapter_pic_detail_path, img_file, value, page_content_hashes[img_file], kind)
+                    PAGES_TOTAL.inc(result='reused' if kind == 'library' else kind)
+                    processed_images += 1
+                    if kind == 'blank':
+                        pages_blank += 1
+                    elif kind == 'library':
+                        pages_reused += 1
+                    else:
+                        pages_unchanged += 1
+            if len(pages_to_analyze) < len(image_files):
+                logger.info(f"[{task_id}] 章节 '{chapter_name}' 预处理完成：{len(pages_to_analyze)}/{len(image_files)} 页需要调用视觉模型。", extra={'task_id': task_id, 'chapter': chapter_name})
+                update_task_status(task_id, {'pages_blank': pages_blank, 'pages_reused': pages_reused, 'pages_unchanged': pages_unchanged})
 
             with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_img = {executor.submit(_analyze_image_task, task_id, chapter_name, img_file, os.path.join(chapter_pic_storage_path, img_file)): img_file for img_file in image_files}
+                page_groups = [pages_to_analyze[n:n + VISION_PAGES_PER_REQUEST] for n in range(0, len(pages_to_analyze), VISION_PAGES_PER_REQUEST)]
+                future_to_group = {executor.submit(_analyze_page_group_timed, task_id, chapter_name, group, image_dir, time.perf_counter()): group for group in page_groups}
 
-                for future in concurrent.futures.as_completed(future_to_img):
-                    img_file = future_to_img[future]
+                for future in concurrent.futures.as_completed(future_to_group):
+                    group = future_to_group[future]
                     try:
-                        _, description = future.result()
+                        group_results, started_at, seconds = future.result()
+                    except TaskCancelled:
+                        raise
+                    except Exception as exc:
+                        logger.error(f'[{task_id}] 图片 {", ".join(group)} 生成时发生错误: {exc}', exc_info=True, extra={'task_id': task_id, 'chapter': chapter_name, 'page': group[0]})
+                        continue
+
+                    for img_file, description in group_results:
+                        PAGES_TOTAL.inc(result='ok' if description else 'failed')
                         if description:
                             page_descriptions_map[img_file] = description
-                            desc_filename = os.path.splitext(img_file)[0] + '.txt'
-                            with open(os.path.join(chapter_pic_detail_path, desc_filename), 'w', encoding='utf-8') as f:
-                                f.write(description)
-                        
+                            _save_page_description(chapter_pic_detail_path, img_file, description, page_content_hashes[img_file], 'vision',
+                                                   started_at=started_at, seconds=round(seconds, 3))
                         processed_images += 1
-                        progress = (processed_images / total_images) * 95
-                        details = f'章节 {chapter_name} ({i+1}/{total_chapters}): 分析图片 {processed_images}/{total_images}'
-                        update_task_status(task_id, {'status': 'AI处理中', 'progress': progress, 'details': details})
-
-                    except Exception as exc:
-                        logger.error(f'[{task_id}] 图片 {img_file} 生成时发生错误: {exc}', exc_info=True)
 
-            page_descriptions = [page_descriptions_map[img_file] for img_file in image_files if img_file in page_descriptions_map]
+                    progress = (processed_images / total_images) * 95
+                    details = f'章节 {chapter_name} ({i+1}/{total_chapters}): 分析图片 {processed_images}/{total_images}'
+                    update_task_status(task_id, {'status': 'AI处理中', 'progress': progress, 'details': details})
 
+            # 章节内的重复页复用其代表页的结果
+            for img_file in image_files:
+                kind, representative = page_plans[img_file]
+                if kind == 'duplicate':
+                    processed_images += 1
+                    description = page_descriptions_map.get(representative)
+                    if description:
+                        page_descriptions_map[img_file] = description
+                        _save_page_description(chapter_pic_detail_path, img_file, description, page_content_hashes[img_file], 'duplicate')
+                        PAGES_TOTAL.inc(result='reused')
+                        pages_reused += 1
+            update_task_status(task_id, {'pages_blank': pages_blank, 'pages_reused': pages_reused})
+
+            # 记录页面哈希，供后续章节和其他漫画去重
+            with span('page_hashes', 'io', chapter=chapter_name):
+                delete_page_hashes(comic_hash, chapter_name)
+                add_page_hashes(comic_hash, chapter_name, {img_file: value for img_file, value in page_hashes.items()
+                                                            if img_file in page_descriptions_map and page_plans[img_file][0] != 'blank'})
+            # 以图搜图索引覆盖章节的每一页（包括空白页和重复页）
+            with span('image_hashes', 'io', chapter=chapter_name):
+                if IMAGE_SEARCH_INDEX:
+                    index_chapter_images(comic_hash, chapter_name, image_files, task_id)
+                else:
+                    delete_page_images(comic_hash, chapter_name)
+
+            # 空白页和章节内重复页不参与摘要，避免稀释关键词
+            summary_pages = [img_file for img_file in image_files
+                             if img_file in page_descriptions_map and page_plans[img_file][0] not in ('blank', 'duplicate')]
+            page_descriptions = [page_descriptions_map[img_file] for img_file in summary_pages]
+
+            chapter_complete = len(page_descriptions_map) == len(image_files)
             if page_descriptions:
                 details = f'正在为章节 {chapter_name} 生成摘要...'
                 update_task_status(task_id, {'details': details})
-                logger.info(f"[{task_id}] {details}")
+                logger.info(f"[{task_id}] {details}", extra={'task_id': task_id, 'chapter': chapter_name})
                 
-                full_description_text = "\n\n".join(page_descriptions)
-                # 注意：summarize_text 也需要修改以使用新的状态更新机制
-                # 目前假设 summarize_text 内部也已更新或不直接修改状态
-                summary_chunks = list(summarize_text(full_description_text, task_id, chapter_name))
-                chapter_summary = "".join(summary_chunks)
+                # 长章节会按 token 预算分块并行摘要后再合并（见 SUMMARY_MODE），分块结果缓存于 summary_cache
+                summary_cache_dir = os.path.join(comic_path, 'summary_cache')
+                summary_cache_keys = set()
+                with span('summary', 'summary', chapter=chapter_name, pages=len(page_descriptions)):
+                    chapter_summary = control.run(summarize_chapter, page_descriptions, task_id, chapter_name,
+                                                  cache_dir=summary_cache_dir, cache_keys=summary_cache_keys)
                 
-                with open(os.path.join(chapter_summary_path, 'summary.txt'), 'w', encoding='utf-8') as f:
-                    f.write(chapter_summary)
-                logger.info(f"[{task_id}] [摘要完成] 章节 {chapter_name} 摘要已保存。")
-
-                # 使用稳定的漫画哈希来添加嵌入
-                embedding = get_embedding(chapter_summary)
-                add_embedding(comic_hash, chapter_name, chapter_summary, embedding)
-
+                if chapter_summary == SUMMARY_FAILED:
+                    # 不保存、不索引失败的摘要（旧的向量和联想词已在重建章节时删除）；章节记为未完成，下次上传时重新摘要
+                    logger.error(f"[{task_id}] 章节 {chapter_name} 摘要失败，未保存。", extra={'task_id': task_id, 'chapter': chapter_name})
+                    chapter_complete = False
+                else:
+                    save_chapter_summary(chapter_summary_path, chapter_summary, summary_pages, summary_cache_dir, summary_cache_keys)
+                    logger.info(f"[{task_id}] [摘要完成] 章节 {chapter_name} 摘要已保存。", extra={'task_id': task_id, 'chapter': chapter_name})
+
+                    # 使用稳定的漫画哈希来添加嵌入；embedding 按当前集合的模型计算（重建索引期间新旧模型各一份）
+                    add_embedding(comic_hash, chapter_name, chapter_summary)
+                    index_chapter_terms(comic_hash, chapter_name, chapter_summary)
+
+            with span('finalize_chapter', 'io', chapter=chapter_name):
+                finalize_chapter(chapter_pic_detail_path)
+                _save_chapter_fingerprint(chapter_pic_detail_path, image_files, page_content_hashes, chapter_complete)
+            if not chapter_complete:
+                incomplete_chapters.append(chapter_name)
+            if tracing_enabled():
+                record_span(task_id, 'chapter', 'chapter', chapter_started, time.perf_counter_ns() - chapter_started,
+                            {'chapter': chapter_name, 'pages': len(image_files), 'analyzed': len(pages_to_analyze)})
+
+        # 有章节未完成时不记录来源哈希，否则批量导入会永久跳过该来源，未完成的章节得不到重试
+        if incomplete_chapters:
+            logger.warning(f"[{task_id}] 章节 {incomplete_chapters} 有页面或摘要失败，下次导入时重试。", extra={'task_id': task_id})
+        else:
+            _record_source_hash(comic_path, file_content_hash)
+        # 批量导入的来源属于用户的文件库，只读取不删除；上传的文件在处理成功后才删除，
+        # worker 中途退出、任务被重新领取时仍能读到来源
+        if not task.get('keep_source') and os.path.exists(filepath):
+            os.remove(filepath)
+            logger.info(f"[{task_id}] 原始 zip 文件已被处理和删除: {filepath}", extra={'task_id': task_id})
         update_task_status(task_id, {'status': '完成', 'progress': 100, 'details': '所有章节处理完毕。', 'end_time': time.time()})
-        logger.info(f"[{task_id}] 漫画 '{comic_name}' 处理完成。")
+        logger.info(f"[{task_id}] 漫画 '{comic_name}' 处理完成。", extra={'task_id': task_id})
 
+    except TaskCancelled:
+        # 由工作线程标记为“已取消”；当前章节没有写入指纹，下次上传时会重新处理
+        logger.info(f"[{task_id}] 漫画 '{comic_name}' 的处理已取消。", extra={'task_id': task_id})
+        raise
     except Exception as e:
-        logger.error(f"[{task_id}] 处理漫画时发生严重错误: {e}", exc_info=True)
+        logger.error(f"[{task_id}] 处理漫画时发生严重错误: {e}，来源文件已保留: {filepath}", exc_info=True, extra={'task_id': task_id})
         update_task_status(task_id, {'status': '失败', 'details': str(e), 'end_time': time.time()})
     finally:
         if os.path.exists(temp_extract_path):
             shutil.rmtree(temp_extract_path)
-            logger.info(f"[{task_id}] 已清理临时文件: {temp_extract_path}")
+            logger.info(f"[{task_id}] 已清理临时文件: {temp_extract_path}", extra={'task_id': task_id})
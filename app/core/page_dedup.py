@@ -0,0 +1,77 @@
+import os
+from PIL import Image, ImageStat
+
+from ..utils.logger import logger
+from ..services.phash_service import find_similar_pages, dhash, PHASH_MAX_DISTANCE
+from ..services.description_store import load_chapter_descriptions
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+# 分析前先按感知哈希去重、跳过空白页
+PAGE_DEDUP = os.getenv('PAGE_DEDUP', 'True').lower() == 'true'
+# 灰度标准差低于该值视为空白页（纯白、纯黑或单色分隔页）
+BLANK_STDDEV_THRESHOLD = float(os.getenv('BLANK_STDDEV_THRESHOLD', 3.0))
+BLANK_PAGE_DESCRIPTION = "（空白页，无内容）"
+
+def compute_page_fingerprint(image_path):
+    """计算页面的 64 位 dHash 和灰度统计量，返回 (hash, mean, stddev)。"""
+    with Image.open(image_path) as img:
+        # 对 JPEG 直接按缩小尺寸解码，避免完整解码大图
+        img.draft('L', (64, 64))
+        gray = img.convert('L')
+        stat = ImageStat.Stat(gray.resize((64, 64)))
+        value = dhash(gray)
+    return value, stat.mean[0], stat.stddev[0]
+
+def _read_stored_description(comic_hash, chapter_name, image, cache):
+    """读取已入库页面的描述，不存在时返回 None。
+
+    cache 为 {(comic_hash, 章节名): 描述字典}，同一次预处理中多页命中同一章节时只读取、解压一次记录文件。
+    """
+    key = (comic_hash, chapter_name)
+    if key not in cache:
+        cache[key] = load_chapter_descriptions(os.path.join(DATA_BASE_PATH, comic_hash, 'pic_detail', chapter_name))
+    return cache[key].get(image)
+
+def plan_chapter_pages(task_id, chapter_name, image_files, image_dir):
+    """分析前的预处理：为章节每一页决定处理方式。
+
+    返回 (plans, page_hashes)：
+      plans[img_file] = ('analyze', None)          需要调用视觉模型
+                        ('blank', 描述)            空白页，使用固定描述
+                        ('library', 描述)          与库中已有页面近似重复，复用其描述
+                        ('duplicate', 代表页文件名) 与本章节内另一页近似重复，复用代表页结果
+      page_hashes[img_file] = 64 位哈希（计算失败的页面不包含在内）
+    """
+    plans = {img_file: ('analyze', None) for img_file in image_files}
+    page_hashes = {}
+    if not PAGE_DEDUP:
+        return plans, page_hashes
+
+    representatives = []  # 本章节内需要分析的代表页 [(hash, img_file)]
+    stored_descriptions = {}
+    for img_file in image_files:
+        try:
+            value, _, stddev = compute_page_fingerprint(os.path.join(image_dir, img_file))
+        except Exception as e:
+            logger.warning(f"[{task_id}] 计算图片 {img_file} 的感知哈希失败: {e}", extra={'task_id': task_id, 'chapter': chapter_name, 'page': img_file})
+            continue
+        page_hashes[img_file] = value
+
+        if stddev < BLANK_STDDEV_THRESHOLD:
+            plans[img_file] = ('blank', BLANK_PAGE_DESCRIPTION)
+            continue
+
+        same_chapter = next((rep for rep_hash, rep in representatives if (rep_hash ^ value).bit_count() <= PHASH_MAX_DISTANCE), None)
+        if same_chapter is not None:
+            plans[img_file] = ('duplicate', same_chapter)
+            continue
+
+        for _, comic_hash, other_chapter, other_image in find_similar_pages(value):
+            description = _read_stored_description(comic_hash, other_chapter, other_image, stored_descriptions)
+            if description:
+                plans[img_file] = ('library', description)
+                break
+        else:
+            representatives.append((value, img_file))
+
+    return plans, page_hashes
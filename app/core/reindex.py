@@ -0,0 +1,168 @@
+import os
+import time
+import socket
+import threading
+
+from ..utils.logger import logger
+from ..utils.metrics import REINDEX_CHAPTERS
+from ..services.openai_service import get_embeddings, EMBEDDING_MODEL
+from ..services import chroma_service
+from .summarizer import estimate_tokens
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+# 每次 embedding 请求包含的章节摘要数
+REINDEX_BATCH_SIZE = int(os.getenv('REINDEX_BATCH_SIZE', 64))
+# 重建索引的速率预算（每分钟请求数 / 估算 token 数，0 表示不限制），避免挤占正常入库的配额
+REINDEX_REQUESTS_PER_MINUTE = int(os.getenv('REINDEX_REQUESTS_PER_MINUTE', 60))
+REINDEX_TOKENS_PER_MINUTE = int(os.getenv('REINDEX_TOKENS_PER_MINUTE', 200000))
+# EMBEDDING_MODEL 与当前集合的模型不一致时，是否在 Web 进程中自动启动后台重建
+REINDEX_AUTO = os.getenv('REINDEX_AUTO', 'True').lower() == 'true'
+REINDEX_LEASE_SECONDS = 300
+REINDEX_OWNER = f"{socket.gethostname()}-{os.getpid()}"
+
+class RateBudget:
+    """按分钟补充的请求数和 token 数预算，acquire 在预算不足时阻塞。"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60.0)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60.0)
+
+    def acquire(self, tokens):
+        # 单批超过整分钟预算时按整分钟预算计，否则永远等不到
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            self._refill()
+            waits = []
+            if self.requests_per_minute and self._requests < 1:
+                waits.append((1 - self._requests) * 60.0 / self.requests_per_minute)
+            if self.tokens_per_minute and self._tokens < tokens:
+                waits.append((tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+            if not waits:
+                self._requests -= 1
+                self._tokens -= tokens
+                return
+            time.sleep(max(waits))
+
+def scan_chapter_summaries():
+    """列出磁盘上全部章节摘要，返回 {chapter_id: (comic_hash, 章节名, 摘要路径, 修改时间)}。"""
+    chapters = {}
+    if not os.path.exists(DATA_BASE_PATH):
+        return chapters
+    for comic_hash in os.listdir(DATA_BASE_PATH):
+        comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
+        summary_dir = os.path.join(comic_path, 'cap_summary')
+        if not os.path.exists(os.path.join(comic_path, 'info.json')) or not os.path.isdir(summary_dir):
+            continue
+        for chapter_name in os.listdir(summary_dir):
+            summary_path = os.path.join(summary_dir, chapter_name, 'summary.txt')
+            try:
+                mtime = os.path.getmtime(summary_path)
+            except OSError:
+                continue
+            chapters[f"{comic_hash}_{chapter_name}"] = (comic_hash, chapter_name, summary_path, mtime)
+    return chapters
+
+def _pending_chapters(name):
+    """返回尚未写入 name 集合、或写入后摘要又被修改的章节，以及磁盘上全部章节 ID。"""
+    chapters = scan_chapter_summaries()
+    done = chroma_service.reindex_progress(name)
+    pending = [(chapter_id, entry) for chapter_id, entry in sorted(chapters.items()) if done.get(chapter_id) != entry[3]]
+    return pending, set(chapters)
+
+def _embed_batch(name, model, batch, budget):
+    """读取一批章节摘要，按 model 生成 embedding 写入 name 集合，返回写入的章节数。"""
+    ids, documents, metadatas, done = [], [], [], []
+    for chapter_id, (comic_hash, chapter_name, summary_path, mtime) in batch:
+        try:
+            with open(summary_path, 'r', encoding='utf-8') as f:
+                summary = f.read()
+        except OSError:
+            continue  # 读取前被删除，下一轮扫描不会再出现
+        done.append((chapter_id, mtime))
+        if not summary.strip():
+            continue
+        ids.append(chapter_id)
+        documents.append(summary)
+        metadatas.append((comic_hash, chapter_name, mtime))
+    if ids:
+        # 沿用旧集合中的写入时间，保证按入库时间过滤的结果在切换前后一致
+        active = chroma_service.active_collection().get(ids=ids, include=['metadatas'])
+        ingested = {entry_id: meta.get('ingested_at') for entry_id, meta in zip(active['ids'], active['metadatas'])}
+        metadatas = [chroma_service.chapter_metadata(comic_hash, chapter_name, ingested_at=ingested.get(entry_id) or mtime)
+                     for entry_id, (comic_hash, chapter_name, mtime) in zip(ids, metadatas)]
+        budget.acquire(sum(estimate_tokens(document) for document in documents))
+        embeddings = get_embeddings(documents, model=model)
+        chroma_service.get_collection(name).upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        REINDEX_CHAPTERS.inc(len(ids))
+    chroma_service.mark_reindexed(name, done)
+    return len(ids)
+
+def run_reindex(model=EMBEDDING_MODEL, batch_size=REINDEX_BATCH_SIZE, requests_per_minute=REINDEX_REQUESTS_PER_MINUTE,
+                tokens_per_minute=REINDEX_TOKENS_PER_MINUTE, owner=REINDEX_OWNER, progress_callback=None):
+    """用 model 重新生成全部章节的 embedding 并在完成后切换搜索集合。
+
+    进度按章节记录在 index_state.db 中，中断后再次运行会从断点继续；重建期间搜索照常使用旧集合。
+    返回新集合名；已是该模型或其他进程正在重建时返回 None。
+    """
+    name = chroma_service.begin_reindex(model)
+    if name is None:
+        logger.info(f"向量集合已由模型 {model} 生成，无需重建。")
+        return None
+    if not chroma_service.claim_reindex(owner, REINDEX_LEASE_SECONDS):
+        logger.info(f"向量集合 {name} 正由其他进程重建，跳过。")
+        return None
+
+    logger.info(f"开始用模型 {model} 重建向量集合 {name}。")
+    budget = RateBudget(requests_per_minute, tokens_per_minute)
+    written = 0
+    # 重复扫描直到没有待处理章节，覆盖重建过程中摘要被修改的章节
+    while True:
+        pending, on_disk = _pending_chapters(name)
+        if not pending:
+            break
+        for start in range(0, len(pending), batch_size):
+            written += _embed_batch(name, model, pending[start:start + batch_size], budget)
+            if not chroma_service.claim_reindex(owner, REINDEX_LEASE_SECONDS):
+                logger.warning(f"向量集合 {name} 的重建租约已被其他进程接管，停止。")
+                return None
+            if progress_callback:
+                progress_callback(min(start + batch_size, len(pending)), len(pending))
+
+    # 重建期间被删除的章节可能在删除之后才写入新集合
+    target = chroma_service.get_collection(name)
+    orphans = [entry_id for entry_id in target.get(include=[])['ids'] if entry_id not in on_disk]
+    if orphans:
+        target.delete(ids=orphans)
+
+    chroma_service.switch_to_building(name)
+    logger.info(f"向量集合 {name} 重建完成，写入 {written} 个章节。")
+    return name
+
+def start_background_reindex():
+    """EMBEDDING_MODEL 与当前集合的模型不一致（或有未完成的重建）时，在后台线程中运行 run_reindex。"""
+    if not REINDEX_AUTO:
+        return
+    building = chroma_service.collection_info('building')
+    if chroma_service.collection_info('active')[1] == EMBEDDING_MODEL and not building:
+        return
+    if any(t.name == 'comic-reindex' for t in threading.enumerate()):
+        return
+
+    def run():
+        try:
+            run_reindex()
+        except Exception as e:
+            logger.error(f"重建向量索引时出错: {e}", exc_info=True)
+
+    threading.Thread(target=run, daemon=True, name='comic-reindex').start()
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import random
+import concurrent.futures
+
+from ..utils.logger import logger
+from ..utils.tracing import task_context, span
+from ..tasks import add_task, update_task_status, get_task_control, TaskCancelled
+from ..services.openai_service import SUMMARY_FAILED
+from ..services.chroma_service import add_embedding
+from ..services.suggest_index import index_chapter_terms
+from ..services.description_store import load_chapter_descriptions
+from .summarizer import summarize_chapter, save_chapter_summary, load_summary_meta, summary_is_stale
+from .page_dedup import BLANK_PAGE_DESCRIPTION
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+# 重新摘要时同时处理的章节数（每章内部的分块摘要另受 SUMMARY_MAX_CONCURRENCY 限制）
+RESUMMARIZE_MAX_CHAPTERS = int(os.getenv('RESUMMARIZE_MAX_CHAPTERS', 4))
+
+def find_stale_chapters(comic_hash, force=False):
+    """返回漫画中摘要需要重新生成的章节；force 为 True 时返回全部有页面描述的章节。"""
+    comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
+    summary_dir = os.path.join(comic_path, 'cap_summary')
+    if not os.path.isdir(summary_dir):
+        return []
+    chapters = []
+    for chapter_name in sorted(os.listdir(summary_dir)):
+        if not os.path.isdir(os.path.join(comic_path, 'pic_detail', chapter_name)):
+            continue
+        if force or summary_is_stale(load_summary_meta(os.path.join(summary_dir, chapter_name))):
+            chapters.append(chapter_name)
+    return chapters
+
+def _stored_page_descriptions(chapter_pic_detail_path, pages):
+    """按页序读取已保存的页面描述，返回 (页面列表, 描述列表)。
+
+    pages 为上次参与摘要的页面；早期入库的章节没有记录时按 manifest 顺序读取，
+    并跳过空白页和与前面页面描述完全相同的页面（章节内重复页直接复制了代表页的描述）。
+    """
+    stored = load_chapter_descriptions(chapter_pic_detail_path)
+    if pages is None:
+        try:
+            with open(os.path.join(chapter_pic_detail_path, 'manifest.json'), 'r', encoding='utf-8') as f:
+                pages = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return [], []
+        deduplicate = True
+    else:
+        deduplicate = False
+
+    used_pages, descriptions, seen = [], [], set()
+    for img_file in pages:
+        description = stored.get(img_file)
+        if not description:
+            continue
+        if deduplicate:
+            if description == BLANK_PAGE_DESCRIPTION or description in seen:
+                continue
+            seen.add(description)
+        used_pages.append(img_file)
+        descriptions.append(description)
+    return used_pages, descriptions
+
+def _resummarize_chapter(task_id, comic_hash, chapter_name):
+    """用已保存的页面描述重新生成单个章节的摘要和 embedding。成功返回 True。"""
+    comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
+    chapter_summary_path = os.path.join(comic_path, 'cap_summary', chapter_name)
+    meta = load_summary_meta(chapter_summary_path)
+    pages, descriptions = _stored_page_descriptions(os.path.join(comic_path, 'pic_detail', chapter_name), meta.get('pages'))
+    if not descriptions:
+        logger.warning(f"[{task_id}] 章节 {chapter_name} 没有可用的页面描述，跳过。", extra={'task_id': task_id, 'chapter': chapter_name})
+        return False
+
+    cache_dir = os.path.join(comic_path, 'summary_cache')
+    cache_keys = set()
+    chapter_summary = summarize_chapter(descriptions, task_id, chapter_name, cache_dir=cache_dir, cache_keys=cache_keys)
+    if chapter_summary == SUMMARY_FAILED:
+        # 保留旧摘要，元数据仍为旧版本，下次运行会重试
+        logger.error(f"[{task_id}] 章节 {chapter_name} 重新摘要失败，保留旧摘要。", extra={'task_id': task_id, 'chapter': chapter_name})
+        return False
+
+    save_chapter_summary(chapter_summary_path, chapter_summary, pages, cache_dir, cache_keys)
+    add_embedding(comic_hash, chapter_name, chapter_summary)
+    index_chapter_terms(comic_hash, chapter_name, chapter_summary)
+    logger.info(f"[{task_id}] [摘要完成] 章节 {chapter_name} 已重新摘要。", extra={'task_id': task_id, 'chapter': chapter_name})
+    return True
+
+def _traced_resummarize_chapter(task_id, comic_hash, chapter_name):
+    """在线程池中运行 _resummarize_chapter，并把其中的摘要、embedding 阶段记到任务追踪下。
+
+    任务暂停时等待恢复后重做该章节，取消时抛出 TaskCancelled。
+    """
+    control = get_task_control(task_id)
+    with task_context(task_id), span('chapter', 'chapter', chapter=chapter_name):
+        if control is None:
+            return _resummarize_chapter(task_id, comic_hash, chapter_name)
+        return control.run(_resummarize_chapter, task_id, comic_hash, chapter_name)
+
+def _resummarize_comic(task):
+    """任务处理函数：并行重新摘要一部漫画中过期的章节。
+
+    每个章节完成后立即写入摘要元数据，任务中断后再次运行只会处理剩余的章节。
+    """
+    task_id = task['task_id']
+    comic_hash = task['comic_hash']
+    chapters = find_stale_chapters(comic_hash, force=task.get('force', False))
+    total = len(chapters)
+    update_task_status(task_id, {'status': '正在处理', 'details': f'需要重新摘要 {total} 个章节'})
+
+    done, failed = 0, 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=RESUMMARIZE_MAX_CHAPTERS) as executor:
+        futures = {executor.submit(_traced_resummarize_chapter, task_id, comic_hash, chapter_name): chapter_name for chapter_name in chapters}
+        for future in concurrent.futures.as_completed(futures):
+            chapter_name = futures[future]
+            try:
+                ok = future.result()
+            except TaskCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"[{task_id}] 重新摘要章节 {chapter_name} 时出错: {e}", exc_info=True, extra={'task_id': task_id, 'chapter': chapter_name})
+                ok = False
+            done += ok
+            failed += not ok
+            update_task_status(task_id, {'status': 'AI处理中', 'progress': (done + failed) / total * 100,
+                                         'details': f'已重新摘要 {done}/{total} 个章节，失败 {failed} 个'})
+
+    status = '失败' if failed and not done else '完成'
+    update_task_status(task_id, {'status': status, 'progress': 100, 'end_time': time.time(),
+                                 'details': f'重新摘要完成：成功 {done}，失败 {failed}，共 {total} 个章节。'})
+    logger.info(f"[{task_id}] 漫画 {comic_hash} 重新摘要完成：成功 {done}，失败 {failed}。", extra={'task_id': task_id})
+
+def resummarize_comic(comic_hash, force=False):
+    """将漫画的重新摘要任务加入队列，返回任务 ID；没有需要处理的章节时返回 None。"""
+    if not find_stale_chapters(comic_hash, force=force):
+        return None
+    try:
+        with open(os.path.join(DATA_BASE_PATH, comic_hash, 'info.json'), 'r', encoding='utf-8') as f:
+            comic_name = json.load(f).get('name', comic_hash)
+    except (FileNotFoundError, json.JSONDecodeError):
+        comic_name = comic_hash
+    task_id = f"{time.time_ns()}-{random.randint(1000, 9999)}-resummarize-{comic_hash}"
+    add_task({'task_id': task_id, 'comic_name': f"{comic_name}（重新摘要）", 'comic_hash': comic_hash, 'force': force}, _resummarize_comic)
+    return task_id
+
+def resummarize_library(force=False):
+    """为库中每部有过期章节的漫画加入重新摘要任务，返回任务 ID 列表。"""
+    task_ids = []
+    if not os.path.exists(DATA_BASE_PATH):
+        return task_ids
+    for comic_hash in sorted(os.listdir(DATA_BASE_PATH)):
+        if not os.path.exists(os.path.join(DATA_BASE_PATH, comic_hash, 'info.json')):
+            continue
+        task_id = resummarize_comic(comic_hash, force=force)
+        if task_id:
+            task_ids.append(task_id)
+    return task_ids
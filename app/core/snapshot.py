@@ -0,0 +1,344 @@
+import os
+import io
+import gzip
+import json
+import lzma
+import time
+import zlib
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import numpy as np
+
+from ..utils.logger import logger
+from ..services import chroma_service
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+# 最近一次导入的快照；增量快照只能应用在其基准快照之上
+SNAPSHOT_STATE_PATH = os.path.join(DATA_BASE_PATH, 'snapshot.json')
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = 'manifest.json'
+VECTOR_BATCH_SIZE = 256
+
+# --- 库快照 ---
+# 供只读搜索节点复制用的一致快照：漫画信息、封面、章节摘要、页面描述，以及 active 集合的全部向量。
+# 页面图片（pic/）和各类本地索引（页面哈希、搜索建议等）不包含在内，搜索节点按需自行重建。
+# 归档为 tar（默认 gzip），成员：
+#   files/<相对 DATA_BASE_PATH 的路径>       新增或变化的文件
+#   vectors/records.jsonl                    新增或变化的向量：{"id", "document", "metadata"}
+#   vectors/embeddings.f32                   与 records 逐行对应的 float32 向量
+#   manifest.json                            完整的文件、向量清单（含校验和）以及本次的删除列表，最后写入
+# 另在归档旁写出 <归档>.sha256 和 <归档>.manifest.json，后者可直接作为下一次增量快照的基准。
+_COMIC_FILES = ('info.json', 'cover.png')
+_COMIC_DIRS = ('cap_summary', 'pic_detail')
+_COMPRESSION_MODES = {'gz': 'w:gz', 'xz': 'w:xz', 'none': 'w'}
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _library_files():
+    """列出快照包含的文件，返回相对 DATA_BASE_PATH、以 / 分隔的路径。"""
+    if not os.path.exists(DATA_BASE_PATH):
+        return
+    for comic_hash in sorted(os.listdir(DATA_BASE_PATH)):
+        comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
+        if not os.path.isfile(os.path.join(comic_path, 'info.json')):
+            continue
+        for name in _COMIC_FILES:
+            if os.path.isfile(os.path.join(comic_path, name)):
+                yield f"{comic_hash}/{name}"
+        for sub in _COMIC_DIRS:
+            for root, dirs, files in os.walk(os.path.join(comic_path, sub)):
+                dirs.sort()
+                rel_root = os.path.relpath(root, DATA_BASE_PATH).replace(os.sep, '/')
+                for name in sorted(files):
+                    if not name.endswith('.tmp'):
+                        yield f"{rel_root}/{name}"
+
+def _local_path(root, rel):
+    return os.path.join(root, *rel.split('/'))
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+def _vector_digest(vector, document, metadata):
+    digest = hashlib.sha256(vector.tobytes())
+    digest.update((document or '').encode('utf-8'))
+    digest.update(json.dumps(metadata, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def _iter_vectors(store):
+    ids = store.get(include=[])['ids']
+    for start in range(0, len(ids), VECTOR_BATCH_SIZE):
+        batch = store.get(ids=ids[start:start + VECTOR_BATCH_SIZE], include=['embeddings', 'documents', 'metadatas'])
+        yield from zip(batch['ids'], batch['embeddings'], batch['documents'], batch['metadatas'])
+
+def load_manifest(path):
+    """读取快照清单。path 可以是 .manifest.json，也可以是归档本身（优先读取旁边的 .manifest.json）。"""
+    if not path.endswith('.manifest.json') and os.path.exists(path + '.manifest.json'):
+        path = path + '.manifest.json'
+    if path.endswith('.manifest.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    with tarfile.open(path, 'r:*') as tar:
+        for member in tar:
+            if member.name == MANIFEST_NAME:
+                return json.load(tar.extractfile(member))
+    raise ValueError(f"{path} 中没有快照清单")
+
+def _export_files(tar, base_files, members):
+    """写入新增或内容变化的文件，返回完整的文件清单 {路径: [大小, mtime_ns, sha256]}。
+
+    大小和修改时间与基准一致的文件直接沿用基准的记录，不再读取。先 stat 后读取，
+    读取期间被修改的文件在下一次快照中修改时间不同，会被重新比较。
+    """
+    files = {}
+    for rel in _library_files():
+        path = _local_path(DATA_BASE_PATH, rel)
+        entry = base_files.get(rel)
+        try:
+            st = os.stat(path)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                files[rel] = entry
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue  # 导出期间被删除
+        sha = hashlib.sha256(data).hexdigest()
+        files[rel] = [st.st_size, st.st_mtime_ns, sha]
+        if entry and entry[2] == sha:
+            continue
+        _add_bytes(tar, 'files/' + rel, data)
+        members['files/' + rel] = sha
+    return files
+
+def _export_vectors(tar, work_dir, store, base_vectors, members):
+    """写入新增或变化的向量，返回 (完整的向量清单 {id: 摘要}, 维度, 写入条数)。"""
+    records_path = os.path.join(work_dir, 'records.jsonl')
+    embeddings_path = os.path.join(work_dir, 'embeddings.f32')
+    vectors, dim, written = {}, None, 0
+    with open(records_path, 'w', encoding='utf-8') as records, open(embeddings_path, 'wb') as embeddings:
+        for chapter_id, embedding, document, metadata in _iter_vectors(store):
+            vector = np.asarray(embedding, dtype=np.float32)
+            dim = len(vector)
+            digest = vectors[chapter_id] = _vector_digest(vector, document, metadata)
+            if base_vectors.get(chapter_id) == digest:
+                continue
+            records.write(json.dumps({'id': chapter_id, 'document': document, 'metadata': metadata}, ensure_ascii=False) + '\n')
+            embeddings.write(vector.tobytes())
+            written += 1
+    for member, path in (('vectors/records.jsonl', records_path), ('vectors/embeddings.f32', embeddings_path)):
+        members[member] = _sha256_file(path)
+        tar.add(path, arcname=member)
+    return vectors, dim, written
+
+def export_snapshot(path, since=None, compression='gz'):
+    """导出库快照到 path，返回清单。
+
+    since 为基准快照（归档或其 .manifest.json）时只导出之后的变化；期间 active 集合被切换过时向量全量导出。
+    导出全程持有向量集合的写入屏障，入库、删除等操作的向量写入会等待导出结束。
+    """
+    base = load_manifest(since) if since else None
+    snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(4).hex()}"
+    started = time.monotonic()
+    members = {}
+    tmp_path = path + '.tmp'
+    with tempfile.TemporaryDirectory() as work_dir, chroma_service.vector_write_lock():
+        name, model = chroma_service.collection_info('active')
+        same_collection = base is not None and base['collection']['name'] == name
+        base_vectors = base['vectors'] if same_collection else {}
+        base_files = base['files'] if base else {}
+        with tarfile.open(tmp_path, _COMPRESSION_MODES[compression]) as tar:
+            files = _export_files(tar, base_files, members)
+            vectors, dim, written = _export_vectors(tar, work_dir, chroma_service.get_collection(name), base_vectors, members)
+            manifest = {
+                'format': SNAPSHOT_FORMAT,
+                'snapshot_id': snapshot_id,
+                'base': base['snapshot_id'] if base else None,
+                'created_at': time.time(),
+                'index_generation': chroma_service.get_index_generation(),
+                'collection': {'name': name, 'model': model, 'dim': dim},
+                'files': files,
+                'vectors': vectors,
+                'deleted_files': sorted(set(base_files) - set(files)),
+                'deleted_vectors': sorted(set(base_vectors) - set(vectors)),
+                'written_vectors': written,
+                'members': members,
+            }
+            _add_bytes(tar, MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+    os.replace(tmp_path, path)
+
+    with open(path + '.manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    with open(path + '.sha256', 'w', encoding='utf-8') as f:
+        f.write(f"{_sha256_file(path)}  {os.path.basename(path)}\n")
+    logger.info(f"快照 {snapshot_id} 已导出到 {path}（{'增量，基于 ' + base['snapshot_id'] if base else '完整'}）："
+                f"{len(members) - 2} 个文件、{written} 条向量，删除 {len(manifest['deleted_files'])} 个文件、"
+                f"{len(manifest['deleted_vectors'])} 条向量，用时 {time.monotonic() - started:.1f} 秒。")
+    return manifest
+
+def _verify_archive(path):
+    """按旁边的 .sha256 校验整个归档（没有时跳过，之后仍会逐个校验成员）。"""
+    try:
+        with open(path + '.sha256', 'r', encoding='utf-8') as f:
+            expected = f.read().split()[0]
+    except FileNotFoundError:
+        return
+    if _sha256_file(path) != expected:
+        raise ValueError(f"快照 {path} 的校验和不匹配，归档可能已损坏")
+
+def _extract(path, staging):
+    """把归档解到 staging 并计算每个成员的 sha256，返回 (清单, {成员: sha256})。只接受预期的普通文件成员。"""
+    try:
+        return _extract_members(path, staging)
+    except (tarfile.TarError, EOFError, zlib.error, gzip.BadGzipFile, lzma.LZMAError, json.JSONDecodeError) as e:
+        raise ValueError(f"无法读取快照 {path}: {e}")
+
+def _extract_members(path, staging):
+    manifest, received = None, {}
+    with tarfile.open(path, 'r:*') as tar:
+        for member in tar:
+            name = member.name
+            parts = name.split('/')
+            if not member.isfile() or name.startswith('/') or '..' in parts or '' in parts:
+                raise ValueError(f"快照中有不安全的成员: {name}")
+            source = tar.extractfile(member)
+            if name == MANIFEST_NAME:
+                manifest = json.load(source)
+                continue
+            if parts[0] not in ('files', 'vectors'):
+                raise ValueError(f"快照中有未知的成员: {name}")
+            target = _local_path(staging, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            digest = hashlib.sha256()
+            with open(target, 'wb') as f:
+                for block in iter(lambda: source.read(1024 * 1024), b''):
+                    digest.update(block)
+                    f.write(block)
+            received[name] = digest.hexdigest()
+    if manifest is None:
+        raise ValueError(f"{path} 中没有快照清单")
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"不支持的快照格式: {manifest.get('format')}")
+    for name, sha in manifest['members'].items():
+        if received.get(name) != sha:
+            raise ValueError(f"快照成员 {name} 缺失或校验和不匹配")
+    return manifest, received
+
+def load_snapshot_state():
+    try:
+        with open(SNAPSHOT_STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _library_is_empty():
+    return next(_library_files(), None) is None
+
+def _remove_library_file(rel):
+    """删除库中的文件；漫画的 info.json 被删除时移除整个漫画目录，否则清理留下的空目录。"""
+    comic_hash = rel.split('/')[0]
+    comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
+    if rel == f"{comic_hash}/info.json":
+        shutil.rmtree(comic_path, ignore_errors=True)
+        return
+    path = _local_path(DATA_BASE_PATH, rel)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    parent = os.path.dirname(path)
+    while os.path.abspath(parent) != os.path.abspath(comic_path) and os.path.isdir(parent) and not os.listdir(parent):
+        os.rmdir(parent)
+        parent = os.path.dirname(parent)
+
+def _import_vectors(store, staging, dim):
+    """按批把暂存的向量写入 store，返回写入条数。向量文件以内存映射方式读取。"""
+    embeddings_path = os.path.join(staging, 'vectors', 'embeddings.f32')
+    if not dim or not os.path.getsize(embeddings_path):
+        return 0
+    embeddings = np.memmap(embeddings_path, dtype=np.float32, mode='r').reshape(-1, dim)
+    written = 0
+    batch = []
+    with open(os.path.join(staging, 'vectors', 'records.jsonl'), 'r', encoding='utf-8') as f:
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) == VECTOR_BATCH_SIZE:
+                written = _upsert_batch(store, batch, embeddings, written)
+                batch = []
+    if batch:
+        written = _upsert_batch(store, batch, embeddings, written)
+    return written
+
+def _upsert_batch(store, batch, embeddings, offset):
+    store.upsert(ids=[record['id'] for record in batch], embeddings=np.asarray(embeddings[offset:offset + len(batch)]).tolist(),
+                 documents=[record['document'] for record in batch], metadatas=[record['metadata'] for record in batch])
+    return offset + len(batch)
+
+def import_snapshot(path, force=False):
+    """导入快照，返回清单。
+
+    完整快照只能导入空库，force 为 True 时把现有库替换为快照内容；增量快照必须基于本库最近导入的快照。
+    先校验全部成员再修改库：写入文件、写入向量、删除向量并切换集合，最后删除文件，
+    搜索在导入过程中始终可用。
+    """
+    _verify_archive(path)
+    state = load_snapshot_state()
+    staging = os.path.join(DATA_BASE_PATH, f'.snapshot-import-{os.getpid()}')
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    started = time.monotonic()
+    try:
+        manifest, _ = _extract(path, staging)
+        full = manifest['base'] is None
+        if full and not force and not _library_is_empty():
+            raise ValueError("目标库不为空，完整快照需要 --force 才能替换现有内容")
+        if not full and state.get('snapshot_id') != manifest['base']:
+            raise ValueError(f"增量快照基于 {manifest['base']}，而本库最近导入的快照是 {state.get('snapshot_id') or '（无）'}")
+
+        name, model = manifest['collection']['name'], manifest['collection']['model']
+        with chroma_service.vector_write_lock():
+            for member in manifest['members']:
+                if member.startswith('files/'):
+                    target = _local_path(DATA_BASE_PATH, member[len('files/'):])
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(_local_path(staging, member), target)
+
+            # 集合与当前 active 不同（首次导入或源库切换过集合）时写入新集合后整体切换
+            switch = chroma_service.collection_info('active') != (name, model)
+            store = chroma_service.get_collection(name)
+            written = _import_vectors(store, staging, manifest['collection']['dim'])
+            if full or switch:
+                stale = sorted(set(store.get(include=[])['ids']) - set(manifest['vectors']))
+            else:
+                stale = manifest['deleted_vectors']
+            for start in range(0, len(stale), VECTOR_BATCH_SIZE):
+                store.delete(ids=stale[start:start + VECTOR_BATCH_SIZE])
+            if switch:
+                chroma_service.adopt_collection(name, model)
+            else:
+                chroma_service.bump_index_generation()
+
+        deleted_files = set(manifest['deleted_files'])
+        if full:
+            deleted_files |= set(_library_files()) - set(manifest['files'])
+        for rel in sorted(deleted_files):
+            _remove_library_file(rel)
+
+        with open(SNAPSHOT_STATE_PATH + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'snapshot_id': manifest['snapshot_id'], 'created_at': manifest['created_at'], 'imported_at': time.time()}, f)
+        os.replace(SNAPSHOT_STATE_PATH + '.tmp', SNAPSHOT_STATE_PATH)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"快照 {manifest['snapshot_id']} 已导入：{len(manifest['members']) - 2} 个文件、{written} 条向量，"
+                f"删除 {len(deleted_files)} 个文件、{len(stale)} 条向量，用时 {time.monotonic() - started:.1f} 秒。")
+    return manifest
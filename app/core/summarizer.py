@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import hashlib
+import concurrent.futures
+
+from ..utils.logger import logger
+from ..utils.metrics import SUMMARY_CHUNK_CACHE
+from ..utils.tracing import span
+from ..tasks import TaskInterrupted
+from ..services.openai_service import (
+    summarize_text, SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, SUMMARY_FAILED,
+    CHUNK_SUMMARY_PROMPT, REDUCE_SUMMARY_PROMPT
+)
+
+# single: 整章一次请求；mapreduce: 总是分块摘要再合并；auto: 超出单块预算时才分块
+SUMMARY_MODE = os.getenv('SUMMARY_MODE', 'auto').lower()
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', 6000))
+# 每块的页数；未设置时按单页描述约 PAGE_TOKENS_ESTIMATE 个 token 从预算折算
+PAGE_TOKENS_ESTIMATE = 500
+SUMMARY_CHUNK_PAGES = int(os.getenv('SUMMARY_CHUNK_PAGES') or 0) or max(1, SUMMARY_CHUNK_TOKENS // PAGE_TOKENS_ESTIMATE)
+SUMMARY_MAX_CONCURRENCY = int(os.getenv('SUMMARY_MAX_CONCURRENCY', 4))
+# 与 summary.txt 同目录，记录生成摘要时的模型、提示词版本和参与摘要的页面
+SUMMARY_META_FILE = 'summary.json'
+CHUNK_SUMMARY_MAX_TOKENS = 2048
+REDUCE_SUMMARY_MAX_TOKENS = 4096
+MAX_REDUCE_DEPTH = 3
+
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """粗略估算 token 数：CJK 字符按 1 个计，其余按约 4 个字符 1 个计。"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def chunk_descriptions(descriptions, size=SUMMARY_CHUNK_PAGES):
+    """按固定条数将连续的页面描述分组。
+
+    分界只取决于位置而不取决于内容，修改某一页只会让它所在的块缓存失效，后续块的缓存键不变。
+    """
+    return [descriptions[n:n + size] for n in range(0, len(descriptions), size)]
+
+def _cache_key(kind, text):
+    digest = hashlib.sha256(f"{kind}\0{SUMMARY_MODEL}\0{SUMMARY_PROMPT_VERSION}\0{text}".encode('utf-8')).hexdigest()
+    return f"{kind}-{digest}"
+
+def _summarize_cached(text, task_id, chapter_name, kind, prompt, log_key, max_tokens, cache_dir, cache_keys=None):
+    """带缓存的单次摘要请求。缓存以内容、模型和提示词版本为键；请求失败时 summarize_text 抛出 SummaryError，不会写入缓存。"""
+    key = _cache_key(kind, text)
+    if cache_keys is not None:
+        cache_keys.add(key)
+    cache_path = os.path.join(cache_dir, key + '.txt') if cache_dir else None
+    if cache_path:
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                summary = f.read()
+            SUMMARY_CHUNK_CACHE.inc(result='hit')
+            return summary
+        except FileNotFoundError:
+            pass  # 未缓存，或刚被并行处理的其他章节清理掉
+    SUMMARY_CHUNK_CACHE.inc(result='miss')
+
+    with span(f'summary_{kind}', 'summary', task_id=task_id, chapter=chapter_name):
+        summary = "".join(summarize_text(text, task_id, chapter_name, system_prompt=prompt, log_key=log_key, max_tokens=max_tokens))
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(summary)
+        os.replace(tmp_path, cache_path)
+    return summary
+
+def _map_reduce(texts, task_id, chapter_name, cache_dir, cache_keys=None, depth=0):
+    """分块并行摘要，再合并；合并输入仍超出预算时递归分层。
+
+    第 0 层按 SUMMARY_CHUNK_PAGES 页一块；更高层的输入是分块摘要，按其输出上限折算每块条数。
+    """
+    size = SUMMARY_CHUNK_PAGES if depth == 0 else max(2, SUMMARY_CHUNK_TOKENS // CHUNK_SUMMARY_MAX_TOKENS)
+    chunks = chunk_descriptions(texts, size)
+    label = f"L{depth}" if depth else ''
+    logger.info(f"[{task_id}] 章节 {chapter_name} 分为 {len(chunks)} 块进行摘要 (层级 {depth})。", extra={'task_id': task_id, 'chapter': chapter_name})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SUMMARY_MAX_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(_summarize_cached, "\n\n".join(chunk), task_id, chapter_name, 'chunk', CHUNK_SUMMARY_PROMPT,
+                            f"summary_{chapter_name}_part{label}{n + 1}", CHUNK_SUMMARY_MAX_TOKENS, cache_dir, cache_keys)
+            for n, chunk in enumerate(chunks)
+        ]
+        partial_summaries = [future.result() for future in futures]
+
+    combined = [f"[第 {n + 1} 段]\n{summary}" for n, summary in enumerate(partial_summaries)]
+    # 更高层每块至少两条，递归时块数必然减少
+    if (len(chunks) > 1 and depth < MAX_REDUCE_DEPTH
+            and estimate_tokens("\n\n".join(combined)) > SUMMARY_CHUNK_TOKENS):
+        return _map_reduce(combined, task_id, chapter_name, cache_dir, cache_keys, depth + 1)
+
+    return _summarize_cached("\n\n".join(combined), task_id, chapter_name, 'reduce', REDUCE_SUMMARY_PROMPT,
+                             f"summary_{chapter_name}", REDUCE_SUMMARY_MAX_TOKENS, cache_dir, cache_keys)
+
+def summarize_chapter(page_descriptions, task_id, chapter_name, cache_dir=None, cache_keys=None):
+    """生成章节摘要。根据 SUMMARY_MODE 选择整章单次请求或分块 map-reduce。
+
+    cache_dir 用于保存分块摘要，内容未变化的块在重新处理时直接复用；cache_keys 为集合时收集本次用到的缓存键，
+    传给 save_chapter_summary 以清理不再使用的缓存。
+    任一请求失败（包括输出到一半中断）时返回 SUMMARY_FAILED，调用方不得保存或索引该结果。
+    """
+    full_description_text = "\n\n".join(page_descriptions)
+    use_map_reduce = SUMMARY_MODE == 'mapreduce' or (
+        SUMMARY_MODE == 'auto' and estimate_tokens(full_description_text) > SUMMARY_CHUNK_TOKENS
+    )
+    try:
+        if not use_map_reduce:
+            return "".join(summarize_text(full_description_text, task_id, chapter_name))
+        return _map_reduce(page_descriptions, task_id, chapter_name, cache_dir, cache_keys)
+    except TaskInterrupted:
+        raise
+    except Exception as e:
+        logger.error(f"[{task_id}] 章节 {chapter_name} 摘要失败: {e}", extra={'task_id': task_id, 'chapter': chapter_name})
+        return SUMMARY_FAILED
+
+def save_chapter_summary(chapter_summary_path, chapter_summary, pages, cache_dir=None, cache_keys=None):
+    """写入 summary.txt 及其元数据；pages 为参与摘要的页面文件名（已排除空白页和章节内重复页）。
+
+    cache_keys 为本次摘要用到的分块缓存键，记录在元数据中；给出 cache_dir 时随后清理没有任何章节引用的缓存。
+    """
+    with open(os.path.join(chapter_summary_path, 'summary.txt'), 'w', encoding='utf-8') as f:
+        f.write(chapter_summary)
+    meta = {'model': SUMMARY_MODEL, 'prompt_version': SUMMARY_PROMPT_VERSION, 'pages': pages}
+    if cache_keys is not None:
+        meta['cache_keys'] = sorted(cache_keys)
+    with open(os.path.join(chapter_summary_path, SUMMARY_META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=4)
+    if cache_dir:
+        prune_summary_cache(cache_dir, os.path.dirname(chapter_summary_path))
+
+def prune_summary_cache(cache_dir, summary_base_path):
+    """删除分块摘要缓存中没有被 summary_base_path 下任何章节元数据引用的条目，返回删除的条目数。
+
+    缓存在同一部漫画的各章节间共享，因此以全部章节最近一次摘要用到的键的并集为准。
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    referenced = set()
+    if os.path.isdir(summary_base_path):
+        for chapter_name in os.listdir(summary_base_path):
+            referenced.update(load_summary_meta(os.path.join(summary_base_path, chapter_name)).get('cache_keys', ()))
+    removed = 0
+    for name in os.listdir(cache_dir):
+        # .tmp 为正在写入的缓存，留给写入方处理
+        if name.endswith('.txt') and name[:-len('.txt')] not in referenced:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+def load_summary_meta(chapter_summary_path):
+    """读取章节摘要元数据。早期入库的章节没有元数据，视为提示词版本 1、模型未知。"""
+    try:
+        with open(os.path.join(chapter_summary_path, SUMMARY_META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'model': None, 'prompt_version': 1, 'pages': None}
+
+def summary_is_stale(meta):
+    """摘要由旧版提示词或其他摘要模型生成时返回 True。"""
+    if meta.get('prompt_version') != SUMMARY_PROMPT_VERSION:
+        return True
+    return meta.get('model') is not None and meta.get('model') != SUMMARY_MODEL
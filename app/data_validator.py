@@ -1,6 +1,6 @@
 import os
 import shutil
-from .services.chroma_service import collection, delete_by_chapter_id
+from .services.chroma_service import active_collection, delete_by_chapter_id
 from .models import DATA_BASE_PATH, delete_chapter
 
 def get_filesystem_data():
@@ -19,7 +19,7 @@ def get_filesystem_data():
 def get_chromadb_data():
     """获取ChromaDB中的所有漫画章节数据"""
     chroma_data = set()
-    results = collection.get()
+    results = active_collection().get()
     for i in range(len(results['ids'])):
         meta = results['metadatas'][i]
         comic_hash = meta['comic_hash']
@@ -1,12 +1,16 @@
 import os
 import json
 import shutil
-import io
 import re
 
 from .utils.logger import logger
-from .services.chroma_service import delete_by_comic_hash, delete_by_chapter_id, rename_chapter_embedding, search_by_embedding
-from .services.openai_service import get_embedding
+from .services.chroma_service import delete_by_comic_hash, delete_by_chapter_id, rename_chapter_embedding, search_by_embedding, bump_index_generation, refresh_comic_metadata, collection_info
+from .services.search_cache import search_result_cache, get_query_embedding
+from .services.phash_service import delete_page_hashes, rename_page_hashes, delete_page_images, rename_page_images, search_pages_by_image
+from .services.suggest_index import delete_chapter_terms, rename_chapter_terms
+from .services.page_store import open_page
+from .services.description_store import load_chapter_records
+from .utils.metrics import SEARCH_SECONDS, IMAGE_SEARCH_SECONDS
 
 DATA_BASE_PATH = './data/comicdb'
 
@@ -46,6 +50,11 @@ def update_comic_info(comic_hash, new_data):
             json.dump(data, f, ensure_ascii=False, indent=4)
             f.truncate()
         
+        if 'tags' in new_data:
+            # 标签保存在章节向量的元数据中，供按标签过滤搜索
+            refresh_comic_metadata(comic_hash)
+        # 搜索结果中包含漫画名称，需使缓存失效
+        bump_index_generation()
         logger.info(f"漫画 {comic_hash} 的信息已更新: {new_data}")
         return True, "漫画信息更新成功"
     except Exception as e:
@@ -61,6 +70,9 @@ def delete_comic(comic_hash, processing_statuses):
             logger.info(f"已从文件系统删除漫画目录: {comic_path}")
         
         delete_by_comic_hash(comic_hash)
+        delete_page_hashes(comic_hash)
+        delete_page_images(comic_hash)
+        delete_chapter_terms(comic_hash)
         
         if comic_hash in processing_statuses:
             del processing_statuses[comic_hash]
@@ -92,15 +104,15 @@ def get_comic_details(comic_hash, load_page_details=False, chapter_filter=None):
                 if load_page_details and chapter_name == chapter_filter:
                     chapter_pic_path = os.path.join(pic_detail_dir, chapter_name)
                     if os.path.exists(chapter_pic_path):
+                        # 页面记录按文件名匹配，页序取 manifest；没有 manifest 时按记录顺序
+                        records = load_chapter_records(chapter_pic_path)
                         manifest_path = os.path.join(chapter_pic_path, 'manifest.json')
-                        original_filenames = []
+                        image_filenames = list(records)
                         if os.path.exists(manifest_path):
-                            with open(manifest_path, 'r', encoding='utf-8') as f: original_filenames = json.load(f)
-                        desc_files = sorted([f for f in os.listdir(chapter_pic_path) if f.endswith('.txt')], key=natural_sort_key)
-                        for i, desc_file in enumerate(desc_files):
-                            with open(os.path.join(chapter_pic_path, desc_file), 'r', encoding='utf-8') as f: description = f.read()
-                            image_filename = original_filenames[i] if i < len(original_filenames) else os.path.splitext(desc_file)[0] + '.png' # Fallback
-                            chapter_info['pages'].append({'image': image_filename, 'description': description})
+                            with open(manifest_path, 'r', encoding='utf-8') as f: image_filenames = json.load(f)
+                        for image_filename in image_filenames:
+                            if image_filename in records:
+                                chapter_info['pages'].append({'image': image_filename, 'description': records[image_filename]['description']})
                 details['chapters'].append(chapter_info)
         return details, "获取成功"
     except Exception as e:
@@ -123,6 +135,9 @@ def rename_chapter(comic_hash, old_name, new_name):
         if os.path.exists(old_pic_path): os.rename(old_pic_path, new_pic_path)
         
         rename_chapter_embedding(comic_hash, old_name, new_name)
+        rename_page_hashes(comic_hash, old_name, new_name)
+        rename_page_images(comic_hash, old_name, new_name)
+        rename_chapter_terms(comic_hash, old_name, new_name)
         
         return True, f"章节 '{old_name}' 已成功重命名为 '{new_name}'"
     except Exception as e:
@@ -130,17 +145,14 @@ def rename_chapter(comic_hash, old_name, new_name):
         return False, f"重命名失败: {e}"
 
 def get_comic_image_from_fs(comic_hash, chapter_name, image_name):
-    """从文件系统中直接读取并返回单个图片。"""
-    image_path = os.path.join(DATA_BASE_PATH, comic_hash, 'pic', chapter_name, image_name)
-    if not os.path.exists(image_path):
-        logger.warning(f"图片未找到: {image_path}")
-        return None
-    try:
-        with open(image_path, 'rb') as f:
-            return io.BytesIO(f.read())
-    except Exception as e:
-        logger.error(f"从 {image_path} 读取图片时出错: {e}")
-    return None
+    """定位单张图片：散文件返回路径，打包章节返回 page_store.PageRange，未找到时返回 None。
+
+    两种结果都可直接流式发送，不会先把整张图片读入内存。
+    """
+    page = open_page(os.path.join(DATA_BASE_PATH, comic_hash, 'pic', chapter_name), image_name)
+    if page is None:
+        logger.warning(f"图片未找到: {comic_hash}/{chapter_name}/{image_name}")
+    return page
 
 def delete_chapter(comic_hash, chapter_name):
     """删除漫画的特定章节。"""
@@ -157,17 +169,47 @@ def delete_chapter(comic_hash, chapter_name):
 
         chapter_id = f"{comic_hash}_{chapter_name}"
         delete_by_chapter_id(chapter_id)
+        delete_page_hashes(comic_hash, chapter_name)
+        delete_page_images(comic_hash, chapter_name)
+        delete_chapter_terms(comic_hash, chapter_name)
 
         return True, f"章节 '{chapter_name}' 删除成功"
     except Exception as e:
         logger.error(f"删除章节 {comic_hash}/{chapter_name} 时出错: {e}", exc_info=True)
         return False, f"删除失败: {e}"
 
-def search_comics(query, k=1000):
-    """根据用户查询在 ChromaDB 中执行语义搜索。"""
+def search_comics(query, k=1000, where=None):
+    """根据用户查询在 ChromaDB 中执行语义搜索。where 为 chroma_service.build_where 构造的范围条件。"""
     if not query: return []
-    query_embedding = get_embedding(query)
-    results = search_by_embedding(query_embedding, k)
+    with SEARCH_SECONDS.time():
+        return search_result_cache.get_or_compute(query, k, _search_comics, where)
+
+def search_comics_by_image(image_file, limit=20):
+    """以图搜图：在页面感知哈希索引中查找与截图相近的页面，不调用任何模型。
+
+    image_file 为路径或文件对象，返回按距离升序的页面列表。
+    """
+    with IMAGE_SEARCH_SECONDS.time():
+        matches = search_pages_by_image(image_file, limit=limit)
+    names = {}
+    results = []
+    for distance, comic_hash, chapter, image, region in matches:
+        if comic_hash not in names:
+            try:
+                with open(os.path.join(DATA_BASE_PATH, comic_hash, 'info.json'), 'r', encoding='utf-8') as f:
+                    names[comic_hash] = json.load(f).get('name', '未知漫画')
+            except FileNotFoundError:
+                names[comic_hash] = '未知漫画'
+        results.append({'title': names[comic_hash], 'hash': comic_hash, 'chapter': chapter, 'image': image,
+                        'region': region, 'distance': distance, 'similarity': 1 - distance / 64})
+    return results
+
+def _search_comics(query, k, where=None):
+    """search_comics 的实际实现：embedding、向量查询和按漫画聚合。"""
+    # 查询须使用当前集合的 embedding 模型；重建索引期间仍是旧模型，切换后才改用新模型
+    collection_name, model = collection_info('active')
+    query_embedding = get_query_embedding(query, model)
+    results = search_by_embedding(query_embedding, k, where, collection_name=collection_name)
     if not results or not results['ids'][0]: return []
 
     comic_scores = {}
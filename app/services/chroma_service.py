@@ -1,54 +1,429 @@
 import os
-import chromadb
+import re
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
 
 from ..utils.logger import logger
+from ..utils.metrics import CHROMA_WRITE_SECONDS, CHROMA_QUERY_SECONDS
+from ..utils.tracing import span
+from .vector_store import NumpyVectorStore
+from .openai_service import get_embedding, EMBEDDING_MODEL
 
 # --- 路径和数据库配置 ---
 DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
 CHROMA_PATH = os.path.join(DATA_BASE_PATH, 'chroma')
+VECTOR_STORE_PATH = os.path.join(DATA_BASE_PATH, 'vectors')
+# chroma: ChromaDB HNSW 索引；numpy: 内存映射的 float16/int8 数组 + 精确检索
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma').lower()
+VECTOR_DTYPE = os.getenv('VECTOR_DTYPE', 'float16').lower()
+# 索引代数：每次写入或删除向量时递增，搜索结果缓存据此判断是否过期（跨进程共享）
+INDEX_STATE_PATH = os.path.join(DATA_BASE_PATH, 'index_state.db')
+# 向量集合的写入屏障（见 vector_write_lock）
+BARRIER_PATH = os.path.join(DATA_BASE_PATH, 'vector_barrier.db')
+# 最初的章节集合名；重建索引时生成带版本后缀的新集合
+DEFAULT_COLLECTION = 'comic_chapters'
 os.makedirs(DATA_BASE_PATH, exist_ok=True)
-os.makedirs(CHROMA_PATH, exist_ok=True)
-
-# --- ChromaDB 连接 ---
-chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-collection = chroma_client.get_or_create_collection(name="comic_chapters")
-
-def add_embedding(comic_hash, chapter_name, chapter_summary, embedding):
-    """向 ChromaDB 添加一个新的 embedding。"""
-    collection.add(
-        embeddings=[embedding],
-        documents=[chapter_summary],
-        metadatas=[{'comic_hash': comic_hash, 'chapter': chapter_name}],
-        ids=[f"{comic_hash}_{chapter_name}"]
+
+_state_local = threading.local()
+
+def _state_conn():
+    conn = getattr(_state_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(INDEX_STATE_PATH, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS state (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)')
+        conn.execute('INSERT OR IGNORE INTO state (id, generation) VALUES (1, 0)')
+        # 集合角色：active 为当前提供搜索的集合，building 为重建中的集合，retired 为切换后保留的旧集合
+        conn.execute('CREATE TABLE IF NOT EXISTS collections (role TEXT PRIMARY KEY, name TEXT NOT NULL, model TEXT NOT NULL, owner TEXT, heartbeat REAL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS reindex_progress (collection TEXT NOT NULL, chapter_id TEXT NOT NULL, mtime REAL NOT NULL, PRIMARY KEY (collection, chapter_id))')
+        # 升级前的库视为由当前 EMBEDDING_MODEL 生成
+        conn.execute("INSERT OR IGNORE INTO collections (role, name, model) VALUES ('active', ?, ?)", (DEFAULT_COLLECTION, EMBEDDING_MODEL))
+        _state_local.conn = conn
+    return conn
+
+def get_index_generation():
+    """返回当前索引代数。"""
+    return _state_conn().execute('SELECT generation FROM state WHERE id = 1').fetchone()[0]
+
+def bump_index_generation():
+    """索引内容（或搜索结果依赖的漫画信息）变化后调用，使已缓存的搜索结果失效。"""
+    _state_conn().execute('UPDATE state SET generation = generation + 1 WHERE id = 1')
+
+# --- 写入屏障 ---
+# 每次修改向量集合（以及切换 active 集合）时在 vector_barrier.db 上持有一个短暂的写事务；
+# 导出快照时在整个导出期间持有同一把锁，其他线程和进程的写入在此期间等待，快照看到的集合不会中途变化。
+# SQLite 的文件锁跨进程有效，持有者崩溃时由操作系统释放。
+_barrier_local = threading.local()
+
+@contextmanager
+def vector_write_lock():
+    """独占向量集合的写入，被快照阻塞时一直等待。同一线程内可重入。"""
+    depth = getattr(_barrier_local, 'depth', 0)
+    if depth:
+        _barrier_local.depth = depth + 1
+        try:
+            yield
+        finally:
+            _barrier_local.depth = depth
+        return
+    conn = getattr(_barrier_local, 'conn', None)
+    if conn is None:
+        conn = _barrier_local.conn = sqlite3.connect(BARRIER_PATH, timeout=30, isolation_level=None)
+    waiting = False
+    while True:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            break
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            if not waiting:
+                logger.info("向量集合正被快照导出锁定，写入等待中...")
+                waiting = True
+    _barrier_local.depth = 1
+    try:
+        yield
+    finally:
+        _barrier_local.depth = 0
+        conn.execute('COMMIT')
+
+def open_vector_store(backend=VECTOR_BACKEND, name=DEFAULT_COLLECTION):
+    """打开指定后端的章节向量集合。返回的对象实现 vector_store 模块中描述的 Collection 方法子集。"""
+    if backend == 'numpy':
+        return NumpyVectorStore(_numpy_store_path(name), dtype=VECTOR_DTYPE)
+    if backend != 'chroma':
+        raise ValueError(f"未知的向量库后端: {backend}")
+    return _chroma_client().get_or_create_collection(name=name)
+
+def drop_vector_store(name, backend=VECTOR_BACKEND):
+    """删除一个章节向量集合的全部数据。"""
+    with _stores_lock:
+        _stores.pop(name, None)
+    if backend == 'numpy':
+        shutil.rmtree(_numpy_store_path(name), ignore_errors=True)
+    elif name in [getattr(c, 'name', c) for c in _chroma_client().list_collections()]:
+        _chroma_client().delete_collection(name=name)
+    logger.info(f"已删除向量集合 {name}。")
+
+def _numpy_store_path(name):
+    return VECTOR_STORE_PATH if name == DEFAULT_COLLECTION else f"{VECTOR_STORE_PATH}-{name}"
+
+_chroma = None
+
+def _chroma_client():
+    global _chroma
+    if _chroma is None:
+        import chromadb
+        os.makedirs(CHROMA_PATH, exist_ok=True)
+        _chroma = chromadb.PersistentClient(path=CHROMA_PATH)
+    return _chroma
+
+# --- 版本化集合 ---
+# 当前使用哪个集合、由哪个 embedding 模型生成，记录在 index_state.db 中，Web 进程和独立 worker 共享。
+# 重建期间搜索仍使用 active 集合及其模型；新写入、删除和重命名同时作用于 building 集合。
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_collection(name):
+    """返回指定名称的向量集合（每个进程每个集合只打开一次）。"""
+    store = _stores.get(name)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(name)
+            if store is None:
+                store = _stores[name] = open_vector_store(name=name)
+    return store
+
+def collection_info(role='active'):
+    """返回指定角色集合的 (名称, embedding 模型)，不存在时返回 None。"""
+    row = _state_conn().execute('SELECT name, model FROM collections WHERE role = ?', (role,)).fetchone()
+    return tuple(row) if row else None
+
+def active_collection():
+    """返回当前提供搜索的向量集合。"""
+    return get_collection(collection_info('active')[0])
+
+def _write_targets():
+    """返回需要同步写入的 (角色, 集合名, 模型)：active 以及重建中的 building。"""
+    rows = _state_conn().execute("SELECT role, name, model FROM collections WHERE role IN ('active', 'building') ORDER BY role").fetchall()
+    return [tuple(row) for row in rows]
+
+def begin_reindex(model=EMBEDDING_MODEL):
+    """为 model 准备 building 集合并返回其名称；active 集合已由该模型生成时返回 None。
+
+    已有同一模型的 building 集合时沿用它（断点续跑）；模型不同的 building 集合会被丢弃。
+    """
+    conn = _state_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        active_name, active_model = conn.execute("SELECT name, model FROM collections WHERE role = 'active'").fetchone()
+        building = conn.execute("SELECT name, model FROM collections WHERE role = 'building'").fetchone()
+        if building and building[1] == model:
+            conn.execute('COMMIT')
+            return building[0]
+        abandoned = building[0] if building else None
+        name = None
+        if abandoned:
+            conn.execute("DELETE FROM collections WHERE role = 'building'")
+            conn.execute('DELETE FROM reindex_progress WHERE collection = ?', (abandoned,))
+        if active_model != model:
+            name = f"{DEFAULT_COLLECTION}_{time.time_ns()}"
+            conn.execute("INSERT INTO collections (role, name, model) VALUES ('building', ?, ?)", (name, model))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    if abandoned:
+        drop_vector_store(abandoned)
+    return name
+
+def claim_reindex(owner, lease_seconds=300):
+    """领取 building 集合的重建租约，同一时间只有一个进程执行重建；也用于续租。"""
+    now = time.time()
+    cursor = _state_conn().execute(
+        "UPDATE collections SET owner = ?, heartbeat = ? WHERE role = 'building' "
+        "AND (owner IS NULL OR owner = ? OR heartbeat < ?)",
+        (owner, now, owner, now - lease_seconds)
     )
+    return cursor.rowcount == 1
+
+def reindex_progress(name):
+    """返回 building 集合已写入的 {chapter_id: 摘要文件修改时间}。"""
+    return dict(_state_conn().execute('SELECT chapter_id, mtime FROM reindex_progress WHERE collection = ?', (name,)))
+
+def mark_reindexed(name, entries):
+    """记录 [(chapter_id, 摘要文件修改时间)] 已写入 name 集合。"""
+    conn = _state_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('INSERT OR REPLACE INTO reindex_progress (collection, chapter_id, mtime) VALUES (?, ?, ?)',
+                         [(name, chapter_id, mtime) for chapter_id, mtime in entries])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def switch_to_building(name):
+    """原子地把 building 集合 name 切换为 active，旧集合转为 retired。返回被替换的旧集合名。
+
+    之前保留的 retired 集合在切换后删除。
+    """
+    conn = _state_conn()
+    # 切换期间快照导出不会看到半切换的状态
+    with vector_write_lock():
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            building = conn.execute("SELECT name, model FROM collections WHERE role = 'building'").fetchone()
+            if not building or building[0] != name:
+                raise RuntimeError(f"集合 {name} 不在重建中，无法切换")
+            previous_retired = conn.execute("SELECT name FROM collections WHERE role = 'retired'").fetchone()
+            old_name = conn.execute("SELECT name FROM collections WHERE role = 'active'").fetchone()[0]
+            conn.execute("DELETE FROM collections WHERE role = 'retired'")
+            conn.execute("UPDATE collections SET role = 'retired', owner = NULL, heartbeat = NULL WHERE role = 'active'")
+            conn.execute("UPDATE collections SET role = 'active', owner = NULL, heartbeat = NULL WHERE role = 'building'")
+            conn.execute('DELETE FROM reindex_progress WHERE collection = ?', (name,))
+            conn.execute('UPDATE state SET generation = generation + 1 WHERE id = 1')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    logger.info(f"搜索已切换到向量集合 {name}（模型 {building[1]}），旧集合 {old_name} 已保留为 retired。")
+    if previous_retired:
+        drop_vector_store(previous_retired[0])
+    return old_name
+
+def adopt_collection(name, model):
+    """把 name 设为 active 集合（导入快照时使用）。清除重建状态，并删除其他角色的旧集合。"""
+    conn = _state_conn()
+    with vector_write_lock():
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            others = [row[0] for row in conn.execute('SELECT name FROM collections WHERE name != ?', (name,))]
+            conn.execute('DELETE FROM collections')
+            conn.execute('DELETE FROM reindex_progress')
+            conn.execute("INSERT INTO collections (role, name, model) VALUES ('active', ?, ?)", (name, model))
+            conn.execute('UPDATE state SET generation = generation + 1 WHERE id = 1')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    for other in others:
+        drop_vector_store(other)
+
+def drop_retired():
+    """删除切换后保留的旧集合，返回其名称（没有时为 None）。"""
+    conn = _state_conn()
+    row = conn.execute("SELECT name FROM collections WHERE role = 'retired'").fetchone()
+    if not row:
+        return None
+    conn.execute("DELETE FROM collections WHERE role = 'retired'")
+    drop_vector_store(row[0])
+    return row[0]
+
+# --- 章节元数据 ---
+# 每条章节向量的元数据：comic_hash、chapter、chapter_number（章节名中的第一个数字，没有时为 -1）、
+# ingested_at（写入时间戳）以及 info.json 中每个标签对应的 "tag:<标签>": True，供 where 过滤使用。
+TAG_PREFIX = 'tag:'
+
+def _chapter_number(chapter_name):
+    match = re.search(r'\d+(?:\.\d+)?', chapter_name)
+    return float(match.group()) if match else -1.0
+
+def _comic_tags(comic_hash):
+    info_path = os.path.join(DATA_BASE_PATH, comic_hash, 'info.json')
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            tags = json.load(f).get('tags', [])
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+    return [tag for tag in tags if isinstance(tag, str) and tag and not any(c in tag for c in '"\'\\')]
+
+def chapter_metadata(comic_hash, chapter_name, ingested_at=None, tags=None):
+    """构造章节向量的元数据。tags 为 None 时从 info.json 读取。"""
+    metadata = {
+        'comic_hash': comic_hash,
+        'chapter': chapter_name,
+        'chapter_number': _chapter_number(chapter_name),
+        'ingested_at': int(ingested_at if ingested_at is not None else time.time()),
+    }
+    for tag in (_comic_tags(comic_hash) if tags is None else tags):
+        metadata[TAG_PREFIX + tag] = True
+    return metadata
+
+def build_where(comic_hash=None, chapter_from=None, chapter_to=None, ingested_after=None, ingested_before=None, tags=None):
+    """把搜索范围参数转换为向量库 where 条件；没有任何限制时返回 None。
+
+    chapter_from/chapter_to 按章节号闭区间过滤，ingested_after/ingested_before 为时间戳，
+    tags 中的标签须全部具备。
+    """
+    conditions = []
+    if comic_hash:
+        conditions.append({'comic_hash': comic_hash})
+    if chapter_from is not None:
+        conditions.append({'chapter_number': {'$gte': float(chapter_from)}})
+    if chapter_to is not None:
+        conditions.append({'chapter_number': {'$lte': float(chapter_to)}})
+    if ingested_after is not None:
+        conditions.append({'ingested_at': {'$gte': int(ingested_after)}})
+    if ingested_before is not None:
+        conditions.append({'ingested_at': {'$lte': int(ingested_before)}})
+    for tag in tags or []:
+        conditions.append({TAG_PREFIX + tag: True})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+def add_embedding(comic_hash, chapter_name, chapter_summary, embedding=None):
+    """向向量库写入章节 embedding；章节已存在时覆盖旧记录。
+
+    embedding 须由 active 集合的模型生成，为 None 时按该模型计算。重建索引期间还会用新模型
+    计算一份写入 building 集合，使切换时不遗漏重建过程中入库的章节。
+    """
+    chapter_id = f"{comic_hash}_{chapter_name}"
+    metadata = chapter_metadata(comic_hash, chapter_name)
+    for role, name, model in _write_targets():
+        if role == 'active' and embedding is not None:
+            vector = embedding
+        else:
+            with span('embed', 'embedding', model=model, chapter=chapter_name):
+                vector = get_embedding(chapter_summary, model=model)
+        with vector_write_lock(), CHROMA_WRITE_SECONDS.time(), span('index_write', 'chroma', collection=name, chapter=chapter_name):
+            get_collection(name).upsert(embeddings=[vector], documents=[chapter_summary], metadatas=[metadata], ids=[chapter_id])
+        if role == 'building':
+            mark_reindexed(name, [(chapter_id, _summary_mtime(comic_hash, chapter_name) or 0.0)])
+    bump_index_generation()
     logger.info(f"章节 '{chapter_name}' 的 embedding 已存入数据库。")
 
-def search_by_embedding(embedding, k=1000):
-    """通过 embedding 在 ChromaDB 中进行搜索。"""
-    return collection.query(query_embeddings=[embedding], n_results=k)
+def search_by_embedding(embedding, k=1000, where=None, collection_name=None):
+    """通过 embedding 在向量库中进行搜索。where 条件在向量库内过滤，只在范围内的章节中取前 k 个。
+
+    collection_name 为生成 embedding 时读取的 active 集合名，避免查询期间恰好切换集合导致模型不匹配。
+    """
+    store = get_collection(collection_name) if collection_name else active_collection()
+    with CHROMA_QUERY_SECONDS.time():
+        return store.query(query_embeddings=[embedding], n_results=k, where=where)
 
 def delete_by_comic_hash(comic_hash):
     """根据 comic_hash 删除 ChromaDB 中的条目。"""
-    results = collection.get(where={"comic_hash": comic_hash})
-    if results and results['ids']:
-        collection.delete(ids=results['ids'])
-        logger.info(f"已从 ChromaDB 中删除 {len(results['ids'])} 个与漫画 {comic_hash} 相关的条目。")
+    with vector_write_lock():
+        for _, name, _ in _write_targets():
+            store = get_collection(name)
+            results = store.get(where={"comic_hash": comic_hash})
+            if results and results['ids']:
+                store.delete(ids=results['ids'])
+                bump_index_generation()
+                logger.info(f"已从向量集合 {name} 中删除 {len(results['ids'])} 个与漫画 {comic_hash} 相关的条目。")
 
 def delete_by_chapter_id(chapter_id):
     """根据 chapter_id 删除 ChromaDB 中的条目。"""
-    collection.delete(ids=[chapter_id])
+    with vector_write_lock():
+        for _, name, _ in _write_targets():
+            get_collection(name).delete(ids=[chapter_id])
+    bump_index_generation()
     logger.info(f"已从 ChromaDB 中删除章节 ID: {chapter_id}")
 
 def rename_chapter_embedding(comic_hash, old_name, new_name):
     """在 ChromaDB 中重命名一个章节。"""
     old_id = f"{comic_hash}_{old_name}"
     new_id = f"{comic_hash}_{new_name}"
-    results = collection.get(ids=[old_id], include=["embeddings", "documents", "metadatas"])
-    if results and results['ids']:
-        collection.add(
-            ids=[new_id],
-            embeddings=results['embeddings'],
-            documents=results['documents'],
-            metadatas=[{'comic_hash': comic_hash, 'chapter': new_name}]
-        )
-        collection.delete(ids=[old_id])
+    with vector_write_lock():
+        for role, name, _ in _write_targets():
+            store = get_collection(name)
+            results = store.get(ids=[old_id], include=["embeddings", "documents", "metadatas"])
+            if results and results['ids']:
+                store.upsert(
+                    ids=[new_id],
+                    embeddings=results['embeddings'],
+                    documents=results['documents'],
+                    metadatas=[chapter_metadata(comic_hash, new_name, ingested_at=results['metadatas'][0].get('ingested_at'))]
+                )
+                store.delete(ids=[old_id])
+                if role == 'building':
+                    mark_reindexed(name, [(new_id, _summary_mtime(comic_hash, new_name) or 0.0)])
+                bump_index_generation()
+
+def _summary_mtime(comic_hash, chapter_name):
+    """章节摘要文件的修改时间。早期写入的条目没有 ingested_at 时以它代替，重建索引也据此判断摘要是否变化。"""
+    summary_path = os.path.join(DATA_BASE_PATH, comic_hash, 'cap_summary', chapter_name, 'summary.txt')
+    try:
+        return os.path.getmtime(summary_path)
+    except OSError:
+        return None
+
+def refresh_comic_metadata(comic_hash):
+    """按当前 info.json（如标签）重写漫画所有章节向量的元数据，保留原写入时间。返回 active 集合中更新的条目数。"""
+    tags = _comic_tags(comic_hash)
+    updated = 0
+    for role, name, _ in _write_targets():
+        store = get_collection(name)
+        results = store.get(where={"comic_hash": comic_hash}, include=["embeddings", "documents", "metadatas"])
+        if not results or not results['ids']:
+            continue
+        metadatas = []
+        for meta in results['metadatas']:
+            ingested_at = meta.get('ingested_at') or _summary_mtime(comic_hash, meta['chapter'])
+            metadatas.append(chapter_metadata(comic_hash, meta['chapter'], ingested_at=ingested_at, tags=tags))
+        with vector_write_lock(), CHROMA_WRITE_SECONDS.time():
+            store.upsert(ids=results['ids'], embeddings=results['embeddings'], documents=results['documents'], metadatas=metadatas)
+        if role == 'active':
+            updated = len(results['ids'])
+    if updated:
+        bump_index_generation()
+    return updated
+
+def refresh_all_metadata():
+    """为库中全部漫画重写章节元数据（为旧条目补齐过滤字段），返回 (漫画数, 条目数)。"""
+    comic_hashes = {meta['comic_hash'] for meta in active_collection().get(include=['metadatas'])['metadatas']}
+    return len(comic_hashes), sum(refresh_comic_metadata(comic_hash) for comic_hash in comic_hashes)
+
+def copy_vectors(source, target, batch_size=256):
+    """把 source 向量库中的全部条目复制到 target，返回复制的条目数。用于切换后端。"""
+    all_ids = source.get(include=[])['ids']
+    for start in range(0, len(all_ids), batch_size):
+        batch = source.get(ids=all_ids[start:start + batch_size], include=['embeddings', 'documents', 'metadatas'])
+        target.upsert(ids=batch['ids'], embeddings=batch['embeddings'], documents=batch['documents'], metadatas=batch['metadatas'])
+    return len(all_ids)
@@ -0,0 +1,144 @@
+import os
+import json
+import gzip
+import threading
+from collections import OrderedDict
+
+from ..utils.logger import logger
+
+try:
+    import zstandard  # zstd 压缩为可选支持，需要安装 zstandard
+except ImportError:
+    zstandard = None
+
+# --- 页面描述存储 ---
+# 每个章节的页面描述保存在 pic_detail/<章节>/pages.jsonl 中，每行一条页面记录：
+#   {"image", "hash", "description", "source", "model", "prompt_version", "started_at", "seconds"}
+# 入库时按页面完成顺序追加，章节结束时整理（同一页只保留最后一条）并按 DESCRIPTION_COMPRESSION 压缩。
+# 读取时一次顺序读完整个文件；早期入库的章节仍按 manifest 读取每页一个的 .txt 文件。
+RECORDS_FILE = 'pages.jsonl'
+# none / gzip / zstd（未安装 zstandard 时退回 gzip）
+DESCRIPTION_COMPRESSION = os.getenv('DESCRIPTION_COMPRESSION', 'none').lower()
+_COMPRESSED_SUFFIXES = ('.zst', '.gz')
+
+_append_lock = threading.Lock()
+
+def _compressed_paths(chapter_detail_dir):
+    return [os.path.join(chapter_detail_dir, RECORDS_FILE + suffix) for suffix in _COMPRESSED_SUFFIXES]
+
+def _read_text(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.gz'):
+        data = gzip.decompress(data)
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"读取 {path} 需要安装 zstandard")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    # 写入中断可能截断多字节字符，按替换解码，只让那半行解析失败
+    return data.decode('utf-8', errors='replace')
+
+def _parse_records(text, records):
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # 写入中断留下的半行
+        records.pop(record['image'], None)
+        records[record['image']] = record
+
+def _legacy_records(chapter_detail_dir):
+    """早期入库的章节：按 manifest 读取每页一个的 .txt 描述。"""
+    records = OrderedDict()
+    try:
+        with open(os.path.join(chapter_detail_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            image_files = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return records
+    try:
+        with open(os.path.join(chapter_detail_dir, 'fingerprint.json'), 'r', encoding='utf-8') as f:
+            hashes = dict(json.load(f).get('pages', []))
+    except (FileNotFoundError, json.JSONDecodeError):
+        hashes = {}
+    for img_file in image_files:
+        desc_path = os.path.join(chapter_detail_dir, os.path.splitext(img_file)[0] + '.txt')
+        try:
+            with open(desc_path, 'r', encoding='utf-8') as f:
+                description = f.read()
+        except FileNotFoundError:
+            continue
+        records[img_file] = {'image': img_file, 'hash': hashes.get(img_file), 'description': description, 'source': 'legacy'}
+    return records
+
+def load_chapter_records(chapter_detail_dir):
+    """读取章节全部页面记录，返回按写入顺序排列的 {图片文件名: 记录}；同一页以最后一条为准。"""
+    records = OrderedDict()
+    found = False
+    # 整理后的压缩文件在前，整理之后追加的记录在后
+    for path in _compressed_paths(chapter_detail_dir) + [os.path.join(chapter_detail_dir, RECORDS_FILE)]:
+        try:
+            text = _read_text(path)
+        except FileNotFoundError:
+            continue
+        found = True
+        _parse_records(text, records)
+    return records if found else _legacy_records(chapter_detail_dir)
+
+def load_chapter_descriptions(chapter_detail_dir):
+    """返回 {图片文件名: 描述}，空描述不包含在内。"""
+    return {image: record['description'] for image, record in load_chapter_records(chapter_detail_dir).items() if record.get('description')}
+
+def append_record(chapter_detail_dir, image, description, content_hash=None, source='vision', model=None, prompt_version=None,
+                  started_at=None, seconds=None):
+    """追加一条页面记录。每条记录一次 write，崩溃时最多留下一行不完整的记录；
+    之后追加时先补上换行，新记录不会接在那半行后面一起被丢弃。"""
+    record = {'image': image, 'hash': content_hash, 'description': description, 'source': source, 'model': model,
+              'prompt_version': prompt_version, 'started_at': started_at, 'seconds': seconds}
+    line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+    with _append_lock:
+        with open(os.path.join(chapter_detail_dir, RECORDS_FILE), 'a+b') as f:
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = b'\n' + line
+            f.write(line)
+
+def finalize_chapter(chapter_detail_dir, compression=DESCRIPTION_COMPRESSION):
+    """整理章节记录：去掉被覆盖的旧记录，按 compression 重写为单个文件。"""
+    records = load_chapter_records(chapter_detail_dir)
+    if not records:
+        return
+    data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records.values()).encode('utf-8')
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("未安装 zstandard，页面描述改用 gzip 压缩。")
+        compression = 'gzip'
+    if compression == 'zstd':
+        target, data = RECORDS_FILE + '.zst', zstandard.ZstdCompressor().compress(data)
+    elif compression == 'gzip':
+        target, data = RECORDS_FILE + '.gz', gzip.compress(data, mtime=0)
+    else:
+        target = RECORDS_FILE
+    target_path = os.path.join(chapter_detail_dir, target)
+    with open(target_path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(target_path + '.tmp', target_path)
+    for path in _compressed_paths(chapter_detail_dir) + [os.path.join(chapter_detail_dir, RECORDS_FILE)]:
+        if path != target_path and os.path.exists(path):
+            os.remove(path)
+
+def migrate_chapter(chapter_detail_dir, compression=DESCRIPTION_COMPRESSION):
+    """把早期的每页一个 .txt 转换为记录文件并删除 .txt，返回转换的页数。"""
+    if any(os.path.exists(path) for path in _compressed_paths(chapter_detail_dir) + [os.path.join(chapter_detail_dir, RECORDS_FILE)]):
+        return 0
+    records = _legacy_records(chapter_detail_dir)
+    if not records:
+        return 0
+    with open(os.path.join(chapter_detail_dir, RECORDS_FILE), 'w', encoding='utf-8') as f:
+        for record in records.values():
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    finalize_chapter(chapter_detail_dir, compression)
+    for img_file in records:
+        os.remove(os.path.join(chapter_detail_dir, os.path.splitext(img_file)[0] + '.txt'))
+    return len(records)
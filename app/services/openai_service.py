@@ -1,10 +1,12 @@
 import os
+import time
 from collections import deque
 from openai import OpenAI
 from dotenv import load_dotenv
 
 from ..utils.logger import logger
-from ..tasks import get_or_create_stream_buffer
+from ..tasks import get_or_create_stream_buffer, get_task_control, TaskInterrupted
+from ..utils.metrics import EMBEDDING_SECONDS, SUMMARY_SECONDS, SUMMARY_TTFT
 
 # --- 初始化 ---
 load_dotenv()
@@ -17,48 +19,94 @@ client = OpenAI(
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
 SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-3.5-turbo")
 
+# --- 摘要提示词 ---
+# 修改任一提示词时请同时递增版本号，缓存和过期检测都依赖它
+SUMMARY_PROMPT_VERSION = 1
+SUMMARY_PROMPT = "你是一个善于总结的助手。请根据以下漫画各页描述，生成一个连贯的本章节摘要，用作EMBEDDING关键词搜索。只输出关键词和复杂事件总结关键句（用作事件比对）;格式：\n关键词\n关键词\n关键词。\n\n关键句：\n关键句\n关键句\n关键句。"
+CHUNK_SUMMARY_PROMPT = "你是一个善于总结的助手。以下是漫画某章节中连续若干页的描述，请提炼这一段的人物、地点、物品和事件，输出关键词和关键句，尽量保留专有名词，不要遗漏重要情节。"
+REDUCE_SUMMARY_PROMPT = "你是一个善于总结的助手。以下是同一漫画章节按顺序分段得到的摘要，请合并为一个连贯的本章节摘要，用作EMBEDDING关键词搜索。去除重复，只输出关键词和复杂事件总结关键句（用作事件比对）;格式：\n关键词\n关键词\n关键词。\n\n关键句：\n关键句\n关键句\n关键句。"
+SUMMARY_FAILED = "摘要生成失败。"
+
+
+class SummaryError(RuntimeError):
+    """摘要请求失败（包括已输出部分内容后中断），已产出的文本不完整，不能使用。"""
+
 def get_embedding(text, model=EMBEDDING_MODEL):
     """为文本生成 embedding 向量。"""
     text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=model).data[0].embedding
+    with EMBEDDING_SECONDS.time():
+        return client.embeddings.create(input=[text], model=model).data[0].embedding
+
+def get_embeddings(texts, model=EMBEDDING_MODEL):
+    """在一次请求中为多段文本生成 embedding，按输入顺序返回。"""
+    with EMBEDDING_SECONDS.time():
+        response = client.embeddings.create(input=[text.replace("\n", " ") for text in texts], model=model)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def summarize_text(text, task_id, chapter_name, model=SUMMARY_MODEL, system_prompt=SUMMARY_PROMPT, log_key=None, max_tokens=16384):
+    """以流式方式为文本生成摘要，并将日志写入特定的缓冲区。
 
-def summarize_text(text, task_id, chapter_name, model=SUMMARY_MODEL):
-    """以流式方式为文本生成摘要，并将日志写入特定的缓冲区。"""
-    summary_log_key = f"summary_{chapter_name}"
+    任务被暂停或取消时关闭流并抛出 TaskInterrupted；请求失败时抛出 SummaryError，
+    此前已产出的片段应整体丢弃。
+    """
+    summary_log_key = log_key or f"summary_{chapter_name}"
+    request_start = time.perf_counter()
+    control = get_task_control(task_id)
+    unregister = None
     try:
+        if control is not None and control.interrupted():
+            raise TaskInterrupted()
         buffer = get_or_create_stream_buffer(task_id, summary_log_key)
         if buffer is None:
             error_message = f"无法为 {summary_log_key} 获取流缓冲区。"
-            logger.error(f"[{task_id}] {error_message}")
-            yield f"摘要生成失败: {error_message}"
-            return
+            logger.error(f"[{task_id}] {error_message}", extra={'task_id': task_id})
+            raise SummaryError(error_message)
 
         stream = client.chat.completions.create(
             model=model,
             messages=[
-                {"role": "system", "content": "你是一个善于总结的助手。请根据以下漫画各页描述，生成一个连贯的本章节摘要，用作EMBEDDING关键词搜索。只输出关键词和复杂事件总结关键句（用作事件比对）;格式：\n关键词\n关键词\n关键词。\n\n关键句：\n关键句\n关键句\n关键句。"},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": text}
             ],
-            max_tokens=16384,
+            max_tokens=max_tokens,
             stream=True,
         )
+        if control is not None:
+            unregister = control.on_interrupt(stream.close)
         buffer.append("[摘要开始]\n")
         
         summary_content = []
         for chunk in stream:
             content = chunk.choices[0].delta.content
             if content:
+                if not summary_content:
+                    SUMMARY_TTFT.observe(time.perf_counter() - request_start)
                 buffer.append(content)
                 summary_content.append(content)
                 yield content
+        # 连接被关闭时流可能直接结束而不报错
+        if control is not None and control.interrupted():
+            raise TaskInterrupted()
         
         buffer.append("\n[摘要结束]\n")
+        SUMMARY_SECONDS.observe(time.perf_counter() - request_start, result='ok')
         
+    except SummaryError:
+        raise
     except Exception as e:
+        if control is not None and control.interrupted():
+            buffer = get_or_create_stream_buffer(task_id, summary_log_key)
+            if buffer:
+                buffer.append("\n[摘要已中止]\n")
+            raise TaskInterrupted() from e
+        SUMMARY_SECONDS.observe(time.perf_counter() - request_start, result='error')
         error_message = f"生成摘要时出错: {e}"
-        logger.error(f"[{task_id}] {error_message}")
+        logger.error(f"[{task_id}] {error_message}", extra={'task_id': task_id})
         # 尝试获取缓冲区并记录错误
         buffer = get_or_create_stream_buffer(task_id, summary_log_key)
         if buffer:
             buffer.append(error_message)
-        yield "摘要生成失败。"
+        raise SummaryError(error_message) from e
+    finally:
+        if unregister is not None:
+            unregister()
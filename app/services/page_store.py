@@ -0,0 +1,191 @@
+import os
+import json
+import mmap
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+from ..utils.logger import logger
+
+# --- 页面图片存储 ---
+# files: 每页一个文件，pic/<章节>/<图片>
+# packed: 每章一个只追加的 pages.pack，加上记录 [文件名, 偏移, 长度] 的 pages.idx，
+#         大型库的 inode 数、备份和重新入库时的 rmtree 开销与章节数而非页数成正比。
+# 读取时两种格式都支持（按章节目录中是否有 pages.idx 判断），PAGE_STORAGE 只决定新入库章节的格式。
+PAGE_STORAGE = os.getenv('PAGE_STORAGE', 'files').lower()
+PACK_FILE = 'pages.pack'
+PACK_INDEX_FILE = 'pages.idx'
+CHUNK_SIZE = 256 * 1024
+MAX_OPEN_MAPS = 64
+
+_index_cache = OrderedDict()
+_maps = OrderedDict()
+_lock = threading.Lock()
+
+def is_packed(chapter_dir):
+    return os.path.exists(os.path.join(chapter_dir, PACK_INDEX_FILE))
+
+def _file_stamp(st):
+    """判断文件是否变化的标识。章节重新入库时文件被删除后重建，inode 号常被复用，只比较 inode 不够。"""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_OPEN_MAPS:
+        cache.popitem(last=False)
+
+def load_pack_index(chapter_dir):
+    """读取章节的页面索引，返回有序的 {文件名: (偏移, 长度)}；索引文件变化后自动重新加载。"""
+    index_path = os.path.join(chapter_dir, PACK_INDEX_FILE)
+    try:
+        stamp = _file_stamp(os.stat(index_path))
+    except FileNotFoundError:
+        return None
+    with _lock:
+        cached = _index_cache.get(index_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = OrderedDict((name, (offset, length)) for name, offset, length in json.load(f))
+    with _lock:
+        _remember(_index_cache, index_path, (stamp, index))
+    return index
+
+def _write_index(chapter_dir, index):
+    index_path = os.path.join(chapter_dir, PACK_INDEX_FILE)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump([[name, offset, length] for name, (offset, length) in index.items()], f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_path)
+
+def append_pages(chapter_dir, source_dir, image_files):
+    """把 source_dir 中的图片追加到章节的 pages.pack，并更新索引。
+
+    先写数据并 fsync，再原子替换索引；中途失败时已有页面不受影响，多出的字节只是未被索引引用。
+    同名页面再次追加时索引指向新数据。
+    """
+    os.makedirs(chapter_dir, exist_ok=True)
+    existing = load_pack_index(chapter_dir)
+    index = OrderedDict(existing or {})
+    # 没有索引时 pages.pack 只可能是上次中断留下的未引用数据，直接覆盖
+    with open(os.path.join(chapter_dir, PACK_FILE), 'ab' if existing is not None else 'wb') as pack:
+        offset = pack.seek(0, os.SEEK_END)
+        for img_file in image_files:
+            with open(os.path.join(source_dir, img_file), 'rb') as src:
+                shutil.copyfileobj(src, pack, CHUNK_SIZE)
+            length = pack.tell() - offset
+            index.pop(img_file, None)
+            index[img_file] = (offset, length)
+            offset += length
+        pack.flush()
+        os.fsync(pack.fileno())
+    _write_index(chapter_dir, index)
+
+def store_chapter_pages(chapter_dir, source_dir, image_files):
+    """按 PAGE_STORAGE 把新入库章节的图片保存到 chapter_dir（source_dir 中的文件会被移走或复制）。"""
+    if PAGE_STORAGE == 'packed':
+        append_pages(chapter_dir, source_dir, image_files)
+        return
+    os.makedirs(chapter_dir, exist_ok=True)
+    for img_file in image_files:
+        shutil.move(os.path.join(source_dir, img_file), os.path.join(chapter_dir, img_file))
+
+def _pack_map(pack_path, required):
+    """返回覆盖至少 required 字节的 pages.pack 只读映射；文件被替换、重建或追加后重新映射。
+
+    旧映射不主动关闭：仍在发送中的响应持有其 memoryview，由垃圾回收释放。
+    """
+    stamp = _file_stamp(os.stat(pack_path))
+    with _lock:
+        cached = _maps.get(pack_path)
+        if cached and cached[0] == stamp and len(cached[1]) >= required:
+            _maps.move_to_end(pack_path)
+            return cached[1]
+    with open(pack_path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with _lock:
+        _remember(_maps, pack_path, (stamp, mapped))
+    return mapped
+
+class PageRange:
+    """pages.pack 中的一页。以 memoryview 分块输出映射内存，不复制整页数据。"""
+
+    def __init__(self, pack_path, offset, length):
+        self.pack_path = pack_path
+        self.offset = offset
+        self.length = length
+
+    def view(self):
+        return memoryview(_pack_map(self.pack_path, self.offset + self.length))[self.offset:self.offset + self.length]
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        page = self.view()
+        for start in range(0, self.length, chunk_size):
+            yield page[start:start + chunk_size]
+
+def open_page(chapter_dir, image_name):
+    """定位单页图片：散文件返回路径，打包章节返回 PageRange，不存在时返回 None。"""
+    index = load_pack_index(chapter_dir)
+    if index is not None:
+        entry = index.get(image_name)
+        return PageRange(os.path.join(chapter_dir, PACK_FILE), *entry) if entry else None
+    path = os.path.join(chapter_dir, image_name)
+    return path if os.path.isfile(path) else None
+
+def page_sha256(chapter_dir, image_name):
+    """计算已保存页面内容的 SHA-256，两种存储格式结果一致。"""
+    page = open_page(chapter_dir, image_name)
+    if page is None:
+        raise FileNotFoundError(os.path.join(chapter_dir, image_name))
+    digest = hashlib.sha256()
+    if isinstance(page, PageRange):
+        digest.update(page.view())
+        return digest.hexdigest()
+    with open(page, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def pack_chapter(chapter_dir, order=None):
+    """把散文件章节转换为打包格式，返回打包的页数；已打包或没有图片时返回 0。
+
+    order 为页序（通常是 pic_detail 中的 manifest），不在其中的文件按文件名排在后面。
+    索引写入后才删除散文件；上次在删除前中断时，本次只补做删除。
+    """
+    if not os.path.isdir(chapter_dir):
+        return 0
+    loose = {name for name in os.listdir(chapter_dir)
+             if os.path.isfile(os.path.join(chapter_dir, name)) and name not in (PACK_FILE, PACK_INDEX_FILE) and not name.endswith('.tmp')}
+    index = load_pack_index(chapter_dir)
+    if index is not None:
+        for name in loose & set(index):
+            os.remove(os.path.join(chapter_dir, name))
+        return 0
+    if not loose:
+        return 0
+    image_files = [name for name in (order or []) if name in loose]
+    image_files += sorted(loose - set(image_files))
+    append_pages(chapter_dir, chapter_dir, image_files)
+    for img_file in image_files:
+        os.remove(os.path.join(chapter_dir, img_file))
+    return len(image_files)
+
+def unpack_chapter(chapter_dir):
+    """把打包章节还原为每页一个文件，返回还原的页数。"""
+    index = load_pack_index(chapter_dir)
+    if index is None:
+        return 0
+    pack_path = os.path.join(chapter_dir, PACK_FILE)
+    with open(pack_path, 'rb') as pack:
+        for img_file, (offset, length) in index.items():
+            pack.seek(offset)
+            with open(os.path.join(chapter_dir, img_file), 'wb') as f:
+                f.write(pack.read(length))
+    os.remove(os.path.join(chapter_dir, PACK_INDEX_FILE))
+    os.remove(pack_path)
+    logger.info(f"已还原打包章节 {chapter_dir}（{len(index)} 页）。")
+    return len(index)
@@ -0,0 +1,372 @@
+import os
+import io
+import sqlite3
+import threading
+import itertools
+from PIL import Image
+
+from ..utils.logger import logger
+from .page_store import open_page, load_pack_index, PageRange
+
+# --- 页面感知哈希索引 ---
+# 持久化在 SQLite 中，内存里只保存 (rowid, hash) 的多索引分桶，命中后再回表读取页面位置。
+# page_hashes：已分析页面的整页哈希，用于入库时复用近似重复页的描述；
+# page_images：pic/ 中每一页的整页及分区哈希，用于以图搜图（不调用任何模型）。
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+PHASH_DB_PATH = os.path.join(DATA_BASE_PATH, 'page_hashes.db')
+# 近似重复判定的最大汉明距离（64 位 dHash）
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 3))
+# 以图搜图：入库时是否为每页建立图片哈希，以及截图与页面（或页面分区）判定为匹配的最大汉明距离
+IMAGE_SEARCH_INDEX = os.getenv('IMAGE_SEARCH_INDEX', 'True').lower() == 'true'
+IMAGE_SEARCH_MAX_DISTANCE = int(os.getenv('IMAGE_SEARCH_MAX_DISTANCE', 10))
+# 除整页外还为哪些分区建立哈希（截图只截了半页时也能命中）；每个分区占一条索引记录
+IMAGE_SEARCH_REGIONS = [r.strip() for r in os.getenv('IMAGE_SEARCH_REGIONS', 'full,top,bottom').split(',') if r.strip()]
+# 以图搜图索引的分段数：查询在每段内枚举 IMAGE_SEARCH_MAX_DISTANCE // 段数 以内的翻转
+IMAGE_SEARCH_BANDS = 4
+# 其他进程删除、而本进程内存索引中仍残留的条目超过索引大小的该比例时，从数据库整体重建索引
+INDEX_REBUILD_RATIO = 0.1
+
+_local = threading.local()
+_index_lock = threading.Lock()
+_indexes = {}  # 表名 -> MultiIndexHamming
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_hashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash INTEGER NOT NULL,
+    comic_hash TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    image TEXT NOT NULL,
+    UNIQUE (comic_hash, chapter, image)
+);
+CREATE INDEX IF NOT EXISTS idx_page_hashes_comic ON page_hashes(comic_hash, chapter);
+CREATE TABLE IF NOT EXISTS page_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash INTEGER NOT NULL,
+    comic_hash TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    image TEXT NOT NULL,
+    region TEXT NOT NULL,
+    UNIQUE (comic_hash, chapter, image, region)
+);
+CREATE INDEX IF NOT EXISTS idx_page_images_comic ON page_images(comic_hash, chapter);
+-- 各表累计删除的行数；其他进程的删除无法逐条得知，各进程据此判断内存索引中残留了多少失效条目
+CREATE TABLE IF NOT EXISTS hash_index_state (
+    name TEXT PRIMARY KEY,
+    removed INTEGER NOT NULL
+);
+"""
+
+def _to_signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+def _get_connection():
+    """获取当前线程的 SQLite 连接。"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(DATA_BASE_PATH, exist_ok=True)
+        conn = sqlite3.connect(PHASH_DB_PATH, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+def dhash(gray):
+    """灰度图的 64 位 dHash：缩小到 9x8 后逐行比较相邻像素。"""
+    pixels = list(gray.resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (1 if pixels[row * 9 + col] > pixels[row * 9 + col + 1] else 0)
+    return value
+
+def region_hashes(source, regions=None):
+    """计算图片（路径或文件对象）各分区的 dHash，返回 {分区: 哈希}。"""
+    with Image.open(source) as img:
+        # 对 JPEG 直接按缩小尺寸解码；分区哈希只需要很低的分辨率
+        img.draft('L', (256, 256))
+        gray = img.convert('L')
+    width, height = gray.size
+    boxes = {'full': (0, 0, width, height),
+             'top': (0, 0, width, height // 2), 'bottom': (0, height // 2, width, height),
+             'left': (0, 0, width // 2, height), 'right': (width // 2, 0, width, height)}
+    return {region: dhash(gray.crop(boxes[region])) for region in (regions or ['full']) if region in boxes}
+
+class MultiIndexHamming:
+    """多索引哈希：把 64 位哈希切成 bands 段分别分桶。
+
+    由抽屉原理，汉明距离 <= d 的两个哈希至少有一段的距离 <= d // bands，
+    因此查询只需在每段内枚举这么多位的翻转并比较同桶的候选项，复杂度与库大小近似无关。
+    d < bands 时只需查与查询哈希完全相同的段。
+    """
+
+    def __init__(self, bands, bits=64):
+        self.bands = bands
+        self.bits = bits
+        self._bounds = [(bits * i // bands, bits * (i + 1) // bands) for i in range(bands)]
+        self._tables = [dict() for _ in range(bands)]
+        self._hashes = {}
+        self.last_id = 0  # 已从数据库加载的最大行号
+        self.removed = 0  # 已反映到本索引中的删除数，与 hash_index_state.removed 对应
+
+    def _segments(self, value):
+        for start, end in self._bounds:
+            yield (value >> start) & ((1 << (end - start)) - 1)
+
+    def _probes(self, segment, width, radius):
+        """枚举与 segment 汉明距离不超过 radius 的所有段值。"""
+        yield segment
+        for flips in range(1, radius + 1):
+            for bits in itertools.combinations(range(width), flips):
+                probe = segment
+                for bit in bits:
+                    probe ^= 1 << bit
+                yield probe
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, item_id, value):
+        self._hashes[item_id] = value
+        for table, segment in zip(self._tables, self._segments(value)):
+            table.setdefault(segment, []).append(item_id)
+
+    def remove(self, item_id):
+        """移除一个条目，不存在时返回 False。"""
+        value = self._hashes.pop(item_id, None)
+        if value is None:
+            return False
+        for table, segment in zip(self._tables, self._segments(value)):
+            bucket = table[segment]
+            bucket.remove(item_id)
+            if not bucket:
+                del table[segment]
+        return True
+
+    def search(self, value, max_distance):
+        """返回 [(距离, item_id)]，按距离升序。"""
+        radius = max_distance // self.bands
+        seen = set()
+        results = []
+        for table, segment, (start, end) in zip(self._tables, self._segments(value), self._bounds):
+            for probe in self._probes(segment, end - start, radius):
+                for item_id in table.get(probe, ()):
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    stored = self._hashes.get(item_id)
+                    if stored is None:
+                        continue
+                    distance = (stored ^ value).bit_count()
+                    if distance <= max_distance:
+                        results.append((distance, item_id))
+        results.sort()
+        return results
+
+def _sync_index(table, bands):
+    """加载（或增量同步）表 table 的内存索引：只读取上次之后新增的行，其他进程写入的记录也能被看到。
+
+    本进程删除的行由 _forget_rows 直接移除；其他进程删除的行只能通过 hash_index_state 的计数得知，
+    残留的失效条目超过 INDEX_REBUILD_RATIO 时整体重建。
+    """
+    with _index_lock:
+        conn = _get_connection()
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute('SELECT removed FROM hash_index_state WHERE name = ?', (table,)).fetchone()
+            removed = row[0] if row else 0
+            index = _indexes.get(table)
+            if index is None or removed - index.removed > len(index) * INDEX_REBUILD_RATIO:
+                index = _indexes[table] = MultiIndexHamming(bands)
+                index.removed = removed
+            rows = conn.execute(f'SELECT id, hash FROM {table} WHERE id > ? ORDER BY id', (index.last_id,)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        for row_id, value in rows:
+            index.add(row_id, _to_unsigned(value))
+        if rows:
+            index.last_id = rows[-1][0]
+        return index
+
+def _load_index():
+    """近似重复页查找使用的 page_hashes 内存索引。"""
+    return _sync_index('page_hashes', PHASH_MAX_DISTANCE + 1)
+
+def _delete_rows(conn, table, where, params):
+    """在调用方的事务中删除 table 中满足条件的行并累加删除计数，返回被删除的行号。"""
+    ids = [row[0] for row in conn.execute(f'SELECT id FROM {table} WHERE {where}', params)]
+    if ids:
+        conn.execute(f'DELETE FROM {table} WHERE {where}', params)
+        conn.execute('INSERT INTO hash_index_state (name, removed) VALUES (?, ?) '
+                     'ON CONFLICT(name) DO UPDATE SET removed = removed + excluded.removed', (table, len(ids)))
+    return ids
+
+def _forget_rows(table, ids):
+    """删除提交后，从本进程的内存索引中移除这些行并计入已反映的删除数。"""
+    with _index_lock:
+        index = _indexes.get(table)
+        if index is None:
+            return
+        # 尚未加载过的行以后也不会再被加载，同样算作已反映
+        index.removed += sum(1 for item_id in ids if index.remove(item_id) or item_id > index.last_id)
+
+def add_page_hashes(comic_hash, chapter_name, page_hashes):
+    """记录一个章节的页面哈希。page_hashes 为 {图片文件名: 哈希}。"""
+    if not page_hashes:
+        return
+    conn = _get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # 先删除同名页面的旧记录（而不是 INSERT OR REPLACE），以便计入删除数并移出内存索引
+        removed = []
+        for image in page_hashes:
+            removed += _delete_rows(conn, 'page_hashes', 'comic_hash = ? AND chapter = ? AND image = ?',
+                                    (comic_hash, chapter_name, image))
+        conn.executemany(
+            'INSERT INTO page_hashes (hash, comic_hash, chapter, image) VALUES (?, ?, ?, ?)',
+            [(_to_signed(value), comic_hash, chapter_name, image) for image, value in page_hashes.items()]
+        )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    _forget_rows('page_hashes', removed)
+    _load_index()
+
+def find_similar_pages(value, max_distance=PHASH_MAX_DISTANCE, limit=10):
+    """查找与给定哈希相近的已入库页面，返回 [(距离, comic_hash, chapter, image)]。"""
+    index = _load_index()
+    matches = index.search(value, max_distance)
+    if not matches:
+        return []
+    conn = _get_connection()
+    results = []
+    for distance, row_id in matches:
+        row = conn.execute('SELECT comic_hash, chapter, image FROM page_hashes WHERE id = ?', (row_id,)).fetchone()
+        if row is None:
+            continue  # 已被删除或替换
+        results.append((distance,) + row)
+        if len(results) >= limit:
+            break
+    return results
+
+def delete_page_hashes(comic_hash, chapter_name=None):
+    """删除整部漫画或单个章节的页面哈希记录。"""
+    conn = _get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if chapter_name is None:
+            removed = _delete_rows(conn, 'page_hashes', 'comic_hash = ?', (comic_hash,))
+        else:
+            removed = _delete_rows(conn, 'page_hashes', 'comic_hash = ? AND chapter = ?', (comic_hash, chapter_name))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    _forget_rows('page_hashes', removed)
+    if removed:
+        logger.info(f"已从页面哈希索引中删除 {len(removed)} 条记录 ({comic_hash} {chapter_name or ''})。")
+
+def rename_page_hashes(comic_hash, old_name, new_name):
+    """章节重命名时同步更新页面哈希记录。"""
+    _get_connection().execute(
+        'UPDATE page_hashes SET chapter = ? WHERE comic_hash = ? AND chapter = ?', (new_name, comic_hash, old_name)
+    )
+
+def _load_image_index():
+    """以图搜图使用的 page_images 内存索引。"""
+    return _sync_index('page_images', IMAGE_SEARCH_BANDS)
+
+def chapter_image_files(chapter_dir):
+    """列出已保存章节的全部页面文件名（两种存储格式）。"""
+    index = load_pack_index(chapter_dir)
+    if index is not None:
+        return list(index)
+    if not os.path.isdir(chapter_dir):
+        return []
+    return sorted(name for name in os.listdir(chapter_dir) if os.path.isfile(os.path.join(chapter_dir, name)) and not name.endswith('.tmp'))
+
+def index_chapter_images(comic_hash, chapter_name, image_files=None, task_id=None):
+    """为 pic/ 中已保存的章节页面计算分区哈希并替换该章节原有的记录，返回建立索引的页数。
+
+    image_files 省略时索引章节目录中的全部页面。
+    """
+    chapter_dir = os.path.join(DATA_BASE_PATH, comic_hash, 'pic', chapter_name)
+    if image_files is None:
+        image_files = chapter_image_files(chapter_dir)
+    rows = []
+    for img_file in image_files:
+        page = open_page(chapter_dir, img_file)
+        if page is None:
+            continue
+        try:
+            hashes = region_hashes(io.BytesIO(page.view()) if isinstance(page, PageRange) else page, IMAGE_SEARCH_REGIONS)
+        except Exception as e:
+            logger.warning(f"计算图片 {comic_hash}/{chapter_name}/{img_file} 的以图搜图哈希失败: {e}",
+                           extra={'task_id': task_id, 'chapter': chapter_name, 'page': img_file})
+            continue
+        rows += [(_to_signed(value), comic_hash, chapter_name, img_file, region) for region, value in hashes.items()]
+
+    conn = _get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        removed = _delete_rows(conn, 'page_images', 'comic_hash = ? AND chapter = ?', (comic_hash, chapter_name))
+        conn.executemany('INSERT INTO page_images (hash, comic_hash, chapter, image, region) VALUES (?, ?, ?, ?, ?)', rows)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    _forget_rows('page_images', removed)
+    return len({row[3] for row in rows})
+
+def indexed_image_chapters():
+    """返回已建立以图搜图索引的 {(comic_hash, 章节名)}。"""
+    return set(_get_connection().execute('SELECT DISTINCT comic_hash, chapter FROM page_images').fetchall())
+
+def search_pages_by_image(source, max_distance=IMAGE_SEARCH_MAX_DISTANCE, limit=20):
+    """以图搜图：用截图（路径或文件对象）的整图哈希匹配库中页面及其分区。
+
+    返回 [(距离, comic_hash, chapter, image, region)]，每页只保留距离最小的分区，按距离升序。
+    """
+    value = region_hashes(source)['full']
+    matches = _load_image_index().search(value, max_distance)
+    conn = _get_connection()
+    results = {}
+    # 分批回表；已删除或被替换的记录查不到，直接跳过
+    for n in range(0, len(matches), 500):
+        batch = matches[n:n + 500]
+        distances = dict((row_id, distance) for distance, row_id in batch)
+        placeholders = ','.join('?' * len(batch))
+        for row_id, comic_hash, chapter, image, region in conn.execute(
+                f'SELECT id, comic_hash, chapter, image, region FROM page_images WHERE id IN ({placeholders})', list(distances)):
+            key = (comic_hash, chapter, image)
+            if key not in results or distances[row_id] < results[key][0]:
+                results[key] = (distances[row_id], comic_hash, chapter, image, region)
+        # matches 按距离升序，之后的记录不会比已有结果更近
+        if len(results) >= limit:
+            break
+    return sorted(results.values())[:limit]
+
+def delete_page_images(comic_hash, chapter_name=None):
+    """删除整部漫画或单个章节的以图搜图记录。"""
+    conn = _get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if chapter_name is None:
+            removed = _delete_rows(conn, 'page_images', 'comic_hash = ?', (comic_hash,))
+        else:
+            removed = _delete_rows(conn, 'page_images', 'comic_hash = ? AND chapter = ?', (comic_hash, chapter_name))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    _forget_rows('page_images', removed)
+
+def rename_page_images(comic_hash, old_name, new_name):
+    """章节重命名时同步更新以图搜图记录。"""
+    _get_connection().execute(
+        'UPDATE page_images SET chapter = ? WHERE comic_hash = ? AND chapter = ?', (new_name, comic_hash, old_name)
+    )
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+
+from ..utils.logger import logger
+
+# --- 共享任务队列配置 ---
+# 独立 worker 进程与 Web 进程通过同一个 SQLite 文件交换任务、状态和流式输出。
+# 多机部署时该文件以及 UPLOAD_FOLDER / DATA_BASE_PATH / TEMP_FOLDER 需位于共享存储上。
+TASK_DB_PATH = os.getenv('TASK_DB_PATH', './data/taskqueue.db')
+TASK_LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', 1800))  # 超过该时间无心跳的任务会被重新分配
+# 已结束的任务记录保留多久；Web 进程启动时会加载全部记录，不清理会让内存和 /processing 页面无限增长
+TASK_RETENTION_SECONDS = int(os.getenv('TASK_RETENTION_SECONDS', 7 * 86400))
+PUBLISH_INTERVAL = 0.1
+
+_local = threading.local()
+_publish_queue = queue.Queue()
+_publisher_lock = threading.Lock()
+_publisher_thread = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    func TEXT NOT NULL,
+    data TEXT NOT NULL,
+    status TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker_id TEXT,
+    origin TEXT,
+    seq INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    heartbeat REAL,
+    control TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_seq ON tasks(seq);
+CREATE TABLE IF NOT EXISTS stream_chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    stream_id TEXT NOT NULL,
+    chunk TEXT NOT NULL,
+    origin TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_stream_chunks_task ON stream_chunks(task_id);
+"""
+
+def _get_connection():
+    """获取当前线程的 SQLite 连接（每个线程一个连接）。"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        db_dir = os.path.dirname(TASK_DB_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = sqlite3.connect(TASK_DB_PATH, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        # 早期创建的数据库没有 control 列
+        if 'control' not in {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}:
+            conn.execute('ALTER TABLE tasks ADD COLUMN control TEXT')
+        _local.conn = conn
+    return conn
+
+def _next_seq(conn):
+    """在写事务内生成单调递增的状态序号。"""
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks').fetchone()[0]
+
+def enqueue_task(task_id, func_path, task_data, status, origin):
+    """将任务写入共享队列。任务已存在时返回 False。"""
+    conn = _get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if conn.execute('SELECT 1 FROM tasks WHERE task_id = ?', (task_id,)).fetchone():
+            conn.execute('ROLLBACK')
+            return False
+        conn.execute(
+            'INSERT INTO tasks (task_id, func, data, status, state, origin, seq, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (task_id, func_path, json.dumps(task_data, ensure_ascii=False), json.dumps(status, ensure_ascii=False),
+             'queued', origin, _next_seq(conn), time.time())
+        )
+        conn.execute('COMMIT')
+        return True
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def claim_task(worker_id):
+    """原子地领取一个排队中（或租约已过期）的任务。没有任务时返回 None。"""
+    conn = _get_connection()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(
+            "SELECT task_id, func, data, status FROM tasks "
+            "WHERE state = 'queued' OR (state = 'running' AND heartbeat < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (now - TASK_LEASE_SECONDS,)
+        ).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        task_id, func_path, data, status = row
+        conn.execute(
+            "UPDATE tasks SET state = 'running', worker_id = ?, heartbeat = ? WHERE task_id = ?",
+            (worker_id, now, task_id)
+        )
+        conn.execute('COMMIT')
+        return task_id, func_path, json.loads(data), json.loads(status)
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def finish_task(task_id):
+    """标记任务已结束，不再参与领取。"""
+    flush_published()
+    _get_connection().execute("UPDATE tasks SET state = 'done', heartbeat = ? WHERE task_id = ?", (time.time(), task_id))
+
+def cancel_queued_task(task_id):
+    """把尚未被领取的任务标记为已结束。任务已被领取或不存在时返回 False。"""
+    cursor = _get_connection().execute(
+        "UPDATE tasks SET state = 'done', heartbeat = ? WHERE task_id = ? AND state = 'queued'", (time.time(), task_id)
+    )
+    return cursor.rowcount == 1
+
+def set_task_control(task_id, action):
+    """为运行中的任务写入控制请求（cancel / pause / resume），由领取该任务的 worker 执行。任务未在运行时返回 False。"""
+    cursor = _get_connection().execute(
+        "UPDATE tasks SET control = ? WHERE task_id = ? AND state = 'running'", (action, task_id)
+    )
+    return cursor.rowcount == 1
+
+def fetch_task_controls(task_ids):
+    """返回给定任务中带有控制请求的 [(task_id, action)]。"""
+    placeholders = ','.join('?' * len(task_ids))
+    return _get_connection().execute(
+        f"SELECT task_id, control FROM tasks WHERE control IS NOT NULL AND task_id IN ({placeholders})", list(task_ids)
+    ).fetchall()
+
+def touch_tasks(task_ids, worker_id=None):
+    """刷新任务心跳。给出 worker_id 时只续租仍由该 worker 持有的运行中任务。"""
+    placeholders = ','.join('?' * len(task_ids))
+    sql = f"UPDATE tasks SET heartbeat = ? WHERE task_id IN ({placeholders})"
+    params = [time.time()] + list(task_ids)
+    if worker_id is not None:
+        sql += " AND state = 'running' AND worker_id = ?"
+        params.append(worker_id)
+    _get_connection().execute(sql, params)
+
+def _publisher_loop():
+    """后台发布线程：批量写入状态和流块，减少每个 token 一次提交的开销。"""
+    while True:
+        items = [_publish_queue.get()]
+        time.sleep(PUBLISH_INTERVAL)
+        while True:
+            try:
+                items.append(_publish_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_published(items)
+        except Exception as e:
+            logger.error(f"写入共享任务队列时出错: {e}", exc_info=True)
+        finally:
+            for _ in items:
+                _publish_queue.task_done()
+
+def _write_published(items):
+    """在一个事务内按顺序写入一批发布事件。"""
+    conn = _get_connection()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for kind, task_id, payload, origin in items:
+            if kind == 'chunk':
+                stream_id, chunk = payload
+                conn.execute(
+                    'INSERT INTO stream_chunks (task_id, stream_id, chunk, origin) VALUES (?, ?, ?, ?)',
+                    (task_id, stream_id, json.dumps(chunk, ensure_ascii=False), origin)
+                )
+            else:
+                conn.execute(
+                    'UPDATE tasks SET status = ?, origin = ?, seq = ?, heartbeat = ? WHERE task_id = ?',
+                    (json.dumps(payload, ensure_ascii=False), origin, _next_seq(conn), now, task_id)
+                )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def _ensure_publisher():
+    """按需启动发布线程。"""
+    global _publisher_thread
+    with _publisher_lock:
+        if _publisher_thread is None or not _publisher_thread.is_alive():
+            _publisher_thread = threading.Thread(target=_publisher_loop, daemon=True, name='comic-task-publisher')
+            _publisher_thread.start()
+
+def publish_status(task_id, status, origin):
+    """异步发布任务状态快照。"""
+    _ensure_publisher()
+    _publish_queue.put(('status', task_id, status, origin))
+
+def publish_chunk(task_id, stream_id, chunk, origin):
+    """异步发布一个流式输出块。"""
+    _ensure_publisher()
+    _publish_queue.put(('chunk', task_id, (stream_id, chunk), origin))
+
+def flush_published():
+    """等待所有已发布事件写入数据库。"""
+    if _publisher_thread is not None:
+        _publish_queue.join()
+
+def fetch_status_updates(since_seq, exclude_origin):
+    """返回序号大于 since_seq 且非本进程发布的状态更新。"""
+    rows = _get_connection().execute(
+        'SELECT task_id, status, origin, seq FROM tasks WHERE seq > ? ORDER BY seq', (since_seq,)
+    ).fetchall()
+    last_seq = rows[-1][3] if rows else since_seq
+    updates = [(task_id, json.loads(status)) for task_id, status, origin, _ in rows if origin != exclude_origin]
+    return updates, last_seq
+
+def fetch_stream_chunks(after_id, exclude_origin):
+    """返回 id 大于 after_id 且非本进程发布的流式输出块。"""
+    rows = _get_connection().execute(
+        'SELECT id, task_id, stream_id, chunk, origin FROM stream_chunks WHERE id > ? ORDER BY id', (after_id,)
+    ).fetchall()
+    last_id = rows[-1][0] if rows else after_id
+    chunks = [(task_id, stream_id, json.loads(chunk)) for _, task_id, stream_id, chunk, origin in rows if origin != exclude_origin]
+    return chunks, last_id
+
+def purge_finished_chunks(max_age_seconds=86400):
+    """清理已结束较久的任务的流式输出块，防止数据库无限增长。"""
+    _get_connection().execute(
+        "DELETE FROM stream_chunks WHERE task_id IN (SELECT task_id FROM tasks WHERE state = 'done' AND heartbeat < ?)",
+        (time.time() - max_age_seconds,)
+    )
+
+def purge_finished_tasks(max_age_seconds=TASK_RETENTION_SECONDS):
+    """删除结束超过保留期的任务记录及其剩余的流式输出块。"""
+    conn = _get_connection()
+    cutoff = time.time() - max_age_seconds
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(
+            "DELETE FROM stream_chunks WHERE task_id IN (SELECT task_id FROM tasks WHERE state = 'done' AND heartbeat < ?)", (cutoff,)
+        )
+        # 保留序号最大的记录：_next_seq 取 MAX(seq) + 1，删掉它会让序号回退，其他进程将错过之后的状态更新
+        cursor = conn.execute(
+            "DELETE FROM tasks WHERE state = 'done' AND heartbeat < ? AND seq < (SELECT MAX(seq) FROM tasks)", (cutoff,)
+        )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    if cursor.rowcount:
+        logger.info(f"已从共享队列中清理 {cursor.rowcount} 条过期的任务记录。")
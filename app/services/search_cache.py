@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import threading
+import unicodedata
+from collections import OrderedDict, Counter
+
+from ..utils.logger import logger
+from ..utils.metrics import SEARCH_CACHE, SEARCH_CACHE_HIT_RATIO, SEARCH_CACHE_ENTRIES
+from .chroma_service import get_index_generation
+from .openai_service import get_embedding, EMBEDDING_MODEL
+
+# --- 搜索结果缓存 ---
+# 结果以 (规范化查询, k, 过滤条件) 为键，并标记计算时的索引代数；代数变化后旧结果不再返回。
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 512))
+# 索引代数变化后预热的热门查询数，0 表示不预热
+SEARCH_CACHE_PREWARM = int(os.getenv('SEARCH_CACHE_PREWARM', 0))
+# 代数保持不变多久（秒）后才预热，批量导入期间避免反复预热
+SEARCH_CACHE_PREWARM_DELAY = float(os.getenv('SEARCH_CACHE_PREWARM_DELAY', 5))
+# 查询 embedding 只取决于文本和模型，与索引代数无关，单独缓存
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 4096))
+
+def normalize_query(query):
+    """规范化查询：全角转半角、忽略大小写、合并空白。"""
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+class LRUCache:
+    """线程安全的 LRU 缓存。"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+
+def get_query_embedding(query, model=EMBEDDING_MODEL):
+    """获取查询文本在 model 下的 embedding，相同查询只请求一次。"""
+    key = (model, normalize_query(query))
+    embedding = _embedding_cache.get(key)
+    if embedding is None:
+        embedding = get_embedding(query, model=model)
+        _embedding_cache.put(key, embedding)
+    return embedding
+
+class SearchResultCache:
+    """按索引代数失效的搜索结果 LRU 缓存，可在代数变化后预热热门查询。"""
+
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE, prewarm_count=SEARCH_CACHE_PREWARM, prewarm_delay=SEARCH_CACHE_PREWARM_DELAY):
+        self._results = LRUCache(max_entries)
+        self.prewarm_count = prewarm_count
+        self.prewarm_delay = prewarm_delay
+        self._popularity = Counter()
+        self._popularity_lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+        self._compute = None
+        self._prewarm_thread = None
+
+    def _record(self, result):
+        SEARCH_CACHE.inc(result=result)
+        with self._popularity_lock:
+            self._lookups += 1
+            self._hits += result == 'hit'
+            SEARCH_CACHE_HIT_RATIO.set(self._hits / self._lookups)
+        SEARCH_CACHE_ENTRIES.set(len(self._results))
+
+    def get_or_compute(self, query, k, compute, where=None):
+        """返回缓存结果；未命中或已过期时调用 compute(query, k, where) 计算并缓存。"""
+        key = (normalize_query(query), k, json.dumps(where, sort_keys=True, ensure_ascii=False) if where else None)
+        generation = get_index_generation()
+        with self._popularity_lock:
+            self._popularity[key] += 1
+            # 热门统计只保留有限条目，避免长尾查询无限增长
+            if len(self._popularity) > self._results.max_entries * 4:
+                self._popularity = Counter(dict(self._popularity.most_common(self._results.max_entries)))
+        self._ensure_prewarm_thread(compute)
+
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == generation:
+            self._record('hit')
+            return cached[1]
+        self._record('stale' if cached is not None else 'miss')
+        return self._store(key, generation, compute(query, k, where))
+
+    def _store(self, key, generation, results):
+        self._results.put(key, (generation, results))
+        SEARCH_CACHE_ENTRIES.set(len(self._results))
+        return results
+
+    def _ensure_prewarm_thread(self, compute):
+        if self.prewarm_count <= 0 or self._prewarm_thread is not None:
+            return
+        with self._popularity_lock:
+            if self._prewarm_thread is not None:
+                return
+            self._compute = compute
+            self._prewarm_thread = threading.Thread(target=self._prewarm_loop, daemon=True, name='search-cache-prewarm')
+            self._prewarm_thread.start()
+
+    def _prewarm_loop(self):
+        """后台线程：索引代数变化且稳定 prewarm_delay 秒后，重新计算最热门的查询。"""
+        warmed_generation = get_index_generation()
+        while True:
+            time.sleep(self.prewarm_delay)
+            try:
+                generation = get_index_generation()
+                if generation == warmed_generation:
+                    continue
+                time.sleep(self.prewarm_delay)
+                if get_index_generation() != generation:
+                    continue  # 仍在频繁写入，等下一轮
+                with self._popularity_lock:
+                    top_keys = [key for key, _ in self._popularity.most_common(self.prewarm_count)]
+                start = time.perf_counter()
+                for query, k, where_key in top_keys:
+                    where = json.loads(where_key) if where_key else None
+                    self._store((query, k, where_key), generation, self._compute(query, k, where))
+                warmed_generation = generation
+                logger.info(f"搜索缓存已为索引代数 {generation} 预热 {len(top_keys)} 个热门查询，耗时 {time.perf_counter() - start:.2f}s。")
+            except Exception as e:
+                logger.error(f"预热搜索缓存时出错: {e}", exc_info=True)
+
+search_result_cache = SearchResultCache()
@@ -0,0 +1,193 @@
+import os
+import re
+import time
+import bisect
+import heapq
+import threading
+
+from ..utils.logger import logger
+from ..utils.metrics import SUGGEST_SECONDS, SUGGEST_TERMS
+from ..tasks import TASK_BACKEND
+from .chroma_service import get_index_generation
+from .openai_service import SUMMARY_FAILED
+from .search_cache import LRUCache, normalize_query
+
+# --- 搜索建议 ---
+# 从章节摘要的关键词行（人物、地点、事件等）提取词条，按出现的章节数排序，用于搜索框的前缀补全，不调用 embedding。
+# 词条按规范化形式排序保存，前缀查询用二分定位区间；入库、删除、重命名章节时增量更新。
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+# 超过该长度的行视为关键句，不作为建议
+SUGGEST_MAX_TERM_LENGTH = int(os.getenv('SUGGEST_MAX_TERM_LENGTH', 24))
+SUGGEST_CACHE_SIZE = int(os.getenv('SUGGEST_CACHE_SIZE', 2048))
+# sqlite 任务后端下由其他进程入库的章节不会触发增量更新；索引代数变化后最多每隔这么久（秒）在后台重建一次
+SUGGEST_REBUILD_INTERVAL = float(os.getenv('SUGGEST_REBUILD_INTERVAL', 60))
+
+_SECTION_PREFIX_RE = re.compile(r'^(关键词|关键句)\s*[:：]?\s*')
+_BULLET_RE = re.compile(r'^(?:[-*•·]|\d+\s*[.、)）])\s*')
+_SEPARATOR_RE = re.compile(r'[，,、;；/|]')
+_TRIM_CHARS = ' \t。.!！?？"“”\'‘’：:（）()[]【】'
+
+def extract_terms(summary):
+    """从摘要中提取候选词条（去重）。"""
+    if not summary or summary.startswith(SUMMARY_FAILED):
+        return set()
+    terms = set()
+    for line in summary.splitlines():
+        line = _BULLET_RE.sub('', _SECTION_PREFIX_RE.sub('', line.strip()))
+        for part in _SEPARATOR_RE.split(line):
+            part = part.strip(_TRIM_CHARS)
+            if 1 < len(part) <= SUGGEST_MAX_TERM_LENGTH:
+                terms.add(part)
+    return terms
+
+class SuggestIndex:
+    """内存中的词条前缀索引。
+
+    每个章节记录其词条集合，词条的权重为包含它的章节数；同一规范化形式的词条以第一次出现的写法展示。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chapters = {}  # (comic_hash, 章节名) -> 规范化词条集合
+        self._counts = {}    # 规范化词条 -> 章节数
+        self._display = {}   # 规范化词条 -> 展示用写法
+        self._keys = []      # 排序后的规范化词条
+        self._cache = LRUCache(SUGGEST_CACHE_SIZE)
+        self._version = 0
+        self.ready = False
+        self._generation = None
+        self._built_at = 0.0
+        self._rebuilding = False
+
+    def _add_terms(self, chapter_key, terms):
+        normalized = set()
+        for term in terms:
+            key = normalize_query(term)
+            if not key or key in normalized:
+                continue
+            normalized.add(key)
+            count = self._counts.get(key, 0)
+            if count == 0:
+                bisect.insort(self._keys, key)
+                self._display[key] = term
+            self._counts[key] = count + 1
+        self._chapters[chapter_key] = normalized
+
+    def _remove_chapter(self, chapter_key):
+        for key in self._chapters.pop(chapter_key, ()):
+            count = self._counts[key] - 1
+            if count:
+                self._counts[key] = count
+                continue
+            del self._counts[key]
+            del self._display[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def _changed(self):
+        self._version += 1
+        SUGGEST_TERMS.set(len(self._keys))
+
+    def index_chapter(self, comic_hash, chapter_name, summary):
+        """写入（或替换）章节的词条。"""
+        terms = extract_terms(summary)
+        with self._lock:
+            self._remove_chapter((comic_hash, chapter_name))
+            if terms:
+                self._add_terms((comic_hash, chapter_name), terms)
+            self._changed()
+
+    def delete(self, comic_hash, chapter_name=None):
+        """删除章节的词条；chapter_name 为 None 时删除整部漫画。"""
+        with self._lock:
+            keys = [key for key in self._chapters if key[0] == comic_hash and (chapter_name is None or key[1] == chapter_name)]
+            for key in keys:
+                self._remove_chapter(key)
+            if keys:
+                self._changed()
+
+    def rename(self, comic_hash, old_name, new_name):
+        with self._lock:
+            terms = self._chapters.pop((comic_hash, old_name), None)
+            if terms is not None:
+                self._chapters[(comic_hash, new_name)] = terms
+
+    def suggest(self, prefix, limit=8):
+        """返回以 prefix 开头、按章节数降序的 [(词条, 章节数)]。"""
+        with SUGGEST_SECONDS.time():
+            self._check_stale()
+            key = normalize_query(prefix)
+            if not key:
+                return []
+            cache_key = (key, limit)
+            with self._lock:
+                cached = self._cache.get(cache_key)
+                if cached is not None and cached[0] == self._version:
+                    return cached[1]
+                start = bisect.bisect_left(self._keys, key)
+                end = bisect.bisect_left(self._keys, key + '\U0010ffff', start)
+                top = heapq.nsmallest(limit, self._keys[start:end], key=lambda term: (-self._counts[term], len(term), term))
+                result = [(self._display[term], self._counts[term]) for term in top]
+                self._cache.put(cache_key, (self._version, result))
+            return result
+
+    def rebuild(self):
+        """扫描磁盘上全部章节摘要，重建索引。构建期间查询使用旧索引。"""
+        generation = get_index_generation()
+        fresh = SuggestIndex()
+        chapters = 0
+        if os.path.exists(DATA_BASE_PATH):
+            for comic_hash in os.listdir(DATA_BASE_PATH):
+                summary_dir = os.path.join(DATA_BASE_PATH, comic_hash, 'cap_summary')
+                if not os.path.isdir(summary_dir):
+                    continue
+                for chapter_name in os.listdir(summary_dir):
+                    try:
+                        with open(os.path.join(summary_dir, chapter_name, 'summary.txt'), 'r', encoding='utf-8') as f:
+                            terms = extract_terms(f.read())
+                    except OSError:
+                        continue
+                    if terms:
+                        fresh._add_terms((comic_hash, chapter_name), terms)
+                        chapters += 1
+        with self._lock:
+            self._chapters, self._counts, self._display, self._keys = fresh._chapters, fresh._counts, fresh._display, fresh._keys
+            self._generation = generation
+            self._built_at = time.monotonic()
+            self.ready = True
+            self._changed()
+        logger.info(f"搜索建议索引已构建：{chapters} 个章节，{len(self._keys)} 个词条。")
+
+    def _check_stale(self):
+        """sqlite 任务后端下，其他进程的入库不会经过本进程；索引代数变化时按间隔在后台重建。"""
+        if TASK_BACKEND != 'sqlite' or self._rebuilding or time.monotonic() - self._built_at < SUGGEST_REBUILD_INTERVAL:
+            return
+        if get_index_generation() != self._generation:
+            self.start_rebuild()
+
+    def start_rebuild(self):
+        """在后台线程中重建索引。"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"构建搜索建议索引时出错: {e}", exc_info=True)
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, daemon=True, name='comic-suggest-index').start()
+
+suggest_index = SuggestIndex()
+
+def index_chapter_terms(comic_hash, chapter_name, summary):
+    suggest_index.index_chapter(comic_hash, chapter_name, summary)
+
+def delete_chapter_terms(comic_hash, chapter_name=None):
+    suggest_index.delete(comic_hash, chapter_name)
+
+def rename_chapter_terms(comic_hash, old_name, new_name):
+    suggest_index.rename(comic_hash, old_name, new_name)
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from werkzeug.utils import secure_filename
+
+from ..utils.logger import logger
+
+# --- 分块上传 ---
+# 每个上传会话在上传目录下占用一个子目录：data.part 为已接收的数据，state.json 为会话元数据。
+# 已接收的字节数以 data.part 的实际大小为准，网络中断后客户端查询偏移量即可续传。
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+# 超过该时长未活动的会话会被清理（已完成的会话保留其记录直到过期，便于客户端重复确认）
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+SESSION_DIR_NAME = '.chunked'
+_COPY_BLOCK_SIZE = 1024 * 1024
+
+_sessions_lock = threading.Lock()
+_session_locks = {}
+# 进程内缓存的增量哈希：upload_id -> (已哈希字节数, hashlib 对象)
+_hashers = {}
+
+def _session_path(upload_folder, upload_id):
+    return os.path.join(upload_folder, SESSION_DIR_NAME, upload_id)
+
+def _session_lock(upload_id):
+    with _sessions_lock:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+def _read_state(session_path):
+    state_path = os.path.join(session_path, 'state.json')
+    if not os.path.exists(state_path):
+        return None
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return None
+
+def _write_state(session_path, state):
+    state_path = os.path.join(session_path, 'state.json')
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, state_path)
+
+def _public_state(upload_id, state, offset):
+    info = {'upload_id': upload_id, 'filename': state['filename'], 'size': state['size'], 'offset': offset,
+            'chunk_size': UPLOAD_CHUNK_SIZE, 'completed': state.get('completed', False),
+            'auto_complete': state.get('auto_complete', True)}
+    info.update(state.get('result', {}))
+    return info
+
+def _hasher_for(upload_id, part_path, offset):
+    """返回与 data.part 前 offset 字节一致的哈希对象；进程重启后按块重新计算一次。"""
+    cached = _hashers.get(upload_id)
+    if cached and cached[0] == offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    with open(part_path, 'rb') as f:
+        remaining = offset
+        while remaining > 0:
+            block = f.read(min(_COPY_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    _hashers[upload_id] = (offset, hasher)
+    return hasher
+
+def purge_stale_uploads(upload_folder):
+    """清理超时的上传会话。"""
+    base = os.path.join(upload_folder, SESSION_DIR_NAME)
+    if not os.path.isdir(base):
+        return
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    for upload_id in os.listdir(base):
+        session_path = os.path.join(base, upload_id)
+        try:
+            if os.path.getmtime(session_path) < cutoff:
+                for name in os.listdir(session_path):
+                    os.remove(os.path.join(session_path, name))
+                os.rmdir(session_path)
+                _hashers.pop(upload_id, None)
+                logger.info(f"已清理过期的上传会话: {upload_id}")
+        except OSError as e:
+            logger.warning(f"清理上传会话 {upload_id} 失败: {e}")
+
+def create_upload(upload_folder, filename, size, expected_sha256=None, auto_complete=True):
+    """创建上传会话，返回会话状态。
+
+    expected_sha256 会在完成时校验；auto_complete 为 False 时最后一块到达后不自动完成，
+    由客户端调用 complete 并在那时提供校验值。
+    """
+    purge_stale_uploads(upload_folder)
+    upload_id = uuid.uuid4().hex
+    session_path = _session_path(upload_folder, upload_id)
+    os.makedirs(session_path)
+    open(os.path.join(session_path, 'data.part'), 'wb').close()
+    state = {'filename': filename, 'size': size, 'created_at': time.time(), 'completed': False,
+             'auto_complete': auto_complete}
+    if expected_sha256:
+        state['expected_sha256'] = expected_sha256.lower()
+    _write_state(session_path, state)
+    _hashers[upload_id] = (0, hashlib.sha256())
+    logger.info(f"创建分块上传会话 {upload_id}: '{filename}' ({size} 字节)")
+    return _public_state(upload_id, state, 0)
+
+def get_upload(upload_folder, upload_id):
+    """查询上传会话，offset 为服务端已接收的字节数。会话不存在时返回 None。"""
+    session_path = _session_path(upload_folder, upload_id)
+    state = _read_state(session_path)
+    if state is None:
+        return None
+    part_path = os.path.join(session_path, 'data.part')
+    offset = state['size'] if state.get('completed') else os.path.getsize(part_path)
+    return _public_state(upload_id, state, offset)
+
+def append_chunk(upload_folder, upload_id, offset, stream):
+    """从 stream 按块读取数据追加到会话文件，同时增量更新 SHA-256。
+
+    offset 必须等于服务端已接收的字节数，否则返回 (False, 说明)；成功时返回 (True, 会话状态)。
+    连接中途断开时，已写入的部分同样计入偏移量，客户端查询后从该处续传即可。
+    """
+    session_path = _session_path(upload_folder, upload_id)
+    with _session_lock(upload_id):
+        state = _read_state(session_path)
+        if state is None:
+            return False, '上传会话不存在'
+        if state.get('completed'):
+            return False, '上传已完成'
+        part_path = os.path.join(session_path, 'data.part')
+        current = os.path.getsize(part_path)
+        if offset != current:
+            return False, f'偏移量不匹配：服务端已接收 {current} 字节'
+
+        hasher = _hasher_for(upload_id, part_path, current)
+        written = current
+        try:
+            with open(part_path, 'ab') as f:
+                while written < state['size']:
+                    block = stream.read(min(_COPY_BLOCK_SIZE, state['size'] - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    hasher.update(block)
+                    written += len(block)
+        finally:
+            _hashers[upload_id] = (written, hasher)
+        return True, _public_state(upload_id, state, written)
+
+def complete_upload(upload_folder, upload_id, expected_sha256=None, on_complete=None):
+    """完成上传：校验长度（及可选的 SHA-256），把文件移入上传目录。
+
+    文件以 "<upload_id>_<清理后的文件名>" 存入上传目录，同名的并发上传不会互相覆盖。
+    on_complete(文件路径, sha256, 原始文件名) 只在首次完成时于会话锁内调用一次，其返回的字典会记录在会话中，
+    因此重复确认不会重复入队；它抛出的异常会在把文件移回会话目录后原样抛出，
+    会话保持未完成，可以再次确认。
+    已完成的会话再次确认时仍会用 expected_sha256 比对已记录的哈希。
+    返回 (True, 会话状态) 或 (False, 说明)。
+    """
+    session_path = _session_path(upload_folder, upload_id)
+    with _session_lock(upload_id):
+        state = _read_state(session_path)
+        if state is None:
+            return False, '上传会话不存在'
+        expected = [value.lower() for value in (expected_sha256, state.get('expected_sha256')) if value]
+        if state.get('completed'):
+            digest = state['result']['sha256']
+            if any(value != digest for value in expected):
+                return False, f'SHA-256 校验失败：{digest}'
+            return True, _public_state(upload_id, state, state['size'])
+        part_path = os.path.join(session_path, 'data.part')
+        received = os.path.getsize(part_path)
+        if received != state['size']:
+            return False, f"上传未完成：已接收 {received}/{state['size']} 字节"
+
+        digest = _hasher_for(upload_id, part_path, received).hexdigest()
+        if any(value != digest for value in expected):
+            return False, f'SHA-256 校验失败：{digest}'
+
+        # 会话 ID 放在清理之前拼接：中文文件名清理后只剩扩展名，前缀保证扩展名前的 "." 不被去掉
+        filepath = os.path.join(upload_folder, secure_filename(f"{upload_id}_{state['filename']}"))
+        os.replace(part_path, filepath)
+        result = {'sha256': digest}
+        if on_complete is not None:
+            try:
+                result.update(on_complete(filepath, digest, state['filename']) or {})
+            except Exception:
+                os.replace(filepath, part_path)
+                raise
+        _hashers.pop(upload_id, None)
+        logger.info(f"分块上传 {upload_id} 完成: '{filepath}' (sha256={digest})")
+
+        state.update({'completed': True, 'result': result})
+        _write_state(session_path, state)
+        return True, _public_state(upload_id, state, state['size'])
@@ -0,0 +1,325 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+
+# --- 向量存储接口 ---
+# chroma_service 通过下列与 Chroma Collection 相同的方法子集访问向量库，
+# 因此 Chroma 的 Collection 本身即是一个实现：
+#   upsert(ids, embeddings, documents, metadatas)
+#   query(query_embeddings, n_results, where=None)     -> {'ids', 'distances', 'metadatas', 'documents'}，每项为按查询分组的列表
+#   get(ids=None, where=None, include=None)            -> {'ids', 'metadatas', 'documents', 'embeddings'}
+#   delete(ids=None, where=None)
+#   count()
+# 距离统一为平方 L2，与 Chroma 默认的 l2 空间一致，search_comics 的相似度换算无需区分后端。
+
+_VALID_DTYPES = {'float16': np.float16, 'int8': np.int8}
+_WHERE_OPERATORS = {'$eq': '=', '$ne': '!=', '$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+def _where_sql(where):
+    """把 Chroma 风格的 where 条件转换为针对 metadata JSON 列的 SQL 片段，返回 (sql, params)。"""
+    if not where:
+        return '1', []
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ('$and', '$or'):
+            parts = [_where_sql(sub) for sub in condition]
+            joiner = ' AND ' if key == '$and' else ' OR '
+            clauses.append('(' + joiner.join(sql for sql, _ in parts) + ')')
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+        # 路径以字面量写入 SQL，使 comic_hash 上的表达式索引可被使用
+        if not isinstance(key, str) or any(c in key for c in '"\'\\'):
+            raise ValueError(f"不支持的元数据字段名: {key!r}")
+        column = f"json_extract(metadata, '$.\"{key}\"')"
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, value in condition.items():
+            if op in _WHERE_OPERATORS:
+                clauses.append(f"{column} {_WHERE_OPERATORS[op]} ?")
+                params.append(value)
+            elif op in ('$in', '$nin'):
+                values = list(value)
+                placeholders = ', '.join('?' for _ in values) or 'NULL'
+                clauses.append(f"{column} {'IN' if op == '$in' else 'NOT IN'} ({placeholders})")
+                params.extend(values)
+            else:
+                raise ValueError(f"不支持的 where 操作符: {op}")
+    return ' AND '.join(clauses) or '1', params
+
+class NumpyVectorStore:
+    """基于内存映射 NumPy 数组的紧凑向量库，精确（分块）暴力检索。
+
+    向量按槽位存放在 vectors.<dtype>.bin 中（float16，或逐行缩放的 int8），
+    id、文档和元数据保存在同目录的 SQLite 旁路文件中。读取走 memmap，由操作系统页缓存按需加载，
+    常驻内存只有每行的范数与缩放系数；写入通过 pwrite 完成，多个进程可以共享同一目录。
+    """
+
+    def __init__(self, path, dtype='float16', block_rows=65536):
+        if dtype not in _VALID_DTYPES:
+            raise ValueError(f"不支持的向量存储类型: {dtype}（可选 float16 / int8）")
+        self.path = path
+        self.dtype = dtype
+        self.block_rows = block_rows
+        os.makedirs(path, exist_ok=True)
+        self._db_path = os.path.join(path, 'meta.db')
+        self._vec_path = os.path.join(path, f'vectors.{dtype}.bin')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 查询用的缓存，元数据版本变化时重新加载
+        self._version = None
+        self._dim = None
+        self._matrix = None
+        self._norms = None
+        self._scales = None
+        self._valid = None
+        if not os.path.exists(self._vec_path):
+            open(self._vec_path, 'wb').close()
+
+    # --- 内部工具 ---
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS entries (
+                    slot INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL UNIQUE,
+                    document TEXT,
+                    metadata TEXT NOT NULL,
+                    norm REAL NOT NULL,
+                    scale REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY);
+                CREATE INDEX IF NOT EXISTS entries_comic_hash ON entries (json_extract(metadata, '$."comic_hash"'));
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, conn, key, default=None):
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _bump_version(self, conn):
+        self._set_meta(conn, 'version', int(self._meta(conn, 'version', 0)) + 1)
+
+    def _row_bytes(self, dim):
+        return dim * np.dtype(_VALID_DTYPES[self.dtype]).itemsize
+
+    def _quantize(self, vector):
+        """返回 (存储用的行, 缩放系数, 反量化后的平方范数)。"""
+        if self.dtype == 'int8':
+            peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+            scale = peak / 127.0 if peak > 0 else 1.0
+            row = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+            restored = row.astype(np.float32) * scale
+        else:
+            scale = 1.0
+            row = vector.astype(np.float16)
+            restored = row.astype(np.float32)
+        return row, scale, float(np.dot(restored, restored))
+
+    def _dequantize(self, rows, scales):
+        block = np.asarray(rows, dtype=np.float32)
+        if self.dtype == 'int8':
+            block *= scales[:, None]
+        return block
+
+    def _allocate_slot(self, conn):
+        row = conn.execute('SELECT slot FROM free_slots ORDER BY slot LIMIT 1').fetchone()
+        if row:
+            conn.execute('DELETE FROM free_slots WHERE slot = ?', (row[0],))
+            return row[0]
+        slot = int(self._meta(conn, 'next_slot', 0))
+        self._set_meta(conn, 'next_slot', slot + 1)
+        return slot
+
+    def _refresh(self):
+        """元数据版本变化（包括其他进程写入）时重新加载范数、缩放系数和有效位图，并重新映射向量文件。"""
+        conn = self._conn()
+        version = self._meta(conn, 'version', '0')
+        if version == self._version:
+            return
+        with self._lock:
+            dim = self._meta(conn, 'dim')
+            rows = int(self._meta(conn, 'next_slot', 0))
+            self._dim = int(dim) if dim else None
+            if not self._dim or rows == 0:
+                self._matrix = None
+                self._norms = self._scales = self._valid = np.zeros(0, dtype=np.float32)
+                self._version = version
+                return
+            norms = np.zeros(rows, dtype=np.float32)
+            scales = np.ones(rows, dtype=np.float32)
+            valid = np.zeros(rows, dtype=bool)
+            for slot, norm, scale in conn.execute('SELECT slot, norm, scale FROM entries'):
+                norms[slot], scales[slot], valid[slot] = norm, scale, True
+            self._matrix = np.memmap(self._vec_path, dtype=_VALID_DTYPES[self.dtype], mode='r', shape=(rows, self._dim))
+            self._norms, self._scales, self._valid = norms, scales, valid
+            self._version = version
+
+    def _slots_matching(self, conn, where):
+        sql, params = _where_sql(where)
+        return np.fromiter((row[0] for row in conn.execute(f'SELECT slot FROM entries WHERE {sql}', params)), dtype=np.int64)
+
+    def _fetch(self, conn, column, value_list):
+        """按 slot 或 id 批量读取条目，保持输入顺序。"""
+        found = {}
+        for start in range(0, len(value_list), 500):
+            chunk = value_list[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in conn.execute(f'SELECT slot, id, document, metadata, scale FROM entries WHERE {column} IN ({placeholders})', chunk):
+                found[row[0] if column == 'slot' else row[1]] = row
+        return [found[value] for value in value_list if value in found]
+
+    # --- 公共接口 ---
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("embeddings 必须是与 ids 等长的二维数组")
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            dim = self._meta(conn, 'dim')
+            if dim is None:
+                dim = vectors.shape[1]
+                self._set_meta(conn, 'dim', dim)
+                self._set_meta(conn, 'dtype', self.dtype)
+            dim = int(dim)
+            if vectors.shape[1] != dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与库中维度 {dim} 不一致")
+            row_bytes = self._row_bytes(dim)
+            fd = os.open(self._vec_path, os.O_RDWR)
+            try:
+                for entry_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                    existing = conn.execute('SELECT slot FROM entries WHERE id = ?', (entry_id,)).fetchone()
+                    slot = existing[0] if existing else self._allocate_slot(conn)
+                    row, scale, norm = self._quantize(vector)
+                    os.pwrite(fd, row.tobytes(), slot * row_bytes)
+                    conn.execute(
+                        'INSERT OR REPLACE INTO entries (slot, id, document, metadata, norm, scale) VALUES (?, ?, ?, ?, ?, ?)',
+                        (slot, entry_id, document, json.dumps(metadata, ensure_ascii=False), norm, scale)
+                    )
+                # 向量文件长度至少覆盖所有已分配槽位，memmap 才能完整映射
+                required = int(self._meta(conn, 'next_slot', 0)) * row_bytes
+                if os.fstat(fd).st_size < required:
+                    os.ftruncate(fd, required)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, ids=None, where=None):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if ids is not None:
+                rows = self._fetch(conn, 'id', list(ids))
+                slots = [row[0] for row in rows]
+            else:
+                slots = self._slots_matching(conn, where).tolist()
+            for slot in slots:
+                conn.execute('DELETE FROM entries WHERE slot = ?', (slot,))
+                conn.execute('INSERT OR IGNORE INTO free_slots (slot) VALUES (?)', (slot,))
+            if slots:
+                self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, ids=None, where=None, include=None):
+        include = include or ['metadatas', 'documents']
+        conn = self._conn()
+        if ids is not None:
+            rows = self._fetch(conn, 'id', list(ids))
+        else:
+            sql, params = _where_sql(where)
+            rows = conn.execute(f'SELECT slot, id, document, metadata, scale FROM entries WHERE {sql} ORDER BY slot', params).fetchall()
+        result = {'ids': [row[1] for row in rows], 'included': include}
+        result['metadatas'] = [json.loads(row[3]) for row in rows] if 'metadatas' in include else None
+        result['documents'] = [row[2] for row in rows] if 'documents' in include else None
+        if 'embeddings' in include:
+            self._refresh()
+            slots = np.array([row[0] for row in rows], dtype=np.int64)
+            result['embeddings'] = self._dequantize(self._matrix[slots], self._scales[slots]) if len(slots) else np.zeros((0, self._dim or 0), dtype=np.float32)
+        else:
+            result['embeddings'] = None
+        return result
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        include = include or ['metadatas', 'documents', 'distances']
+        self._refresh()
+        conn = self._conn()
+        result = {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'included': include}
+        if self._matrix is None:
+            for _ in query_embeddings:
+                for key in ('ids', 'distances', 'metadatas', 'documents'):
+                    result[key].append([])
+            return result
+
+        valid = self._valid
+        if where:
+            valid = np.zeros_like(self._valid)
+            slots = self._slots_matching(conn, where)
+            valid[slots[slots < len(valid)]] = True
+            valid &= self._valid
+
+        for query in np.asarray(query_embeddings, dtype=np.float32):
+            best_slots, best_dist = self._top_k(query, n_results, valid)
+            rows = {row[0]: row for row in self._fetch(conn, 'slot', best_slots.tolist())}
+            keep = [n for n, slot in enumerate(best_slots.tolist()) if slot in rows]
+            result['ids'].append([rows[int(best_slots[n])][1] for n in keep])
+            result['distances'].append([float(best_dist[n]) for n in keep])
+            result['metadatas'].append([json.loads(rows[int(best_slots[n])][3]) for n in keep])
+            result['documents'].append([rows[int(best_slots[n])][2] for n in keep])
+        return result
+
+    def _top_k(self, query, k, valid):
+        """分块计算平方 L2 距离并维护当前最优的 k 个，内存占用与库大小无关。"""
+        query_norm = float(np.dot(query, query))
+        best_slots = np.zeros(0, dtype=np.int64)
+        best_dist = np.zeros(0, dtype=np.float32)
+        total = len(valid)
+        for start in range(0, total, self.block_rows):
+            end = min(total, start + self.block_rows)
+            mask = valid[start:end]
+            if not mask.any():
+                continue
+            candidates = np.nonzero(mask)[0]
+            if len(candidates) * 4 < end - start:
+                # 过滤后很稀疏（如限定单部漫画）时只读取命中的行，开销与范围而非库大小成正比
+                rows = candidates + start
+                block = self._dequantize(self._matrix[rows], self._scales[rows])
+                distances = self._norms[rows] - 2.0 * (block @ query) + query_norm
+            else:
+                block = self._dequantize(self._matrix[start:end], self._scales[start:end])
+                distances = (self._norms[start:end] - 2.0 * (block @ query) + query_norm)[candidates]
+            if len(distances) > k:
+                part = np.argpartition(distances, k)[:k]
+                candidates, distances = candidates[part], distances[part]
+            best_slots = np.concatenate([best_slots, candidates + start])
+            best_dist = np.concatenate([best_dist, distances.astype(np.float32)])
+            if len(best_dist) > k:
+                part = np.argpartition(best_dist, k)[:k]
+                best_slots, best_dist = best_slots[part], best_dist[part]
+        order = np.argsort(best_dist, kind='stable')
+        return best_slots[order], np.maximum(best_dist[order], 0.0)
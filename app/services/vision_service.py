@@ -1,10 +1,17 @@
 # 导入必要的库
 import os
+import re
 import time
+import queue
 import base64  # 用于将图片编码为 Base64 字符串
-from openai import OpenAI  # OpenAI 官方库
+import threading
+from collections import deque
+from openai import OpenAI, Timeout  # OpenAI 官方库
 from dotenv import load_dotenv  # 用于从 .env 文件加载环境变量
 from app.utils.logger import logger
+from app.tasks import TaskInterrupted
+from app.utils.metrics import (VISION_IMAGE_BYTES, VISION_BYTES_TOTAL, VISION_TTFT, VISION_SECONDS, VISION_TOKENS_PER_SECOND, VISION_RETRIES,
+                               VISION_TIMEOUTS, VISION_HEDGES, VISION_HEDGE_WASTED_CHUNKS, VISION_HEDGE_WASTED_BYTES)
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
@@ -20,12 +27,48 @@ if not api_key:
 if not api_base:
     raise ValueError("未在 .env 文件中找到 OPENAI_API_BASE")
 
-# 创建 OpenAI 客户端实例
+# --- 超时与对冲 ---
+# 连接超时和单次读取超时（秒）；读取超时只约束每次 socket 读取，因此另设两个有内容的流式块之间的最长间隔
+VISION_CONNECT_TIMEOUT = float(os.getenv("VISION_CONNECT_TIMEOUT", 10))
+VISION_READ_TIMEOUT = float(os.getenv("VISION_READ_TIMEOUT", 120))
+VISION_IDLE_TIMEOUT = float(os.getenv("VISION_IDLE_TIMEOUT", 90))
+# 请求超过近期首 token 延迟的该百分位仍无输出时，发出一个相同的对冲请求，先输出的一方胜出（0 为关闭）
+VISION_HEDGE_PERCENTILE = float(os.getenv("VISION_HEDGE_PERCENTILE", 0))
+VISION_HEDGE_MIN_SAMPLES = int(os.getenv("VISION_HEDGE_MIN_SAMPLES", 20))
+VISION_HEDGE_WINDOW = int(os.getenv("VISION_HEDGE_WINDOW", 200))
+# 每个任务同时进行的视觉请求上限（与 file_processor 的线程池大小相同）；对冲请求同样占用名额，只在有空闲名额时发出
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4))
+
+# 创建 OpenAI 客户端实例；失败重试由 _stream_vision_request 负责，客户端不再自行重试
 client = OpenAI(
     api_key=api_key,
     base_url=api_base,
+    timeout=Timeout(VISION_READ_TIMEOUT, connect=VISION_CONNECT_TIMEOUT),
+    max_retries=0,
 )
 
+VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4-vision-preview")
+
+# --- 提示词 ---
+# 修改提示词时请同时递增版本号，页面描述记录中会保存它
+VISION_PROMPT_VERSION = 1
+SINGLE_PAGE_PROMPT = "请详细描述这幅漫画图片的关键的内容、风格、人物、动作和对话。（精炼，但是内容全面）"
+MULTI_PAGE_PROMPT = (
+    "以下按顺序提供了同一漫画章节中连续的 {count} 页图片。请逐页详细描述每页的关键的内容、风格、人物、动作和对话。（精炼，但是内容全面）\n"
+    "严格按以下格式输出，每页以单独一行的页标记开头，页码从 1 到 {count}，不要输出任何其他内容：\n"
+    "【第1页】\n第1页的描述\n【第2页】\n第2页的描述"
+)
+SINGLE_PAGE_MAX_TOKENS = 2048
+MULTI_PAGE_MAX_TOKENS = 8192
+PAGE_MARKER_RE = re.compile(r'【第(\d+)页】')
+
+class _StreamReset:
+    def __repr__(self):
+        return 'STREAM_RESET'
+
+# 已经产出过文本的请求中途失败、即将从头重试时产出的标记：调用方须丢弃此前收到的全部文本
+STREAM_RESET = _StreamReset()
+
 def encode_image(image_data):
     """将图片数据（路径或字节）编码为 Base64 字符串。"""
     if isinstance(image_data, str):
@@ -38,61 +81,326 @@ def encode_image(image_data):
     else:
         raise TypeError("输入必须是文件路径（str）或图片字节（bytes）")
 
-def analyze_image(image_data, retry_delay=5):
-    """
-    使用视觉模型以流式方式分析单个漫画图片，并返回其内容的文字描述。
-    增加了无限重试逻辑以提高健壮性。
-    
-    Args:
-        image_data (str or bytes): 本地图片文件的路径或图片的二进制数据。
-        retry_delay (int): 重试前的延迟秒数。
-        
-    Yields:
-        str: AI 模型生成的图片描述的文本块。
+class _LatencyWindow:
+    """按请求页数分别记录近期的首 token 延迟，用于计算对冲阈值。"""
+
+    def __init__(self, size):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, pages, seconds):
+        with self._lock:
+            self._samples.setdefault(pages, deque(maxlen=self.size)).append(seconds)
+
+    def threshold(self, pages, percentile):
+        """返回对冲等待时间；未开启或样本不足时返回 None。"""
+        if percentile <= 0:
+            return None
+        with self._lock:
+            samples = sorted(self._samples.get(pages, ()))
+        if len(samples) < VISION_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+_ttft_window = _LatencyWindow(VISION_HEDGE_WINDOW)
+
+_slots_lock = threading.Lock()
+_in_flight = {}  # task_id -> 该任务正在进行的视觉请求数（包括对冲请求和已放弃但连接尚未结束的请求）
+
+def _acquire_slot(task_id, limit=None):
+    """占用任务的一个请求名额；给出 limit 且名额已满时返回 False。"""
+    with _slots_lock:
+        count = _in_flight.get(task_id, 0)
+        if limit is not None and count >= limit:
+            return False
+        _in_flight[task_id] = count + 1
+        return True
+
+def _release_slot(task_id):
+    with _slots_lock:
+        count = _in_flight.get(task_id, 0) - 1
+        if count > 0:
+            _in_flight[task_id] = count
+        else:
+            _in_flight.pop(task_id, None)
+
+class _StreamAttempt:
+    """在后台线程中运行一次流式请求，把 (attempt, 类型, 值) 放入共享队列。
+
+    调用方须已为 task_id 占用一个请求名额，后台线程结束时释放。
     """
-    # 将图片编码为 Base64
-    base64_image = encode_image(image_data)
-    # 从环境变量获取视觉模型名称，如果未设置则使用默认值
-    vision_model = os.getenv("VISION_MODEL", "gpt-4-vision-preview")
-    image_identifier = image_data if isinstance(image_data, str) else "提供的图片字节"
-    attempt = 0
 
-    while True:
+    def __init__(self, content, max_tokens, image_bytes, events, task_id, hedge=False):
+        self.hedge = hedge
+        self.task_id = task_id
+        self.image_bytes = image_bytes
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.chunks = 0
+        self.cancelled = False
+        self._stream = None
+        self._events = events
+        VISION_BYTES_TOTAL.inc(image_bytes)
+        threading.Thread(target=self._run, args=(content, max_tokens), daemon=True, name='vision-stream').start()
+
+    def _run(self, content, max_tokens):
         try:
             # 调用 OpenAI 的 chat completions API，并启用流式响应
-            stream = client.chat.completions.create(
-                model=vision_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            # 提示词，指导模型生成详细的描述
-                            {"type": "text", "text": "请详细描述这幅漫画图片的关键的内容、风格、人物、动作和对话。（精炼，但是内容全面）"},
-                            # 图片数据
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                }
-                            },
-                        ],
-                    }
-                ],
-                max_tokens=2048,  # 限制生成描述的最大长度
+            self._stream = client.chat.completions.create(
+                model=VISION_MODEL,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=max_tokens,  # 限制生成描述的最大长度
                 stream=True,      # 启用流式响应
             )
+            if self.cancelled:
+                self._stream.close()
+                return
             # 遍历流式响应的每个块
-            for chunk in stream:
-                # 提取并返回内容部分
-                content = chunk.choices[0].delta.content
-                if content:
-                    yield content
+            for chunk in self._stream:
+                if self.cancelled:
+                    return
+                content_piece = chunk.choices[0].delta.content if chunk.choices else None
+                if content_piece:
+                    if self.first_token is None:
+                        self.first_token = time.perf_counter()
+                    self.chunks += 1
+                    self._events.put((self, 'chunk', content_piece))
+            self._events.put((self, 'done', None))
+        except Exception as e:
+            if not self.cancelled:
+                self._events.put((self, 'error', e))
+        finally:
+            _release_slot(self.task_id)
+
+    def cancel(self):
+        """放弃本次请求并关闭连接；已卡住的读取会因连接关闭而立即结束。"""
+        self.cancelled = True
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+def _race_stream(content, max_tokens, image_bytes, pages, control=None):
+    """发送一次视觉请求并逐块产出文本，处理空闲超时和对冲。
+
+    请求在后台线程中运行；若超过对冲阈值仍没有任何输出，再发出一个相同的请求，
+    先产出首个文本块的一方胜出，另一方立即关闭，其已发送的图片字节和已输出的块计为浪费。
+    胜出的请求两个文本块之间超过 VISION_IDLE_TIMEOUT 时抛出 TimeoutError，由调用方重试。
+    任务被暂停或取消时立即关闭所有请求并抛出 TaskInterrupted。
+    """
+    if control is not None and control.interrupted():
+        raise TaskInterrupted()
+    events = queue.Queue()
+    task_id = control.task_id if control is not None else None
+    # 主请求的并发已由调用方的线程池限制，这里只计数
+    _acquire_slot(task_id)
+    attempts = [_StreamAttempt(content, max_tokens, image_bytes, events, task_id)]
+    unregister = control.on_interrupt(lambda: events.put((None, 'interrupt', None))) if control is not None else None
+    hedge_after = _ttft_window.threshold(pages, VISION_HEDGE_PERCENTILE)
+    winner = None
+    last_activity = time.perf_counter()
+    try:
+        while True:
+            now = time.perf_counter()
+            wait = last_activity + VISION_IDLE_TIMEOUT - now
+            hedge_due = winner is None and hedge_after is not None and len(attempts) == 1 and not attempts[0].hedge
+            if hedge_due:
+                wait = min(wait, attempts[0].started + hedge_after - now)
+            try:
+                attempt, kind, value = events.get(timeout=max(wait, 0))
+            except queue.Empty:
+                if hedge_due and time.perf_counter() >= attempts[0].started + hedge_after:
+                    if not _acquire_slot(task_id, MAX_CONCURRENT_REQUESTS):
+                        # 名额已满时不对冲，继续等待原请求直到空闲超时
+                        VISION_HEDGES.inc(result='skipped')
+                        hedge_after = None
+                        continue
+                    VISION_HEDGES.inc(result='fired')
+                    logger.info(f"视觉请求 {hedge_after:.1f} 秒内无输出，发出对冲请求。")
+                    attempts.append(_StreamAttempt(content, max_tokens, image_bytes, events, task_id, hedge=True))
+                    continue
+                VISION_TIMEOUTS.inc()
+                raise TimeoutError(f"视觉流式输出超过 {VISION_IDLE_TIMEOUT:.0f} 秒没有新内容")
+
+            if kind == 'interrupt':
+                raise TaskInterrupted()
+            if winner is None:
+                if kind == 'error':
+                    attempts.remove(attempt)
+                    if attempts:
+                        continue  # 另一个请求仍在进行，由它继续竞争
+                    raise value
+                winner = attempt
+                VISION_TTFT.observe(time.perf_counter() - winner.started)
+                _ttft_window.observe(pages, time.perf_counter() - winner.started)
+                for loser in attempts:
+                    if loser is not winner:
+                        loser.cancel()
+                        # 被放弃的请求至少已等待这么久，作为下限计入样本，避免慢请求从窗口中消失
+                        _ttft_window.observe(pages, time.perf_counter() - loser.started)
+                        VISION_HEDGE_WASTED_CHUNKS.inc(loser.chunks)
+                        VISION_HEDGE_WASTED_BYTES.inc(loser.image_bytes)
+                if winner.hedge:
+                    VISION_HEDGES.inc(result='won')
+            elif attempt is not winner:
+                continue
+
+            last_activity = time.perf_counter()
+            if kind == 'chunk':
+                yield value
+            elif kind == 'done':
+                elapsed = last_activity - winner.started
+                VISION_SECONDS.observe(elapsed)
+                streaming = last_activity - winner.first_token if winner.first_token else 0
+                if streaming > 0:
+                    VISION_TOKENS_PER_SECOND.observe(winner.chunks / streaming)
+                return
+            else:
+                raise value
+    finally:
+        # 正常结束时请求已完成；超时、出错、任务中止或调用方提前停止迭代时关闭所有仍在进行的请求
+        if unregister is not None:
+            unregister()
+        for attempt in attempts:
+            attempt.cancel()
+
+def _stream_vision_request(content, max_tokens, identifier, image_bytes, retry_delay, pages=1, control=None):
+    """发送一次视觉流式请求并逐块产出文本；失败或超时时无限重试，任务被暂停或取消时抛出 TaskInterrupted。
+
+    重试会从头重新生成整段回复；失败前已产出过文本时先产出 STREAM_RESET。
+    """
+    attempt = 0
+
+    while True:
+        emitted = False
+        try:
+            for chunk in _race_stream(content, max_tokens, image_bytes, pages, control):
+                emitted = True
+                yield chunk
             # 如果成功处理完流，则跳出重试循环
             return
+        except TaskInterrupted:
+            raise
         except Exception as e:
+            if emitted:
+                yield STREAM_RESET
             # 如果 API 调用失败，记录错误并无限重试
             attempt += 1
-            error_message = f"分析 {image_identifier} 时出错 (尝试 #{attempt}): {e}"
+            VISION_RETRIES.inc()
+            error_message = f"分析 {identifier} 时出错 (尝试 #{attempt}): {e}"
             logger.warning(error_message)
             logger.info(f"{retry_delay}秒后重试...")
             time.sleep(retry_delay)
+            if control is not None and control.interrupted():
+                raise TaskInterrupted()
+
+def _image_part(base64_image):
+    return {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
+
+def analyze_image(image_data, retry_delay=5, control=None):
+    """
+    使用视觉模型以流式方式分析单个漫画图片，并返回其内容的文字描述。
+    增加了无限重试逻辑以提高健壮性。
+    
+    Args:
+        image_data (str or bytes): 本地图片文件的路径或图片的二进制数据。
+        retry_delay (int): 重试前的延迟秒数。
+        control (TaskControl): 所属任务的控制对象，任务被暂停或取消时中止请求并抛出 TaskInterrupted。
+        
+    Yields:
+        str: AI 模型生成的图片描述的文本块；中途失败重试前产出 STREAM_RESET，此前的文本应丢弃。
+    """
+    # 将图片编码为 Base64
+    base64_image = encode_image(image_data)
+    image_bytes = len(base64_image) * 3 // 4
+    VISION_IMAGE_BYTES.observe(image_bytes)
+    image_identifier = image_data if isinstance(image_data, str) else "提供的图片字节"
+    content = [
+        # 提示词，指导模型生成详细的描述
+        {"type": "text", "text": SINGLE_PAGE_PROMPT},
+        # 图片数据
+        _image_part(base64_image),
+    ]
+    yield from _stream_vision_request(content, SINGLE_PAGE_MAX_TOKENS, image_identifier, image_bytes, retry_delay, control=control)
+
+def analyze_images(image_paths, retry_delay=5, control=None):
+    """
+    在一次请求中分析同一章节的多张连续图片，输出以【第N页】标记分隔的逐页描述。
+    可用 BatchOutputSplitter 在流式过程中按页拆分，用 parse_batch_output 校验完整结果。
+
+    Yields:
+        str: AI 模型生成的原始文本块；中途失败重试前产出 STREAM_RESET，此前的文本应丢弃。
+    """
+    base64_images = [encode_image(path) for path in image_paths]
+    image_bytes = 0
+    for base64_image in base64_images:
+        size = len(base64_image) * 3 // 4
+        VISION_IMAGE_BYTES.observe(size)
+        image_bytes += size
+    content = [{"type": "text", "text": MULTI_PAGE_PROMPT.format(count=len(image_paths))}]
+    content.extend(_image_part(base64_image) for base64_image in base64_images)
+    max_tokens = min(MULTI_PAGE_MAX_TOKENS, SINGLE_PAGE_MAX_TOKENS * len(image_paths))
+    identifier = f"{len(image_paths)} 张图片 ({os.path.basename(image_paths[0])} 起)"
+    yield from _stream_vision_request(content, max_tokens, identifier, image_bytes, retry_delay, pages=len(image_paths), control=control)
+
+def parse_batch_output(text, count):
+    """将多页输出拆分为按页顺序的描述列表；格式不符（缺页、重复、空描述）时返回 None。"""
+    markers = list(PAGE_MARKER_RE.finditer(text))
+    if len(markers) != count:
+        return None
+    descriptions = []
+    for i, marker in enumerate(markers):
+        if int(marker.group(1)) != i + 1:
+            return None
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        description = text[marker.end():end].strip()
+        if not description:
+            return None
+        descriptions.append(description)
+    return descriptions
+
+class BatchOutputSplitter:
+    """在流式输出过程中识别【第N页】标记，把文本块路由到对应页面。"""
+
+    def __init__(self, count):
+        self.count = count
+        self.text = ''
+        self._pending = ''
+        self._current = None
+
+    def feed(self, chunk):
+        """输入一个文本块，返回可立即分发的 [(页序号(从0开始), 文本)]。"""
+        self.text += chunk
+        self._pending += chunk
+        routed = []
+        while True:
+            match = PAGE_MARKER_RE.search(self._pending)
+            if match is None:
+                break
+            self._emit(self._pending[:match.start()], routed)
+            page = int(match.group(1)) - 1
+            self._current = page if 0 <= page < self.count else None
+            self._pending = self._pending[match.end():].lstrip('\n')
+        # 末尾可能是被切断的标记，保留到下一个块再判断
+        cut = self._pending.rfind('【')
+        if cut != -1 and '】' not in self._pending[cut:]:
+            self._emit(self._pending[:cut], routed)
+            self._pending = self._pending[cut:]
+        else:
+            self._emit(self._pending, routed)
+            self._pending = ''
+        return routed
+
+    def finish(self):
+        """流结束时分发剩余文本。"""
+        routed = []
+        self._emit(self._pending, routed)
+        self._pending = ''
+        return routed
+
+    def _emit(self, text, routed):
+        if text and self._current is not None:
+            routed.append((self._current, text))
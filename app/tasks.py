@@ -1,9 +1,14 @@
 import threading
 import time
 import os
+import socket
+import importlib
 from collections import deque
 
 from .utils.logger import logger
+from .services import queue_service
+from .utils.metrics import TASK_QUEUE_WAIT, TASK_DURATION
+from .utils import tracing
 
 # --- 任务队列和状态管理 ---
 processing_queue = deque()
@@ -11,6 +16,190 @@ processing_statuses = {}
 queue_lock = threading.Lock()
 status_lock = threading.Lock() # 为状态更新添加专用的锁
 MAX_WORKERS = int(os.getenv('MAX_WORKERS', 4)) # 定义最大并发任务数
+# memory: 任务只在本进程内排队；sqlite: 通过共享 SQLite 队列分发给独立 worker 进程
+TASK_BACKEND = os.getenv('TASK_BACKEND', 'memory').lower()
+LOCAL_WORKERS = int(os.getenv('LOCAL_WORKERS', MAX_WORKERS)) # Web 进程内启动的工作线程数，可为 0
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+SYNC_INTERVAL = 0.2
+# 控制线程为本进程运行中的任务续租的间隔，远小于租约时长，与任务是否发布状态无关
+LEASE_RENEW_INTERVAL = max(1, queue_service.TASK_LEASE_SECONDS // 10)
+# 任务结束时的状态；“已取消”由 cancel_task 产生
+FINAL_STATUSES = ('完成', '失败', '已取消')
+PAUSED_STATUS = '已暂停'
+
+# 每个任务一个通知通道：流块追加和状态更新时递增版本号并唤醒等待者，/stream-ai 据此阻塞等待而不是轮询
+_channels = {}
+_channels_lock = threading.Lock()
+
+class _TaskChannel:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+
+def _channel(task_id):
+    channel = _channels.get(task_id)
+    if channel is None:
+        with _channels_lock:
+            channel = _channels.setdefault(task_id, _TaskChannel())
+    return channel
+
+def notify_task(task_id):
+    """通知正在等待该任务输出的订阅者。"""
+    channel = _channel(task_id)
+    with channel.condition:
+        channel.version += 1
+        channel.condition.notify_all()
+
+def wait_for_task_update(task_id, last_version, timeout):
+    """阻塞直到任务版本号不同于 last_version 或超时，返回当前版本号。"""
+    channel = _channel(task_id)
+    with channel.condition:
+        channel.condition.wait_for(lambda: channel.version != last_version, timeout)
+        return channel.version
+
+def read_stream_updates(task_id, sent_positions):
+    """读取各流中尚未发送的块，返回 (版本号, [(流ID, 块)], 任务状态)，并原地推进 sent_positions。
+
+    在任务通道锁内读取，与 NotifyingBuffer.append 互斥，避免遍历时缓冲区被修改。
+    任务不存在时状态为 None。
+    """
+    channel = _channel(task_id)
+    with channel.condition:
+        task_status = processing_statuses.get(task_id)
+        if task_status is None:
+            return channel.version, [], None
+        chunks = []
+        for stream_id, buffer in list(task_status.get('stream_buffers', {}).items()):
+            position = sent_positions.get(stream_id, 0)
+            if len(buffer) > position:
+                chunks.extend((stream_id, chunk) for chunk in list(buffer)[position:])
+            sent_positions[stream_id] = len(buffer)
+        return channel.version, chunks, task_status.get('status')
+
+class TaskInterrupted(Exception):
+    """任务被暂停或取消时，正在进行的模型请求以此异常中止。"""
+
+class TaskCancelled(TaskInterrupted):
+    """任务已被取消。"""
+
+class TaskControl:
+    """运行中任务的暂停 / 取消信号。
+
+    暂停或取消时立即调用已注册的中止回调（关闭正在进行的流式请求），释放模型并发槽位；
+    处理函数在安排下一项工作前调用 checkpoint()，暂停时在此阻塞，取消时抛出 TaskCancelled。
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.cancelled = False
+        self.paused = False
+        self.resume_status = None
+        self._condition = threading.Condition()
+        self._callbacks = set()
+
+    def interrupted(self):
+        return self.cancelled or self.paused
+
+    def checkpoint(self):
+        """暂停时阻塞到恢复或取消；已取消时抛出 TaskCancelled。"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.cancelled or not self.paused)
+            if self.cancelled:
+                raise TaskCancelled(f"任务 {self.task_id} 已取消")
+
+    def run(self, func, *args, **kwargs):
+        """运行一项可被暂停打断的工作：被暂停中止后等待恢复并重新运行，被取消时抛出 TaskCancelled。"""
+        while True:
+            self.checkpoint()
+            try:
+                return func(*args, **kwargs)
+            except TaskInterrupted:
+                if self.cancelled:
+                    raise TaskCancelled(f"任务 {self.task_id} 已取消")
+
+    def _interrupt(self):
+        with self._condition:
+            callbacks = list(self._callbacks)
+            self._condition.notify_all()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"中止任务 {self.task_id} 的请求时出错: {e}")
+
+    def cancel(self):
+        with self._condition:
+            self.cancelled = True
+        self._interrupt()
+
+    def pause(self):
+        with self._condition:
+            if self.paused or self.cancelled:
+                return False
+            self.paused = True
+        self._interrupt()
+        return True
+
+    def resume(self):
+        with self._condition:
+            if not self.paused:
+                return False
+            self.paused = False
+            self._condition.notify_all()
+            return True
+
+    def on_interrupt(self, callback):
+        """注册中止回调，返回注销函数；已处于暂停或取消状态时立即调用。"""
+        with self._condition:
+            self._callbacks.add(callback)
+            interrupted = self.interrupted()
+        if interrupted:
+            callback()
+        return lambda: self._callbacks.discard(callback)
+
+# 本进程中正在运行的任务的控制对象
+_controls = {}
+
+def get_task_control(task_id):
+    """返回本进程中正在运行的任务的控制对象，任务未在本进程运行时返回 None。"""
+    return _controls.get(task_id)
+
+def _use_shared_queue():
+    return TASK_BACKEND == 'sqlite'
+
+def _func_path(func):
+    """将处理函数转换为可跨进程传递的导入路径。"""
+    return f"{func.__module__}:{func.__name__}"
+
+def _resolve_func(func_path):
+    """根据导入路径加载处理函数。"""
+    module_name, func_name = func_path.split(':', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+def _serializable_status(status):
+    return {k: v for k, v in status.items() if k != 'stream_buffers'}
+
+class NotifyingBuffer(deque):
+    """追加时唤醒该任务订阅者的流缓冲区。"""
+
+    def __init__(self, task_id, log_key):
+        super().__init__()
+        self.task_id = task_id
+        self.log_key = log_key
+
+    def append(self, item):
+        channel = _channel(self.task_id)
+        with channel.condition:
+            super().append(item)
+            channel.version += 1
+            channel.condition.notify_all()
+
+class PublishingBuffer(NotifyingBuffer):
+    """写入时同步发布到共享队列的流缓冲区，供 Web 进程镜像。"""
+
+    def append(self, item):
+        super().append(item)
+        queue_service.publish_chunk(self.task_id, self.log_key, item, WORKER_ID)
 
 def add_task(task_data, process_func):
     """将任务添加到队列中，并初始化其状态。"""
@@ -22,11 +211,7 @@ def add_task(task_data, process_func):
             logger.warning(f"任务 {task_id} ({comic_name}) 已存在，跳过。")
             return
 
-        # 将要执行的函数和其参数一起存储
-        task = {'data': task_data, 'func': process_func}
-        processing_queue.append(task)
-        
-        processing_statuses[task_id] = {
+        status = {
             'task_id': task_id,
             'filename': comic_name,
             'status': '排队中',
@@ -34,8 +219,20 @@ def add_task(task_data, process_func):
             'details': '',
             'start_time': time.time(),
             'end_time': None,
-            'stream_buffers': {}
         }
+        if task_data.get('comic_hash'):
+            status['comic_hash'] = task_data['comic_hash']
+
+        if _use_shared_queue():
+            if not queue_service.enqueue_task(task_id, _func_path(process_func), task_data, status, WORKER_ID):
+                logger.warning(f"任务 {task_id} ({comic_name}) 已存在于共享队列，跳过。")
+                return
+        else:
+            # 将要执行的函数和其参数一起存储
+            task = {'data': task_data, 'func': process_func}
+            processing_queue.append(task)
+
+        processing_statuses[task_id] = dict(status, stream_buffers={})
         logger.info(f"任务 {task_id} ({comic_name}) 已加入队列。")
 
 def get_all_statuses():
@@ -45,13 +242,22 @@ def get_all_statuses():
 
 def update_task_status(task_id, updates):
     """安全地更新任务状态。"""
+    control = _controls.get(task_id)
+    if control is not None and control.paused and updates.get('status') not in (None, PAUSED_STATUS) + FINAL_STATUSES:
+        # 暂停期间仍保持“已暂停”，恢复时再显示处理函数最后报告的状态
+        control.resume_status = updates['status']
+        updates = dict(updates, status=PAUSED_STATUS)
     with status_lock:
         if task_id in processing_statuses:
             processing_statuses[task_id].update(updates)
             # 如果需要，可以记录状态更新
             # logger.debug(f"状态更新 for {task_id}: {updates}")
+            if _use_shared_queue():
+                queue_service.publish_status(task_id, _serializable_status(processing_statuses[task_id]), WORKER_ID)
         else:
             logger.warning(f"尝试更新一个不存在的任务状态: {task_id}")
+            return
+    notify_task(task_id)
 
 def get_or_create_stream_buffer(task_id, log_key):
     """安全地获取或创建流缓冲区。"""
@@ -61,20 +267,133 @@ def get_or_create_stream_buffer(task_id, log_key):
                 processing_statuses[task_id]['stream_buffers'] = {}
             
             if log_key not in processing_statuses[task_id]['stream_buffers']:
-                processing_statuses[task_id]['stream_buffers'][log_key] = deque()
+                buffer = PublishingBuffer(task_id, log_key) if _use_shared_queue() else NotifyingBuffer(task_id, log_key)
+                processing_statuses[task_id]['stream_buffers'][log_key] = buffer
             
             return processing_statuses[task_id]['stream_buffers'][log_key]
         else:
             logger.warning(f"尝试为不存在的任务 {task_id} 获取流缓冲区。")
             return None
 
+def release_stream_buffers(task_id):
+    """丢弃任务的流式输出缓冲区。无人查看实时输出时（如批量导入）用于限制内存占用。"""
+    with status_lock:
+        status = processing_statuses.get(task_id)
+        if status is not None:
+            status['stream_buffers'] = {}
+
+def _mark_cancelled(task_id):
+    update_task_status(task_id, {'status': '已取消', 'details': '任务已取消。', 'end_time': time.time()})
+    logger.info(f"任务 {task_id} 已取消。")
+
+def _apply_control(task_id, action):
+    """对本进程中运行的任务执行 cancel / pause / resume。任务不在本进程运行时返回 False。"""
+    control = _controls.get(task_id)
+    if control is None:
+        return False
+    if action == 'cancel':
+        if not control.cancelled:
+            control.cancel()
+            update_task_status(task_id, {'details': '正在取消，等待进行中的请求中止...'})
+    elif action == 'pause':
+        if control.pause():
+            with status_lock:
+                control.resume_status = processing_statuses.get(task_id, {}).get('status')
+            update_task_status(task_id, {'status': PAUSED_STATUS})
+            logger.info(f"任务 {task_id} 已暂停。")
+    elif action == 'resume':
+        if control.resume():
+            update_task_status(task_id, {'status': control.resume_status or '正在处理'})
+            logger.info(f"任务 {task_id} 已恢复。")
+    return True
+
+def cancel_task(task_id):
+    """取消任务。排队中的任务直接移出队列；运行中的任务立即中止进行中的模型请求，并在下一个检查点停止。
+
+    返回是否找到了可取消的任务。
+    """
+    with queue_lock:
+        queued = next((task for task in processing_queue if task['data']['task_id'] == task_id), None)
+        if queued is not None:
+            processing_queue.remove(queued)
+    if queued is not None or (_use_shared_queue() and queue_service.cancel_queued_task(task_id)):
+        _mark_cancelled(task_id)
+        return True
+    remote = _use_shared_queue() and queue_service.set_task_control(task_id, 'cancel')
+    return _apply_control(task_id, 'cancel') or remote
+
+def pause_task(task_id):
+    """暂停运行中的任务：中止进行中的模型请求并停止安排新的页面，恢复后重新分析被中止的页面。"""
+    remote = _use_shared_queue() and queue_service.set_task_control(task_id, 'pause')
+    return _apply_control(task_id, 'pause') or remote
+
+def resume_task(task_id):
+    """恢复已暂停的任务。"""
+    remote = _use_shared_queue() and queue_service.set_task_control(task_id, 'resume')
+    return _apply_control(task_id, 'resume') or remote
+
+def cancel_comic_tasks(comic_hash, timeout=30):
+    """取消某部漫画所有未结束的任务，并等待其停止（最多 timeout 秒）。返回仍未停止的任务 ID。"""
+    with status_lock:
+        task_ids = [task_id for task_id, status in processing_statuses.items()
+                    if status.get('comic_hash') == comic_hash and status.get('status') not in FINAL_STATUSES]
+    for task_id in task_ids:
+        cancel_task(task_id)
+    deadline = time.time() + timeout
+    while True:
+        with status_lock:
+            running = [task_id for task_id in task_ids if processing_statuses.get(task_id, {}).get('status') not in FINAL_STATUSES]
+        if not running or time.time() >= deadline:
+            return running
+        time.sleep(0.1)
+
+def _control_loop():
+    """共享队列模式下的控制线程：把 Web 进程写入的取消 / 暂停 / 恢复请求应用到本进程运行的任务，
+    并定期为这些任务（包括暂停中和长时间没有状态更新的）续租，避免被其他 worker 当作失联任务重新领取。"""
+    last_renew = 0.0
+    while True:
+        try:
+            task_ids = list(_controls)
+            if task_ids:
+                for task_id, action in queue_service.fetch_task_controls(task_ids):
+                    _apply_control(task_id, action)
+                if time.monotonic() - last_renew >= LEASE_RENEW_INTERVAL:
+                    queue_service.touch_tasks(task_ids, WORKER_ID)
+                    last_renew = time.monotonic()
+        except Exception as e:
+            logger.error(f"读取任务控制请求时出错: {e}", exc_info=True)
+        time.sleep(SYNC_INTERVAL)
+
+def start_control_thread():
+    """启动任务控制线程（仅 sqlite 后端，且每个进程一个）。"""
+    if not _use_shared_queue():
+        return
+    if any(t.name == 'comic-task-control' for t in threading.enumerate()):
+        return
+    threading.Thread(target=_control_loop, daemon=True, name='comic-task-control').start()
+
+def _next_task():
+    """从本地队列或共享队列中取出下一个任务。"""
+    if not _use_shared_queue():
+        with queue_lock:
+            return processing_queue.popleft() if processing_queue else None
+
+    claimed = queue_service.claim_task(WORKER_ID)
+    if claimed is None:
+        return None
+    task_id, func_path, task_data, status = claimed
+    with status_lock:
+        processing_statuses[task_id] = dict(status, stream_buffers={})
+    return {'data': task_data, 'func': _resolve_func(func_path)}
+
 def worker():
     """后台工作线程"""
     while True:
-        task_to_run = None
-        with queue_lock:
-            if processing_queue:
-                task_to_run = processing_queue.popleft()
+        try:
+            task_to_run = _next_task()
+        except Exception as e:
+            logger.error(f"获取任务时出错: {e}", exc_info=True)
+            task_to_run = None
         
         if task_to_run:
             task_data = task_to_run['data']
@@ -82,27 +401,121 @@ def worker():
             task_id = task_data['task_id']
             
             logger.info(f"工作线程获取到新任务: {task_id}")
+            with status_lock:
+                enqueued_at = processing_statuses.get(task_id, {}).get('start_time')
+            if enqueued_at:
+                queue_wait = max(0.0, time.time() - enqueued_at)
+                TASK_QUEUE_WAIT.observe(queue_wait)
+                if tracing.is_enabled():
+                    tracing.record_span(task_id, 'queue_wait', 'queue', time.perf_counter_ns() - int(queue_wait * 1e9), int(queue_wait * 1e9))
+            task_start = time.perf_counter()
+            _controls[task_id] = TaskControl(task_id)
             try:
-                process_func(task_data)
+                with tracing.task_context(task_id), tracing.span('task', filename=task_data.get('comic_name')):
+                    process_func(task_data)
+            except TaskCancelled:
+                _mark_cancelled(task_id)
             except Exception as e:
                 logger.error(f"执行任务 {task_id} 时发生未捕获的异常: {e}", exc_info=True)
                 update_task_status(task_id, {'status': '失败', 'details': f'工作线程错误: {e}'})
+            finally:
+                _controls.pop(task_id, None)
+                with status_lock:
+                    final_status = processing_statuses.get(task_id, {}).get('status', '未知')
+                TASK_DURATION.observe(time.perf_counter() - task_start, status=final_status)
+                try:
+                    tracing.finish_task(task_id)
+                except OSError as e:
+                    logger.warning(f"保存任务 {task_id} 的追踪数据失败: {e}")
+                if _use_shared_queue():
+                    queue_service.finish_task(task_id)
+                    queue_service.purge_finished_chunks()
+                    queue_service.purge_finished_tasks()
         else:
             time.sleep(1)
 
-def start_worker_threads():
+def _apply_remote_status(task_id, status):
+    """将其他进程发布的任务状态合并到本地（不再重新发布）。"""
+    with status_lock:
+        local = processing_statuses.setdefault(task_id, {'stream_buffers': {}})
+        local.update(status)
+    notify_task(task_id)
+
+def _apply_remote_chunk(task_id, stream_id, chunk):
+    """将其他进程发布的流式输出块追加到本地缓冲区。"""
+    with status_lock:
+        local = processing_statuses.get(task_id)
+        if local is None:
+            return
+        buffers = local.setdefault('stream_buffers', {})
+        if stream_id not in buffers:
+            buffers[stream_id] = NotifyingBuffer(task_id, stream_id)
+        buffers[stream_id].append(chunk)
+
+def sync_shared_queue():
+    """同步线程：把独立 worker 发布的进度和流式输出镜像到本进程，使 /processing 和 /stream-ai 照常工作。"""
+    last_seq = 0
+    last_chunk_id = 0
+    while True:
+        try:
+            # 先读状态再读流块，保证读到“完成”状态时其之前的流块也一定可见
+            updates, last_seq = queue_service.fetch_status_updates(last_seq, WORKER_ID)
+            for task_id, status in updates:
+                _apply_remote_status(task_id, status)
+            chunks, last_chunk_id = queue_service.fetch_stream_chunks(last_chunk_id, WORKER_ID)
+            for task_id, stream_id, chunk in chunks:
+                _apply_remote_chunk(task_id, stream_id, chunk)
+        except Exception as e:
+            logger.error(f"同步共享任务队列时出错: {e}", exc_info=True)
+        time.sleep(SYNC_INTERVAL)
+
+def start_sync_thread():
+    """启动共享队列同步线程（仅 sqlite 后端，且每个进程一个）。"""
+    if not _use_shared_queue():
+        return
+    if any(t.name == 'comic-task-sync' for t in threading.enumerate()):
+        return
+    threading.Thread(target=sync_shared_queue, daemon=True, name='comic-task-sync').start()
+    logger.info(f"共享任务队列同步线程已启动，数据库: {queue_service.TASK_DB_PATH}")
+
+def start_worker_threads(num_workers=None):
     """启动后台工作线程池。"""
+    if num_workers is None:
+        num_workers = LOCAL_WORKERS
+
+    start_sync_thread()
+    if num_workers > 0:
+        start_control_thread()
+
     # 计算已在运行的工作线程数量
     running_workers = [t for t in threading.enumerate() if t.name.startswith('comic-worker-')]
     
-    if len(running_workers) >= MAX_WORKERS:
-        logger.info(f"工作线程池已满 ({len(running_workers)}/{MAX_WORKERS})，无需启动新线程。")
+    if len(running_workers) >= num_workers:
+        logger.info(f"工作线程池已满 ({len(running_workers)}/{num_workers})，无需启动新线程。")
         return
 
     # 启动所需数量的新线程
-    for i in range(MAX_WORKERS - len(running_workers)):
+    for i in range(num_workers - len(running_workers)):
         thread_name = f'comic-worker-{len(running_workers) + i}'
         worker_thread = threading.Thread(target=worker, daemon=True, name=thread_name)
         worker_thread.start()
     
     logger.info(f"后台处理工作线程已启动。当前工作线程数: {sum(1 for t in threading.enumerate() if t.name.startswith('comic-worker-'))}")
+
+def run_standalone_worker(num_workers):
+    """独立 worker 进程入口：只从共享队列领取任务并执行，不启动 Web 服务。"""
+    if not _use_shared_queue():
+        raise RuntimeError("独立 worker 需要设置 TASK_BACKEND=sqlite")
+
+    logger.info(f"独立 worker {WORKER_ID} 启动，线程数: {num_workers}")
+    start_control_thread()
+    threads = []
+    for i in range(num_workers):
+        worker_thread = threading.Thread(target=worker, daemon=True, name=f'comic-worker-{i}')
+        worker_thread.start()
+        threads.append(worker_thread)
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info(f"独立 worker {WORKER_ID} 收到中断信号，正在退出。")
@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import time
+import logging
+
+# 与 setup_logger 中的格式对应：'%(asctime)s - %(levelname)s - %(message)s'
+_HEADER_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - (?P<level>[A-Z]+) - (?P<message>.*)$')
+TAIL_BLOCK_SIZE = 64 * 1024
+
+def _parse_header(line):
+    """解析日志记录首行，返回 (level, message, task_id)；续行（如异常堆栈）返回 None。
+
+    同时支持文本格式和 LOG_FORMAT=json 时的单行 JSON 格式。
+    """
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+            return record.get('level', ''), record.get('message', ''), record.get('task_id')
+        except ValueError:
+            return None
+    match = _HEADER_RE.match(line)
+    if not match:
+        return None
+    return match.group('level'), match.group('message'), None
+
+def make_filter(task_id=None, level=None):
+    """构造日志记录过滤函数。level 为最低级别（如 WARNING 会同时包含 ERROR）。"""
+    min_level = logging.getLevelName(level.upper()) if level else None
+    if not isinstance(min_level, int):
+        min_level = None
+
+    def accept(header):
+        parsed = _parse_header(header)
+        if parsed is None:
+            return task_id is None and min_level is None
+        record_level, message, record_task_id = parsed
+        if min_level is not None:
+            numeric = logging.getLevelName(record_level)
+            if not isinstance(numeric, int) or numeric < min_level:
+                return False
+        if task_id and record_task_id != task_id and f"[{task_id}]" not in message:
+            return False
+        return True
+
+    return accept
+
+def _iter_lines_reversed(f, block_size=TAIL_BLOCK_SIZE):
+    """从文件末尾向前按块读取，逆序产出完整的行（字节串），只读取需要的部分。"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        block = f.read(read_size) + remainder
+        lines = block.split(b'\n')
+        # 第一段可能是不完整的行，留到下一个块拼接
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    if remainder:
+        yield remainder
+
+def tail_log(log_path, max_lines=1000, task_id=None, level=None):
+    """反向读取日志文件末尾，返回最多 max_lines 行符合过滤条件的记录文本。
+
+    多行记录（如异常堆栈）与其首行作为整体参与过滤和计数。
+    """
+    if not os.path.exists(log_path):
+        return []
+    accept = make_filter(task_id, level)
+    records = []
+    continuation = []
+    with open(log_path, 'rb') as f:
+        for raw_line in _iter_lines_reversed(f):
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\r')
+            if not line and not continuation and not records:
+                continue  # 文件末尾的空行
+            if _parse_header(line) is None:
+                continuation.append(line)
+                continue
+            if accept(line):
+                records.append('\n'.join([line] + list(reversed(continuation))))
+                if len(records) >= max_lines:
+                    break
+            continuation = []
+    records.reverse()
+    return records
+
+def follow_log(log_path, task_id=None, level=None, poll_interval=0.5, stop_event=None):
+    """持续跟踪日志文件的新增行（类似 tail -f），处理日志轮转后的重新打开。
+
+    产出符合过滤条件的新行；空闲时产出 None，便于调用方发送心跳或检测断开。
+    """
+    accept = make_filter(task_id, level)
+    f = None
+    inode = None
+    first_open = True
+    last_accepted = False
+    try:
+        while stop_event is None or not stop_event.is_set():
+            if f is None:
+                if not os.path.exists(log_path):
+                    time.sleep(poll_interval)
+                    yield None
+                    continue
+                f = open(log_path, 'rb')
+                inode = os.fstat(f.fileno()).st_ino
+                # 首次打开时只跟踪新内容；轮转后的新文件从头读取
+                if first_open:
+                    f.seek(0, os.SEEK_END)
+                    first_open = False
+
+            line = f.readline()
+            if line and line.endswith(b'\n'):
+                text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if _parse_header(text) is not None:
+                    last_accepted = accept(text)
+                # 续行跟随其首行的过滤结果
+                if last_accepted:
+                    yield text
+                continue
+            if line:
+                # 行尚未写完，回退等待
+                f.seek(-len(line), os.SEEK_CUR)
+
+            try:
+                stat = os.stat(log_path)
+                rotated = stat.st_ino != inode or stat.st_size < f.tell()
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                f.close()
+                f = None
+                continue
+            time.sleep(poll_interval)
+            yield None
+    finally:
+        if f is not None:
+            f.close()
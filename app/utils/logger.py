@@ -1,14 +1,151 @@
 import logging
 import os
+import re
+import json
+import copy
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler, QueueHandler, QueueListener
+
+LOG_DIR = 'logs'
+LOG_FILE = os.path.join(LOG_DIR, 'processing.log')
+TASK_LOG_DIR = os.path.join(LOG_DIR, 'tasks')
+# size: 按大小轮转；time: 按时间轮转（LOG_ROTATE_WHEN 指定周期）
+LOG_ROTATION = os.getenv('LOG_ROTATION', 'size').lower()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 20 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+# text: 传统单行文本；json: 每行一个 JSON 对象
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+# 控制台输出的最低级别，命令行工具可调高以免刷屏
+LOG_CONSOLE_LEVEL = os.getenv('LOG_CONSOLE_LEVEL', 'INFO').upper()
+# 为每个任务额外写一份 JSONL 日志，便于单独查看某部漫画的处理历史
+LOG_PER_TASK = os.getenv('LOG_PER_TASK', 'False').lower() == 'true'
+TASK_LOG_MAX_OPEN = 32
+
+STRUCTURED_FIELDS = ('task_id', 'chapter', 'page')
+# 现有日志消息以 "[task_id] ..." 开头，未显式传入 extra 时从中提取任务ID（到第一个 "] " 为止）。
+# 任务ID包含原始文件名，文件名本身含 "] " 时无法从消息中可靠提取，任务内的日志应显式传入 extra
+_TASK_PREFIX_RE = re.compile(r'^\[(.+?)\] ')
+
+def _ensure_structured_fields(record):
+    """补全记录上的结构化字段（task_id / chapter / page）。"""
+    for field in STRUCTURED_FIELDS:
+        if not hasattr(record, field):
+            setattr(record, field, None)
+    if record.task_id is None:
+        match = _TASK_PREFIX_RE.match(record.getMessage())
+        if match:
+            record.task_id = match.group(1)
+    return record
+
+def task_log_path(task_id):
+    """返回任务专属日志文件路径。"""
+    safe_name = re.sub(r'[^\w.-]', '_', task_id)
+    return os.path.join(TASK_LOG_DIR, f"{safe_name}.jsonl")
+
+class JsonFormatter(logging.Formatter):
+    """将日志记录格式化为单行 JSON，包含任务、章节和页面字段。"""
+
+    def format(self, record):
+        _ensure_structured_fields(record)
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        if record.stack_info:
+            payload['stack'] = record.stack_info
+        return json.dumps(payload, ensure_ascii=False)
+
+class StructuredQueueHandler(QueueHandler):
+    """只合并消息和参数，不像 QueueHandler 默认那样把堆栈格式化进 message 后丢弃 exc_info。
+
+    堆栈在调用线程中格式化为 exc_text（不在队列里持有 traceback 及其栈帧），
+    由监听线程中的各处理器自行输出：文本格式附在消息之后，JSON 格式写入 exc 字段。
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class TaskFileHandler(logging.Handler):
+    """按 task_id 将日志分流写入 logs/tasks/<task_id>.jsonl，只保留少量打开的文件句柄。"""
+
+    def __init__(self, max_open=TASK_LOG_MAX_OPEN):
+        super().__init__()
+        self.max_open = max_open
+        self._files = OrderedDict()
+        os.makedirs(TASK_LOG_DIR, exist_ok=True)
+
+    def _get_file(self, task_id):
+        f = self._files.pop(task_id, None)
+        if f is None:
+            f = open(task_log_path(task_id), 'a', encoding='utf-8')
+            while len(self._files) >= self.max_open:
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+        self._files[task_id] = f
+        return f
+
+    def emit(self, record):
+        try:
+            _ensure_structured_fields(record)
+            if record.task_id is None:
+                return
+            f = self._get_file(record.task_id)
+            f.write(self.format(record) + '\n')
+            f.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        super().close()
+
+def _create_file_handler(log_file):
+    """根据配置创建带轮转的文件处理器。"""
+    if LOG_ROTATION == 'time':
+        return TimedRotatingFileHandler(log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    return RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+
+_listener = None
+_listener_lock = threading.Lock()
+
+def stop_log_listener():
+    """停止后台日志线程并写出队列中剩余的记录。"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
 
 def setup_logger():
     """配置全局日志记录器"""
+    global _listener
     # 创建 logs 目录（如果不存在）
-    log_dir = 'logs'
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-
-    log_file = os.path.join(log_dir, 'processing.log')
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
 
     # 获取根日志记录器
     logger = logging.getLogger()
@@ -18,22 +155,32 @@ def setup_logger():
 
     logger.setLevel(logging.INFO)
 
-    # 创建一个文件处理器，将日志写入文件
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    # 创建一个文件处理器，将日志写入文件（按大小或时间轮转，避免无限增长）
+    file_handler = _create_file_handler(LOG_FILE)
     file_handler.setLevel(logging.INFO)
 
     # 创建一个流处理器，将日志输出到控制台
     stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(logging.INFO)
+    stream_handler.setLevel(LOG_CONSOLE_LEVEL)
 
     # 创建日志格式
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else formatter)
     stream_handler.setFormatter(formatter)
 
-    # 将处理器添加到日志记录器
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    handlers = [file_handler, stream_handler]
+    if LOG_PER_TASK:
+        task_handler = TaskFileHandler()
+        task_handler.setFormatter(JsonFormatter())
+        handlers.append(task_handler)
+
+    # 业务线程只把记录放入队列，磁盘和控制台 I/O 由单独的监听线程完成，慢磁盘不会阻塞分析线程
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(StructuredQueueHandler(log_queue))
+    with _listener_lock:
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    atexit.register(stop_log_listener)
 
     return logger
 
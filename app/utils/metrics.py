@@ -0,0 +1,191 @@
+import time
+import math
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 轻量级指标注册表，输出 Prometheus 文本格式（text/plain; version=0.0.4），无需额外依赖。
+# 指标按进程统计；独立 worker 进程可通过 `worker.py --metrics-port` 单独暴露。
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+class Counter(_Metric):
+    """单调递增计数器（名称应以 _total 结尾）。"""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Gauge(_Metric):
+    """可增可减的瞬时值。"""
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    """累积分桶直方图，附带 _sum 和 _count。"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文管理器，退出时记录耗时（秒）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, list(state['counts'])):
+            cumulative += count
+            le = ('le', _format_value(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+def render_metrics():
+    """以 Prometheus 文本格式导出所有已注册指标。"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """在后台线程中启动一个只提供 /metrics 的 HTTP 服务（供独立 worker 进程使用）。"""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics-server').start()
+    return server
+
+# --- 处理流水线指标 ---
+TASK_QUEUE_WAIT = Histogram('comic_task_queue_wait_seconds', '任务从入队到被工作线程领取的等待时间')
+TASK_DURATION = Histogram('comic_task_duration_seconds', '单个漫画任务的端到端处理时间', ['status'])
+EXTRACT_SECONDS = Histogram('comic_extract_seconds', 'ZIP 解压耗时')
+PAGES_TOTAL = Counter('comic_pages_total', '已处理页面数（result: ok/failed/blank/reused）', ['result'])
+VISION_SLOT_WAIT = Histogram('comic_vision_slot_wait_seconds', '页面提交后等待视觉并发槽位的时间')
+VISION_IMAGE_BYTES = Histogram('comic_vision_image_bytes', '发送给视觉模型的单张图片字节数', buckets=SIZE_BUCKETS)
+VISION_BYTES_TOTAL = Counter('comic_vision_image_bytes_sent_total', '发送给视觉模型的图片总字节数')
+VISION_TTFT = Histogram('comic_vision_time_to_first_token_seconds', '视觉请求的首个 token 延迟')
+VISION_SECONDS = Histogram('comic_vision_request_seconds', '单次成功的视觉流式请求总耗时')
+VISION_TOKENS_PER_SECOND = Histogram('comic_vision_tokens_per_second', '视觉流式输出速率（按流式块计）', buckets=RATE_BUCKETS)
+VISION_BATCH_FALLBACKS = Counter('comic_vision_batch_fallbacks_total', '多页请求结果无法解析而退回单页请求的次数')
+VISION_RETRIES = Counter('comic_vision_retries_total', '视觉请求重试次数')
+VISION_TIMEOUTS = Counter('comic_vision_idle_timeouts_total', '视觉流式输出超过 VISION_IDLE_TIMEOUT 没有新内容而放弃的次数')
+VISION_HEDGES = Counter('comic_vision_hedges_total', '视觉对冲请求次数（result: fired 已发出 / won 先于原请求输出 / skipped 并发名额已满未发出）', ['result'])
+VISION_HEDGE_WASTED_CHUNKS = Counter('comic_vision_hedge_wasted_chunks_total', '对冲竞争中被放弃的请求已输出的流式块数')
+VISION_HEDGE_WASTED_BYTES = Counter('comic_vision_hedge_wasted_image_bytes_total', '对冲竞争中被放弃的请求已发送的图片字节数')
+SUMMARY_TTFT = Histogram('comic_summary_time_to_first_token_seconds', '章节摘要请求的首个 token 延迟')
+SUMMARY_CHUNK_CACHE = Counter('comic_summary_chunk_cache_total', '分块摘要缓存命中情况', ['result'])
+SUMMARY_SECONDS = Histogram('comic_summary_seconds', '章节摘要生成耗时', ['result'])
+EMBEDDING_SECONDS = Histogram('comic_embedding_seconds', 'embedding 请求耗时')
+CHROMA_WRITE_SECONDS = Histogram('comic_chroma_write_seconds', '向量库写入耗时')
+CHROMA_QUERY_SECONDS = Histogram('comic_chroma_query_seconds', '向量库查询耗时')
+SEARCH_SECONDS = Histogram('comic_search_seconds', 'search_comics 端到端耗时')
+SEARCH_CACHE = Counter('comic_search_cache_total', '搜索结果缓存查找次数（result: hit/miss/stale）', ['result'])
+SEARCH_CACHE_HIT_RATIO = Gauge('comic_search_cache_hit_ratio', '进程启动以来搜索结果缓存的命中率')
+SEARCH_CACHE_ENTRIES = Gauge('comic_search_cache_entries', '搜索结果缓存当前条目数')
+IMAGE_SEARCH_SECONDS = Histogram('comic_image_search_seconds', '以图搜图耗时（含截图解码）')
+SUGGEST_SECONDS = Histogram('comic_suggest_seconds', '搜索建议前缀查询耗时', buckets=FAST_BUCKETS)
+SUGGEST_TERMS = Gauge('comic_suggest_terms', '搜索建议索引中的词条数')
+REINDEX_CHAPTERS = Counter('comic_reindex_chapters_total', '重建向量索引时重新生成 embedding 的章节数')
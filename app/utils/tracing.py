@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .logger import LOG_DIR
+
+# 任务级时间线追踪：记录任务、章节、页面分析、摘要、embedding、向量库写入等阶段的起止时间和线程，
+# 导出为 Chrome / Perfetto 可直接打开的 Trace Event JSON（chrome://tracing 或 ui.perfetto.dev）。
+# 关闭时 span() 只做一次布尔判断；开关按进程生效，独立 worker 进程用 TRACE_ENABLED 开启。
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'False').lower() == 'true'
+TRACE_DIR = os.path.join(LOG_DIR, 'traces')
+# 内存中保留追踪数据的任务数，以及单个任务最多记录的事件数（超出后丢弃新事件）
+TRACE_MAX_TASKS = int(os.getenv('TRACE_MAX_TASKS', 20))
+TRACE_MAX_EVENTS = int(os.getenv('TRACE_MAX_EVENTS', 200000))
+
+_enabled = TRACE_ENABLED
+_traces = OrderedDict()  # task_id -> {'events': [...], 'threads': {tid: 线程名}, 'dropped': n}
+_lock = threading.Lock()
+_local = threading.local()
+
+def is_enabled():
+    return _enabled
+
+def set_enabled(enabled):
+    """运行时开启或关闭追踪，已记录的数据保留。"""
+    global _enabled
+    _enabled = bool(enabled)
+
+@contextmanager
+def task_context(task_id):
+    """把当前线程绑定到任务，其中未显式传入 task_id 的 span 记到该任务下。"""
+    previous = getattr(_local, 'task_id', None)
+    _local.task_id = task_id
+    try:
+        yield
+    finally:
+        _local.task_id = previous
+
+def _trace_for(task_id):
+    trace = _traces.get(task_id)
+    if trace is None:
+        trace = _traces[task_id] = {'events': [], 'threads': {}, 'dropped': 0}
+        while len(_traces) > TRACE_MAX_TASKS:
+            _traces.popitem(last=False)
+    return trace
+
+def record_span(task_id, name, cat, start_ns, duration_ns, args=None):
+    """记录一个已结束的阶段，时间为 time.perf_counter_ns() 读数。"""
+    thread = threading.current_thread()
+    tid = thread.native_id
+    with _lock:
+        trace = _trace_for(task_id)
+        if len(trace['events']) >= TRACE_MAX_EVENTS:
+            trace['dropped'] += 1
+            return
+        trace['threads'][tid] = thread.name
+        trace['events'].append((name, cat, start_ns // 1000, max(1, duration_ns // 1000), tid, args))
+
+@contextmanager
+def span(name, cat='task', task_id=None, **args):
+    """记录 with 块的耗时。未开启追踪或当前线程没有绑定任务时不做任何事。"""
+    if not _enabled:
+        yield
+        return
+    task_id = task_id or getattr(_local, 'task_id', None)
+    if task_id is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record_span(task_id, name, cat, start, time.perf_counter_ns() - start, args or None)
+
+def trace_path(task_id):
+    safe_name = re.sub(r'[^\w.-]', '_', task_id)
+    return os.path.join(TRACE_DIR, f"{safe_name}.json")
+
+def _to_chrome(trace):
+    pid = os.getpid()
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': f'comic-worker {pid}'}}]
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+               for tid, name in trace['threads'].items()]
+    for name, cat, ts, dur, tid, args in sorted(trace['events'], key=lambda event: event[2]):
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': ts, 'dur': dur, 'pid': pid, 'tid': tid}
+        if args:
+            event['args'] = args
+        events.append(event)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'dropped_events': trace['dropped']}}
+
+def finish_task(task_id):
+    """任务结束时把追踪写入 logs/traces/，其他进程（如 Web 进程）也能下载。"""
+    with _lock:
+        trace = _traces.get(task_id)
+        if not trace or not trace['events']:
+            return
+        data = _to_chrome(trace)
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = trace_path(task_id)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+def export_trace(task_id):
+    """返回任务的 Chrome Trace JSON 对象；进行中的任务返回当前已记录的部分，没有记录时返回 None。"""
+    with _lock:
+        trace = _traces.get(task_id)
+        if trace and trace['events']:
+            return _to_chrome(trace)
+    try:
+        with open(trace_path(task_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
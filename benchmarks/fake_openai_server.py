@@ -0,0 +1,213 @@
+"""本地 OpenAI 兼容桩服务，用于离线压测（不产生真实 API 费用）。
+
+支持：
+  POST /v1/chat/completions  流式（SSE）或非流式返回
+  POST /v1/embeddings        返回由输入文本确定性生成的归一化向量
+
+可配置首 token 延迟、输出速率、输出长度以及错误 / 429 注入比例。
+
+用法：
+  python benchmarks/fake_openai_server.py --port 8900 --ttft 0.5 --token-rate 40 --tokens 120
+"""
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ['少年', '剑士', '城市', '夜晚', '战斗', '对话', '回忆', '海边', '魔法', '朋友', '背叛', '追逐', '微笑', '雨', '列车', '学校']
+
+class FakeOpenAIConfig:
+    def __init__(self, ttft=0.2, token_rate=50.0, tokens=80, embedding_dim=1536, embedding_latency=0.05,
+                 error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.embedding_dim = embedding_dim
+        self.embedding_latency = embedding_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'chat_requests': 0, 'embedding_requests': 0, 'injected_errors': 0, 'injected_429': 0}
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+def fake_embedding(text, dim):
+    """由文本确定性生成单位向量，相同文本得到相同向量。"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+def _make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _inject_failure(self):
+            """按配置随机返回 429 或 500，返回 True 表示已处理。"""
+            roll = config.roll()
+            if roll < config.rate_limit_rate:
+                config.count('injected_429')
+                self._send_json(429, {'error': {'message': 'Rate limit reached (injected)', 'type': 'rate_limit_error'}})
+                return True
+            if roll < config.rate_limit_rate + config.error_rate:
+                config.count('injected_errors')
+                self._send_json(500, {'error': {'message': 'Internal error (injected)', 'type': 'server_error'}})
+                return True
+            return False
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send_json(400, {'error': {'message': 'invalid json', 'type': 'invalid_request_error'}})
+                return
+            path = self.path.rstrip('/')
+            if path.endswith('/chat/completions'):
+                config.count('chat_requests')
+                if not self._inject_failure():
+                    self._chat(request)
+            elif path.endswith('/embeddings'):
+                config.count('embedding_requests')
+                if not self._inject_failure():
+                    self._embeddings(request)
+            else:
+                self._send_json(404, {'error': {'message': f'unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/stats':
+                with config.lock:
+                    self._send_json(200, dict(config.stats))
+            else:
+                self._send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+        def _tokens(self, pages=1):
+            """生成回复 token；多图请求按【第N页】格式逐页输出。"""
+            rng = random.Random(config.roll())
+            tokens = []
+            for page in range(1, pages + 1):
+                if pages > 1:
+                    tokens.append(f"【第{page}页】\n")
+                tokens.extend(rng.choice(WORDS) + ('\n' if i % 12 == 11 else ' ') for i in range(config.tokens))
+            return tokens
+
+        @staticmethod
+        def _count_images(request):
+            count = 0
+            for message in request.get('messages', []):
+                content = message.get('content')
+                if isinstance(content, list):
+                    count += sum(1 for part in content if isinstance(part, dict) and part.get('type') == 'image_url')
+            return count
+
+        def _chat(self, request):
+            model = request.get('model', 'fake-model')
+            created = int(time.time())
+            completion_id = f"chatcmpl-fake-{time.time_ns()}"
+            tokens = self._tokens(max(1, self._count_images(request)))
+            time.sleep(config.ttft)
+
+            if not request.get('stream'):
+                time.sleep(len(tokens) / config.token_rate if config.token_rate > 0 else 0)
+                self._send_json(200, {
+                    'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': 10, 'completion_tokens': len(tokens), 'total_tokens': 10 + len(tokens)},
+                })
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            interval = 1.0 / config.token_rate if config.token_rate > 0 else 0
+            try:
+                for i, token in enumerate(tokens):
+                    chunk = {
+                        'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                        'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': token} if i == 0 else {'content': token}, 'finish_reason': None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    if interval:
+                        time.sleep(interval)
+                final = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                }
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def _embeddings(self, request):
+            inputs = request.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(config.embedding_latency)
+            data = [{'object': 'embedding', 'index': i, 'embedding': fake_embedding(str(text), config.embedding_dim)}
+                    for i, text in enumerate(inputs)]
+            tokens = sum(len(str(text)) for text in inputs)
+            self._send_json(200, {'object': 'list', 'data': data, 'model': request.get('model', 'fake-embedding'),
+                                  'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+    return Handler
+
+def start_server(config, host='127.0.0.1', port=0):
+    """在后台线程启动桩服务，返回 (server, base_url)。"""
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-openai').start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容桩服务（流式对话 + embedding）。')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--ttft', type=float, default=0.2, help='首个 token 前的延迟（秒）')
+    parser.add_argument('--token-rate', type=float, default=50.0, help='每秒输出的 token 数')
+    parser.add_argument('--tokens', type=int, default=80, help='每次回复的 token 数')
+    parser.add_argument('--embedding-dim', type=int, default=1536)
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='embedding 请求延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回 429 的比例')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+def config_from_args(args):
+    return FakeOpenAIConfig(ttft=args.ttft, token_rate=args.token_rate, tokens=args.tokens,
+                            embedding_dim=args.embedding_dim, embedding_latency=args.embedding_latency,
+                            error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(config_from_args(args)))
+    server.daemon_threads = True
+    print(f"Fake OpenAI server listening on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,62 @@
+"""生成用于压测的合成漫画 ZIP。
+
+每个 ZIP 含一个顶层目录（即漫画名）、一张封面以及若干章节目录，每章若干页 PNG/JPEG。
+
+用法：
+  python benchmarks/make_synthetic_comics.py --out ./bench_data --comics 2 --chapters 3 --pages 20
+"""
+import os
+import io
+import random
+import zipfile
+import argparse
+from PIL import Image, ImageDraw
+
+def _render_page(width, height, label, rng, fmt):
+    """生成一页带噪声块和文字的图片，返回编码后的字节。"""
+    img = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(20, width // 2)), min(height, y0 + rng.randrange(20, height // 2))
+        draw.rectangle([x0, y0, x1, y1], outline=(0, 0, 0), fill=tuple(rng.randrange(256) for _ in range(3)))
+    draw.text((10, 10), label, fill=(0, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG' if fmt == 'jpg' else 'PNG', quality=85)
+    return buf.getvalue()
+
+def make_comic_zip(path, comic_name, chapters, pages, width=800, height=1200, fmt='jpg', seed=0):
+    """写出一个合成漫画 ZIP，返回页面总数。"""
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr(f"{comic_name}/cover.{fmt}", _render_page(width, height, f"{comic_name} cover", rng, fmt))
+        for c in range(1, chapters + 1):
+            for p in range(1, pages + 1):
+                label = f"{comic_name} ch{c} p{p}"
+                zf.writestr(f"{comic_name}/第{c}话/{p:03d}.{fmt}", _render_page(width, height, label, rng, fmt))
+    return chapters * pages
+
+def generate(out_dir, comics, chapters, pages, width=800, height=1200, fmt='jpg', seed=0):
+    """批量生成合成漫画，返回 [(zip 路径, 漫画名, 页数)]。"""
+    os.makedirs(out_dir, exist_ok=True)
+    generated = []
+    for i in range(comics):
+        comic_name = f"bench_comic_{i + 1}"
+        path = os.path.join(out_dir, f"{comic_name}.zip")
+        total = make_comic_zip(path, comic_name, chapters, pages, width, height, fmt, seed + i)
+        generated.append((path, comic_name, total))
+    return generated
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成合成漫画 ZIP 用于压测。')
+    parser.add_argument('--out', default='./bench_data')
+    parser.add_argument('--comics', type=int, default=1)
+    parser.add_argument('--chapters', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=20, help='每章页数')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=1200)
+    parser.add_argument('--format', choices=['jpg', 'png'], default='jpg')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for path, name, total in generate(args.out, args.comics, args.chapters, args.pages, args.width, args.height, args.format, args.seed):
+        print(f"{path}: {name}, {total} 页")
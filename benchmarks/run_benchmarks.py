@@ -0,0 +1,252 @@
+"""离线压测：使用本地 OpenAI 桩服务测量导入流水线和搜索的吞吐与延迟。
+
+场景：
+  ingest  通过真实任务队列运行 _process_zip_file，报告 pages/sec、任务端到端延迟和峰值 RSS
+  search  并发调用 search_comics，报告 QPS 以及 p50/p99 延迟
+
+结果写入 JSON，可用 --compare 与旧版本的结果对比。
+
+用法：
+  python benchmarks/run_benchmarks.py --comics 2 --chapters 3 --pages 10 --output bench.json
+  python benchmarks/run_benchmarks.py --scenarios search --queries 500 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import shutil
+import resource
+import argparse
+import tempfile
+import platform
+import subprocess
+import concurrent.futures
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from make_synthetic_comics import generate
+from fake_openai_server import WORDS
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _start_fake_server(args):
+    """以子进程方式启动桩服务，避免其内存和 CPU 计入被测进程。"""
+    port = _free_port()
+    cmd = [sys.executable, os.path.join(BENCH_DIR, 'fake_openai_server.py'), '--port', str(port),
+           '--ttft', str(args.ttft), '--token-rate', str(args.token_rate), '--tokens', str(args.tokens),
+           '--embedding-dim', str(args.embedding_dim), '--embedding-latency', str(args.embedding_latency),
+           '--error-rate', str(args.error_rate), '--rate-limit-rate', str(args.rate_limit_rate), '--seed', str(args.seed)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return proc, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('桩服务启动超时')
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def _peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', '-C', REPO_ROOT, 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def run_ingest(args, workdir):
+    """场景一：生成合成漫画并通过任务队列完整处理。"""
+    from app.processing import process_comic
+    from app.tasks import start_worker_threads, get_all_statuses, FINAL_STATUSES
+
+    upload_dir = os.path.join(workdir, 'uploads')
+    comics = generate(upload_dir, args.comics, args.chapters, args.pages, args.width, args.height, seed=args.seed)
+    total_pages = sum(pages for _, _, pages in comics)
+
+    start_worker_threads(args.workers)
+    start = time.perf_counter()
+    for path, name, _ in comics:
+        process_comic(path, name)
+
+    while True:
+        statuses = get_all_statuses()
+        if len(statuses) >= len(comics) and all(s['status'] in FINAL_STATUSES for s in statuses):
+            break
+        time.sleep(0.2)
+    wall = time.perf_counter() - start
+
+    latencies = [s['end_time'] - s['start_time'] for s in statuses if s.get('end_time')]
+    return {
+        'comics': len(comics),
+        'pages': total_pages,
+        'failed_tasks': sum(1 for s in statuses if s['status'] == '失败'),
+        'wall_seconds': wall,
+        'pages_per_second': total_pages / wall if wall else None,
+        'task_latency_seconds': {'mean': sum(latencies) / len(latencies) if latencies else None,
+                                 'p50': _percentile(latencies, 50), 'max': max(latencies) if latencies else None},
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def run_search(args):
+    """场景二：并发执行语义搜索。"""
+    from app.models import search_comics
+    from app.services.chroma_service import add_embedding
+
+    rng = random.Random(args.seed)
+    # 可选：注入额外的随机章节向量，以模拟更大的库
+    for i in range(args.extra_vectors):
+        vector = [rng.gauss(0, 1) for _ in range(args.embedding_dim)]
+        add_embedding(f"synthetic{i // 50}", f"第{i % 50 + 1}话", 'synthetic', vector)
+
+    queries = [' '.join(rng.sample(WORDS, 3)) for _ in range(args.queries)]
+    for query in queries[:min(5, len(queries))]:
+        search_comics(query, k=args.k)  # 预热
+
+    latencies = []
+    def timed(query):
+        t0 = time.perf_counter()
+        search_comics(query, k=args.k)
+        return time.perf_counter() - t0
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.search_concurrency) as executor:
+        for latency in executor.map(timed, queries):
+            latencies.append(latency)
+    wall = time.perf_counter() - start
+
+    return {
+        'queries': len(queries),
+        'concurrency': args.search_concurrency,
+        'k': args.k,
+        'wall_seconds': wall,
+        'qps': len(queries) / wall if wall else None,
+        'latency_seconds': {'p50': _percentile(latencies, 50), 'p90': _percentile(latencies, 90),
+                            'p99': _percentile(latencies, 99), 'max': max(latencies) if latencies else None},
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+COMPARE_KEYS = [
+    ('ingest', 'pages_per_second', True),
+    ('ingest', 'task_latency_seconds.mean', False),
+    ('ingest', 'peak_rss_mb', False),
+    ('search', 'qps', True),
+    ('search', 'latency_seconds.p50', False),
+    ('search', 'latency_seconds.p99', False),
+]
+
+def _lookup(result, scenario, dotted):
+    value = result.get(scenario)
+    for part in dotted.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def compare_results(old, new):
+    """打印两次压测结果中关键指标的变化。"""
+    print(f"\n对比基准: {old.get('meta', {}).get('git_commit')} -> {new.get('meta', {}).get('git_commit')}")
+    for scenario, key, higher_is_better in COMPARE_KEYS:
+        before, after = _lookup(old, scenario, key), _lookup(new, scenario, key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = (change >= 0) == higher_is_better
+        print(f"  {scenario}.{key}: {before:.4f} -> {after:.4f} ({change:+.1f}%{'' if better or change == 0 else ' 回退'})")
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='离线压测导入流水线和搜索。')
+    parser.add_argument('--scenarios', default='ingest,search', help='逗号分隔：ingest,search')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='与之对比的旧结果 JSON')
+    parser.add_argument('--workdir', default=None, help='工作目录（默认临时目录，结束后删除）')
+    parser.add_argument('--seed', type=int, default=0)
+    # 合成数据
+    parser.add_argument('--comics', type=int, default=1)
+    parser.add_argument('--chapters', type=int, default=2)
+    parser.add_argument('--pages', type=int, default=10, help='每章页数')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=1200)
+    # 流水线并发
+    parser.add_argument('--workers', type=int, default=2, help='任务工作线程数 (MAX_WORKERS)')
+    parser.add_argument('--concurrent-requests', type=int, default=8, help='每个任务的视觉并发数 (MAX_CONCURRENT_REQUESTS)')
+    # 桩服务行为
+    parser.add_argument('--ttft', type=float, default=0.2)
+    parser.add_argument('--token-rate', type=float, default=100.0)
+    parser.add_argument('--tokens', type=int, default=60)
+    parser.add_argument('--embedding-dim', type=int, default=256)
+    parser.add_argument('--embedding-latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    # 搜索
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--search-concurrency', type=int, default=4)
+    parser.add_argument('--k', type=int, default=1000)
+    parser.add_argument('--extra-vectors', type=int, default=0, help='搜索前额外写入的随机章节向量数')
+    return parser
+
+def main():
+    args = build_arg_parser().parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    output_path = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='comic-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    server_proc, base_url = _start_fake_server(args)
+    try:
+        # 应用模块在导入时读取环境变量和相对路径，因此先切换目录并设置环境
+        os.chdir(workdir)
+        os.environ.update({
+            'OPENAI_API_KEY': 'bench', 'OPENAI_API_BASE': base_url,
+            'DATA_BASE_PATH': './data/comicdb', 'TEMP_FOLDER': './tmp',
+            'MAX_WORKERS': str(args.workers), 'MAX_CONCURRENT_REQUESTS': str(args.concurrent_requests),
+            'TASK_BACKEND': 'memory', 'LOCAL_WORKERS': '0',
+        })
+
+        results = {
+            'meta': {'git_commit': _git_commit(), 'timestamp': time.time(), 'python': platform.python_version(),
+                     'platform': platform.platform()},
+            'config': vars(args),
+        }
+        if 'ingest' in scenarios:
+            results['ingest'] = run_ingest(args, workdir)
+            print(f"ingest: {json.dumps(results['ingest'], ensure_ascii=False)}")
+        if 'search' in scenarios:
+            results['search'] = run_search(args)
+            print(f"search: {json.dumps(results['search'], ensure_ascii=False)}")
+    finally:
+        server_proc.terminate()
+        server_proc.wait(timeout=5)
+        os.chdir(REPO_ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    print(f"结果已写入 {output_path}")
+
+    if compare_path:
+        with open(compare_path, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), results)
+
+if __name__ == '__main__':
+    main()
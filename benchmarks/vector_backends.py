@@ -0,0 +1,110 @@
+"""对比向量库后端的召回率与查询延迟：Chroma (HNSW) 与 NumPy memmap (float16 / int8)。
+
+以 float32 精确检索结果为基准，计算 recall@k；合成向量按簇生成，以接近真实摘要向量的分布。
+每个后端在独立的临时目录中构建，结束后删除。
+
+用法：
+  python benchmarks/vector_backends.py --vectors 20000 --dim 1536 --queries 200 --k 10
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+def _percentile(values, pct):
+    return float(np.percentile(values, pct)) if len(values) else None
+
+def _dir_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / (1024 * 1024)
+
+def make_dataset(count, dim, queries, clusters, seed):
+    """按簇生成单位向量，查询为库中向量加噪声。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=count)] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picks = rng.integers(0, count, size=queries)
+    query_vectors = vectors[picks] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32) / np.sqrt(dim)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, query_vectors
+
+def exact_top_k(vectors, query_vectors, k):
+    distances = (vectors ** 2).sum(1)[None, :] - 2.0 * query_vectors @ vectors.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+def open_backend(name, path):
+    if name == 'chroma':
+        import chromadb
+        return chromadb.PersistentClient(path=path).get_or_create_collection(name='bench_chapters')
+    from app.services.vector_store import NumpyVectorStore
+    return NumpyVectorStore(path, dtype=name.split('-', 1)[1])
+
+def run_backend(name, vectors, query_vectors, truth, k, batch_size):
+    workdir = tempfile.mkdtemp(prefix=f'vec-{name}-')
+    try:
+        store = open_backend(name, workdir)
+        ids = [f"c{i // 50}_{i % 50}" for i in range(len(vectors))]
+        start = time.perf_counter()
+        for offset in range(0, len(vectors), batch_size):
+            batch = slice(offset, offset + batch_size)
+            store.upsert(ids=ids[batch], embeddings=vectors[batch],
+                         metadatas=[{'comic_hash': idx.split('_')[0], 'chapter': idx} for idx in ids[batch]],
+                         documents=[''] * len(ids[batch]))
+        insert_seconds = time.perf_counter() - start
+
+        store.query(query_embeddings=[query_vectors[0]], n_results=k)  # 预热
+        latencies, hits = [], 0
+        for query, expected in zip(query_vectors, truth):
+            t0 = time.perf_counter()
+            result = store.query(query_embeddings=[query], n_results=k)
+            latencies.append(time.perf_counter() - t0)
+            found = {int(idx.split('_')[0][1:]) * 50 + int(idx.split('_')[1]) for idx in result['ids'][0]}
+            hits += len(found & set(expected.tolist()))
+
+        return {
+            'insert_seconds': insert_seconds,
+            'recall_at_k': hits / (len(query_vectors) * k),
+            'latency_seconds': {'p50': _percentile(latencies, 50), 'p99': _percentile(latencies, 99), 'max': max(latencies)},
+            'disk_mb': _dir_size_mb(workdir),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='对比向量库后端的召回率与延迟。')
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--backends', default='chroma,numpy-float16,numpy-int8')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='结果 JSON 输出路径')
+    args = parser.parse_args()
+
+    vectors, query_vectors = make_dataset(args.vectors, args.dim, args.queries, args.clusters, args.seed)
+    truth = exact_top_k(vectors, query_vectors, args.k)
+    results = {'config': vars(args)}
+    for name in [b.strip() for b in args.backends.split(',') if b.strip()]:
+        results[name] = run_backend(name, vectors, query_vectors, truth, args.k, args.batch_size)
+        print(f"{name}: {json.dumps(results[name], ensure_ascii=False)}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"结果已写入 {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+# 必须在导入 app 模块之前加载环境变量，并发和任务后端等配置在导入时读取
+load_dotenv()
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='批量导入漫画库（ZIP/CBZ、tar、CBR 及已解压目录），无需启动 Web 服务。')
+    parser.add_argument('paths', nargs='+', help='要导入的目录或归档文件')
+    parser.add_argument('--workers', type=int, default=None, help='本进程的任务工作线程数（默认 MAX_WORKERS）；0 表示只入队，交给独立 worker 处理')
+    parser.add_argument('--concurrent-requests', type=int, default=None, help='每个任务的视觉模型并发数（MAX_CONCURRENT_REQUESTS）')
+    parser.add_argument('--scan-threads', type=int, default=8, help='并行扫描与计算哈希的线程数')
+    parser.add_argument('--rescan', action='store_true', help='忽略扫描缓存，重新计算所有来源的哈希')
+    parser.add_argument('--force', action='store_true', help='即使内容已入库也重新导入')
+    parser.add_argument('--dry-run', action='store_true', help='只扫描并列出将要导入的来源')
+    parser.add_argument('--no-wait', action='store_true', help='入队后立即退出（需 TASK_BACKEND=sqlite 并运行独立 worker）')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='进度输出间隔（秒）')
+    parser.add_argument('--verbose', action='store_true', help='在控制台输出 INFO 级别日志')
+    return parser
+
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+
+    if args.concurrent_requests is not None:
+        os.environ['MAX_CONCURRENT_REQUESTS'] = str(args.concurrent_requests)
+    os.environ['LOG_CONSOLE_LEVEL'] = 'INFO' if args.verbose else 'WARNING'
+    shared_queue = os.getenv('TASK_BACKEND', 'memory').lower() == 'sqlite'
+    if (args.no_wait or args.workers == 0) and not shared_queue:
+        print("只入队模式需要在 .env 中设置 TASK_BACKEND=sqlite，并另外运行 worker.py。")
+        sys.exit(1)
+
+    from app.tasks import start_worker_threads, MAX_WORKERS
+    from app.core.bulk_import import scan_sources, enqueue_sources, wait_for_tasks
+
+    sources = scan_sources(args.paths, scan_threads=args.scan_threads, use_cache=not args.rescan,
+                           progress_callback=lambda n, total: print(f"\r[扫描] {n}/{total}", end='', flush=True))
+    print(f"\n[扫描] 共找到 {len(sources)} 个来源。")
+
+    if args.dry_run:
+        for path, name, content_hash in sources:
+            print(f"  {name}  {content_hash[:12]}  {path}")
+        sys.exit(0)
+
+    if not args.no_wait:
+        start_worker_threads(MAX_WORKERS if args.workers is None else args.workers)
+    task_ids, skipped = enqueue_sources(sources, force=args.force)
+    print(f"[导入] 已入队 {len(task_ids)} 个，跳过已入库 {skipped} 个。")
+    if not task_ids or args.no_wait:
+        sys.exit(0)
+
+    done, failed = wait_for_tasks(task_ids, interval=args.progress_interval)
+    print(f"[导入] 结束：成功 {done}，失败 {failed}。")
+    sys.exit(1 if failed else 0)
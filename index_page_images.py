@@ -0,0 +1,37 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.phash_service import index_chapter_images, indexed_image_chapters
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='为已入库章节的页面建立以图搜图索引（新入库的章节会自动建立）。')
+    parser.add_argument('comics', nargs='*', help='要处理的漫画哈希，省略时处理整个库')
+    parser.add_argument('--rebuild', action='store_true', help='重新计算已有索引的章节（例如修改 IMAGE_SEARCH_REGIONS 之后）')
+    args = parser.parse_args()
+
+    comics = args.comics or sorted(d for d in os.listdir(DATA_BASE_PATH) if os.path.exists(os.path.join(DATA_BASE_PATH, d, 'info.json')))
+    indexed = set() if args.rebuild else indexed_image_chapters()
+    chapters = pages = 0
+    for comic_hash in comics:
+        pic_path = os.path.join(DATA_BASE_PATH, comic_hash, 'pic')
+        if not os.path.isdir(pic_path):
+            continue
+        for chapter_name in sorted(os.listdir(pic_path)):
+            if not os.path.isdir(os.path.join(pic_path, chapter_name)) or (comic_hash, chapter_name) in indexed:
+                continue
+            count = index_chapter_images(comic_hash, chapter_name)
+            if count:
+                chapters += 1
+                pages += count
+                print(f"  {comic_hash}  {chapter_name}  {count} 页")
+    print(f"已为 {chapters} 个章节建立以图搜图索引，共 {pages} 页。")
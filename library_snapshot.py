@@ -0,0 +1,45 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.core.snapshot import export_snapshot, import_snapshot, load_snapshot_state
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='导出或导入库快照（漫画信息、摘要、页面描述和向量），用于复制只读搜索节点。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出快照（导出期间向量写入会等待）')
+    export_parser.add_argument('path', help='输出的归档路径，如 snapshot.tar.gz')
+    export_parser.add_argument('--since', help='基准快照（归档或其 .manifest.json），只导出之后的变化')
+    export_parser.add_argument('--compression', default='gz', choices=['gz', 'xz', 'none'])
+
+    import_parser = subparsers.add_parser('import', help='导入完整或增量快照')
+    import_parser.add_argument('path', help='快照归档路径')
+    import_parser.add_argument('--force', action='store_true', help='允许用完整快照替换非空的库')
+
+    subparsers.add_parser('status', help='显示本库最近导入的快照')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        state = load_snapshot_state()
+        print(f"最近导入的快照: {state['snapshot_id']}" if state else "本库未导入过快照。")
+        sys.exit(0)
+
+    try:
+        if args.command == 'export':
+            manifest = export_snapshot(args.path, since=args.since, compression=args.compression)
+            print(f"已导出快照 {manifest['snapshot_id']} 到 {args.path}：{len(manifest['members']) - 2} 个文件、"
+                  f"{manifest['written_vectors']} 条向量。下次增量导出可使用 --since {args.path}")
+        else:
+            manifest = import_snapshot(args.path, force=args.force)
+            print(f"已导入快照 {manifest['snapshot_id']}（{'增量' if manifest['base'] else '完整'}）。")
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
@@ -0,0 +1,33 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.chroma_service import open_vector_store, copy_vectors, refresh_all_metadata, collection_info
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在向量库后端之间复制章节向量（切换 VECTOR_BACKEND 前运行）。')
+    parser.add_argument('--from', dest='source', default='chroma', choices=['chroma', 'numpy'])
+    parser.add_argument('--to', dest='target', default='numpy', choices=['chroma', 'numpy'])
+    parser.add_argument('--refresh-metadata', action='store_true',
+                        help='不复制，只为当前后端的全部章节向量重写过滤用元数据（章节号、入库时间、标签）')
+    args = parser.parse_args()
+
+    if args.refresh_metadata:
+        comics, entries = refresh_all_metadata()
+        print(f"已为 {comics} 部漫画的 {entries} 条章节向量重写元数据。")
+        sys.exit(0)
+
+    if args.source == args.target:
+        print("源后端与目标后端相同，无需复制。")
+        sys.exit(1)
+
+    name = collection_info('active')[0]
+    copied = copy_vectors(open_vector_store(args.source, name), open_vector_store(args.target, name))
+    print(f"已从 {args.source} 复制 {copied} 条章节向量到 {args.target}。请在 .env 中设置 VECTOR_BACKEND={args.target}。")
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.page_store import pack_chapter, unpack_chapter
+from app.services.description_store import migrate_chapter
+
+DATA_BASE_PATH = os.getenv('DATA_BASE_PATH', './data/comicdb')
+
+def _manifest(comic_path, chapter_name):
+    try:
+        with open(os.path.join(comic_path, 'pic_detail', chapter_name, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='把已入库章节的页面图片转换为每章一个 pages.pack（或用 --unpack 还原为散文件），或用 --descriptions 合并页面描述文件。')
+    parser.add_argument('comics', nargs='*', help='要转换的漫画哈希，省略时处理整个库')
+    parser.add_argument('--unpack', action='store_true', help='把打包章节还原为每页一个文件')
+    parser.add_argument('--descriptions', action='store_true',
+                        help='改为把 pic_detail 中每页一个的 .txt 描述合并为章节记录文件 pages.jsonl（按 DESCRIPTION_COMPRESSION 压缩）')
+    args = parser.parse_args()
+
+    comics = args.comics or sorted(d for d in os.listdir(DATA_BASE_PATH) if os.path.exists(os.path.join(DATA_BASE_PATH, d, 'info.json')))
+    chapters = pages = 0
+    for comic_hash in comics:
+        comic_path = os.path.join(DATA_BASE_PATH, comic_hash)
+        pic_path = os.path.join(comic_path, 'pic_detail' if args.descriptions else 'pic')
+        if not os.path.isdir(pic_path):
+            continue
+        for chapter_name in sorted(os.listdir(pic_path)):
+            chapter_dir = os.path.join(pic_path, chapter_name)
+            if not os.path.isdir(chapter_dir):
+                continue
+            if args.descriptions:
+                count = migrate_chapter(chapter_dir)
+            elif args.unpack:
+                count = unpack_chapter(chapter_dir)
+            else:
+                count = pack_chapter(chapter_dir, _manifest(comic_path, chapter_name))
+            if count:
+                chapters += 1
+                pages += count
+                print(f"  {comic_hash}  {chapter_name}  {count} 页")
+    if args.descriptions:
+        print(f"已合并 {chapters} 个章节的页面描述，共 {pages} 页。")
+    else:
+        action = '还原' if args.unpack else '打包'
+        print(f"已{action} {chapters} 个章节，共 {pages} 页。" + ('' if args.unpack else '新入库的章节请在 .env 中设置 PAGE_STORAGE=packed。'))
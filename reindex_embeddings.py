@@ -0,0 +1,42 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.chroma_service import collection_info, drop_retired
+from app.core.reindex import run_reindex, REINDEX_BATCH_SIZE, REINDEX_REQUESTS_PER_MINUTE, REINDEX_TOKENS_PER_MINUTE
+from app.services.openai_service import EMBEDDING_MODEL
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='用新的 embedding 模型从已保存的章节摘要重建向量集合，完成后切换搜索（可断点续跑）。')
+    parser.add_argument('--model', default=EMBEDDING_MODEL, help='目标 embedding 模型（默认 EMBEDDING_MODEL）')
+    parser.add_argument('--batch-size', type=int, default=REINDEX_BATCH_SIZE, help='每次 embedding 请求包含的章节数')
+    parser.add_argument('--rpm', type=int, default=REINDEX_REQUESTS_PER_MINUTE, help='每分钟请求数上限（0 为不限制）')
+    parser.add_argument('--tpm', type=int, default=REINDEX_TOKENS_PER_MINUTE, help='每分钟估算 token 数上限（0 为不限制）')
+    parser.add_argument('--status', action='store_true', help='只显示当前集合状态')
+    parser.add_argument('--drop-retired', action='store_true', help='删除上次切换后保留的旧集合')
+    args = parser.parse_args()
+
+    if args.status:
+        for role in ('active', 'building', 'retired'):
+            info = collection_info(role)
+            print(f"{role:9} {info[0]}  ({info[1]})" if info else f"{role:9} -")
+        sys.exit(0)
+
+    if args.drop_retired:
+        name = drop_retired()
+        print(f"已删除旧集合 {name}。" if name else "没有需要删除的旧集合。")
+        sys.exit(0)
+
+    name = run_reindex(model=args.model, batch_size=args.batch_size, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                       progress_callback=lambda n, total: print(f"\r[重建] {n}/{total}", end='', flush=True))
+    if name is None:
+        print("无需重建，或其他进程正在重建（见日志）。")
+        sys.exit(0)
+    print(f"\n[重建] 完成，搜索已切换到集合 {name}（模型 {args.model}）。")
@@ -0,0 +1,48 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+# 必须在导入 app 模块之前加载环境变量，摘要模型和并发等配置在导入时读取
+load_dotenv()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='用已保存的页面描述重新生成章节摘要和 embedding（不调用视觉模型），只处理提示词版本或摘要模型过期的章节。')
+    parser.add_argument('comics', nargs='*', help='要处理的漫画哈希，省略时处理整个库')
+    parser.add_argument('--force', action='store_true', help='忽略版本，重新摘要全部章节')
+    parser.add_argument('--workers', type=int, default=None, help='同时处理的漫画数（默认 MAX_WORKERS）')
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要重新摘要的章节')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='进度输出间隔（秒）')
+    args = parser.parse_args()
+
+    from app.tasks import start_worker_threads, MAX_WORKERS
+    from app.core.bulk_import import wait_for_tasks
+    from app.core.resummarize import find_stale_chapters, resummarize_comic, resummarize_library, DATA_BASE_PATH
+
+    if args.dry_run:
+        comics = args.comics or sorted(d for d in os.listdir(DATA_BASE_PATH) if os.path.exists(os.path.join(DATA_BASE_PATH, d, 'info.json')))
+        total = 0
+        for comic_hash in comics:
+            chapters = find_stale_chapters(comic_hash, force=args.force)
+            total += len(chapters)
+            for chapter_name in chapters:
+                print(f"  {comic_hash}  {chapter_name}")
+        print(f"[重新摘要] 共 {total} 个章节需要处理。")
+        sys.exit(0)
+
+    start_worker_threads(MAX_WORKERS if args.workers is None else args.workers)
+    if args.comics:
+        task_ids = [task_id for task_id in (resummarize_comic(comic_hash, force=args.force) for comic_hash in args.comics) if task_id]
+    else:
+        task_ids = resummarize_library(force=args.force)
+    print(f"[重新摘要] 已入队 {len(task_ids)} 部漫画。")
+    if not task_ids:
+        sys.exit(0)
+
+    done, failed = wait_for_tasks(task_ids, interval=args.progress_interval)
+    print(f"[重新摘要] 结束：成功 {done}，失败 {failed}。")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,35 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到 Python 路径中
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from dotenv import load_dotenv
+
+# 必须在导入 app 模块之前加载环境变量，任务后端等配置在导入时读取
+load_dotenv()
+
+from app.tasks import run_standalone_worker, MAX_WORKERS
+from app.utils.metrics import start_metrics_server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='独立运行的漫画处理 worker，从共享任务队列领取任务。')
+    parser.add_argument('--threads', type=int, default=MAX_WORKERS, help='本进程的工作线程数')
+    parser.add_argument('--metrics-port', type=int, default=None, help='在该端口暴露本进程的 Prometheus /metrics')
+    args = parser.parse_args()
+
+    if os.getenv('TASK_BACKEND', 'memory').lower() != 'sqlite':
+        print("请在 .env 中设置 TASK_BACKEND=sqlite 后再启动独立 worker。")
+        sys.exit(1)
+
+    # Chroma 本地持久化模式不支持多进程同时读写：Web 进程可能看不到新章节，并发写入还可能损坏集合
+    if os.getenv('VECTOR_BACKEND', 'chroma').lower() != 'numpy':
+        print("独立 worker 需要可多进程共享的向量库，请在 .env 中设置 VECTOR_BACKEND=numpy"
+              "（先运行 python migrate_vectors.py --from chroma --to numpy）。")
+        sys.exit(1)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    run_standalone_worker(args.threads)